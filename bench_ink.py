@@ -0,0 +1,267 @@
+# bench_ink.py — замеры скорости локального конвейера на синтетических сценариях.
+#
+#   python bench_ink.py lexer --mb 4
+#   python bench_ink.py session --mb 2 --rounds 10
+#   python bench_ink.py pipeline fixtures/gpt5_replay.json --latency-ms 300 --ms-per-token 2
+#   python bench_ink.py pipeline --stream --latency-ms 300 --ms-per-token 2
+#
+# lexer   — сравнивает однопроходную диспетчеризацию строк (ink_frontend.classify)
+#           с прежней цепочкой regex-проверок на многомегабайтном скрипте;
+# session — имитирует раунды правок GPT (одна-две строки за раунд) и сравнивает время
+#           валидации с нуля (validate_ink) и в долгоживущей InkSession;
+# pipeline — весь цикл ask_gpt_ink против локального стаба gpt5_stub на записанных ходах модели:
+#           раунды до зелёного, время API и локальных validate/compile/render по раундам, общее время;
+#           с --stream — ответы потоком (gpt5_stream) и время до первой ошибки в неудачных раундах.
+
+import argparse
+import json
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+import ink_frontend as fe
+import ink_to_json as ij
+import ink_validator as iv
+from ink_incremental import InkSession
+
+
+def make_script(target_bytes: int, seed: int = 1) -> str:
+    """Собрать синтетический сценарий примерно заданного размера (в основном реплики, как в жизни)."""
+    rnd = random.Random(seed)
+    words = ["Официант", "меню", "чай", "кофе", "пожалуйста", "спасибо", "сколько", "стоит",
+             "хорошо", "Вы", "хотите", "ещё", "счёт", "Variant", "Expect", "Leave", "десерт"]
+    out: List[str] = [
+        'VAR total = 0', 'VAR name = "гость"', 'EXTERNAL play(sound)', 'LIST sizes = small, medium, large', '',
+    ]
+    size = sum(len(x.encode("utf-8")) + 1 for x in out)
+    k = 0
+    while size < target_bytes:
+        knot = "start" if k == 0 else f"k{k}"
+        block = [f"=== {knot} ==="]
+        for s in range(rnd.randint(1, 4)):
+            block.append(f"== s{s} ==")
+            for _ in range(rnd.randint(2, 8)):
+                line = " ".join(rnd.choice(words) for _ in range(rnd.randint(4, 14)))
+                block.append(f"{rnd.choice(words)}: {line}" + (" <>" if rnd.random() < 0.05 else ""))
+            if rnd.random() < 0.3:
+                block.append("~ total = total + %d" % rnd.randint(1, 99))
+            if rnd.random() < 0.1:
+                block.append('~ play("ding")  // звук')
+            for c in range(rnd.randint(0, 3)):
+                block.append(f"{rnd.choice('+*')} Вариант {c} -> k{k + 1}.s0")
+            if rnd.random() < 0.3:
+                block.append(rnd.choice(["-> END", "-> s0", f"-> k{k + 1}"]))
+        block.append("")
+        size += sum(len(x.encode("utf-8")) + 1 for x in block)
+        out.extend(block)
+        k += 1
+    return "\n".join(out)
+
+
+def _legacy_classify(line: str):
+    """Прежний порядок проверок в parse_ink_to_json — до десяти regex на строку."""
+    for kind, rx in ((fe.T_VAR, fe.RE_VAR), (fe.T_LIST, fe.RE_LIST), (fe.T_EXTERNAL, fe.RE_EXTERNAL),
+                     (fe.T_KNOT, fe.RE_KNOT), (fe.T_STITCH, fe.RE_STITCH), (fe.T_CHOICE, fe.RE_CHOICE),
+                     (fe.T_DIVERT, fe.RE_DIVERT), (fe.T_SET, fe.RE_SET), (fe.T_CALL, fe.RE_CALL)):
+        m = rx.match(line)
+        if m:
+            return kind, m
+    return fe.T_TEXT, None
+
+
+def _time(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_lexer(mb: float, repeat: int) -> None:
+    text = make_script(int(mb * 1024 * 1024))
+    lines = [tok.text for tok in fe.iter_glued(fe.tokenize(text))]
+
+    # сначала убеждаемся, что классификация совпадает строка в строку
+    # (неверные заголовки парсер считает текстом, как и прежняя цепочка)
+    for line in lines:
+        a, b = _legacy_classify(line)[0], fe.classify(line)[0]
+        assert a == b or (a == fe.T_TEXT and b in (fe.T_BAD_KNOT, fe.T_BAD_STITCH)), (line, a, b)
+
+    n = len(lines)
+    t_old = _time(lambda: [_legacy_classify(l) for l in lines], repeat)
+    t_new = _time(lambda: [fe.classify(l) for l in lines], repeat)
+    t_parse = _time(lambda: ij.parse_ink_to_json(text), repeat)
+    t_val = _time(lambda: iv.validate_ink(text), repeat)
+    assert ij.validate_and_compile(text) == {"report": iv.validate_ink(text), "json": ij.parse_ink_to_json(text)}
+    t_sep = _time(lambda: (iv.validate_ink(text), ij.parse_ink_to_json(text)), repeat)
+    t_both = _time(lambda: ij.validate_and_compile(text), repeat)
+
+    print(f"script: {len(text.encode('utf-8')) / 1e6:.2f} MB, {n} значимых строк")
+    print(f"lexer  legacy chain : {n / t_old:>12,.0f} lines/s")
+    print(f"lexer  dispatch     : {n / t_new:>12,.0f} lines/s  (x{t_old / t_new:.2f})")
+    print(f"parse_ink_to_json   : {n / t_parse:>12,.0f} lines/s  ({t_parse * 1000:.0f} ms)")
+    print(f"validate_ink        : {n / t_val:>12,.0f} lines/s  ({t_val * 1000:.0f} ms)")
+    print(f"validate + parse    : {n / t_sep:>12,.0f} lines/s  ({t_sep * 1000:.0f} ms)")
+    print(f"validate_and_compile: {n / t_both:>12,.0f} lines/s  ({t_both * 1000:.0f} ms, x{t_sep / t_both:.2f})")
+
+
+def _edit_round(lines: List[str], rnd: random.Random) -> None:
+    """Правка, как в цикле исправлений: переписать одну-две реплики в случайных местах."""
+    for _ in range(rnd.randint(1, 2)):
+        while True:
+            i = rnd.randrange(len(lines))
+            if ":" in lines[i] and not lines[i].startswith(("=", "+", "*", "-", "~")):
+                break
+        speaker, _, text = lines[i].partition(":")
+        lines[i] = f"{speaker}: {text.strip()} ещё{rnd.randint(0, 999)}"
+
+
+def bench_session(mb: float, rounds: int, seed: int = 7) -> None:
+    rnd = random.Random(seed)
+    lines = make_script(int(mb * 1024 * 1024)).split("\n")
+    session = InkSession()
+
+    text = "\n".join(lines)
+    t0 = time.perf_counter()
+    session.validate(text)
+    print(f"script: {len(text.encode('utf-8')) / 1e6:.2f} MB, {len(lines)} строк; "
+          f"первый раунд в сессии {(time.perf_counter() - t0) * 1000:.0f} ms")
+    print(f"{'раунд':>5} {'validate_ink':>13} {'InkSession':>11} {'узлов':>7} {'строк':>6}")
+    full_total = inc_total = 0.0
+    for r in range(1, rounds + 1):
+        _edit_round(lines, rnd)
+        text = "\n".join(lines)
+        t0 = time.perf_counter()
+        expected = iv.validate_ink(text)
+        t_full = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        got = session.validate(text)
+        t_inc = time.perf_counter() - t0
+        assert got == expected, f"раунд {r}: отчёт сессии расходится с validate_ink"
+        full_total += t_full
+        inc_total += t_inc
+        st = session.last_stats
+        print(f"{r:>5} {t_full * 1000:>10.1f} ms {t_inc * 1000:>8.1f} ms "
+              f"{st['rechecked']:>7} {st['reclassified']:>6}")
+    print(f"в среднем: validate_ink {full_total / rounds * 1000:.1f} ms, "
+          f"InkSession {inc_total / rounds * 1000:.1f} ms (x{full_total / inc_total:.1f})")
+
+
+def _first_error_ms(b: Dict[str, Any]) -> List[float]:
+    """Время до первой ошибки в неудачных раундах брифа: обрыв потока или ответ + validate_ink."""
+    failed = b["rounds"][:-1] if b["status"] == "ok" else b["rounds"]
+    return [rd["first_error_ms"] if rd.get("aborted") else rd["api_ms"] + rd["validate_ms"]
+            for rd in failed if b["status"] != "no_tool"]
+
+
+def bench_pipeline(fixtures_path: str, repeat: int, latency_ms: float, ms_per_token: float,
+                   compact: bool, as_json: bool, stream: bool = False) -> None:
+    # openai нужен только этому режиму — остальные бенчмарки работают без него
+    from openai import OpenAI
+
+    import gpt5_ink as gi
+    from gpt5_cache import ResponseCache
+    from gpt5_stub import Fixtures, StubServer
+
+    gi.DEBUG = False
+    fixtures = Fixtures.load(fixtures_path)
+    corpus = fixtures.corpus()
+    cache = ResponseCache(mode="off")
+    runs: List[Dict[str, Any]] = []
+    with StubServer(fixtures, latency_ms=latency_ms, ms_per_token=ms_per_token) as srv:
+        client = OpenAI(api_key="stub", base_url=srv.base_url, max_retries=0)
+        for _ in range(repeat):
+            briefs = []
+            t0 = time.perf_counter()
+            for bid, brief in corpus:
+                stats: Dict[str, Any] = {}
+                t = time.perf_counter()
+                gi.ask_gpt_ink(brief, cache=cache, compact=compact, client=client, out_html=None, stats=stats,
+                               stream=stream)
+                briefs.append({"id": bid, **stats, "total_ms": (time.perf_counter() - t) * 1000})
+            runs.append({"wall_ms": (time.perf_counter() - t0) * 1000, "briefs": briefs})
+        calls, cancelled = srv.calls, srv.cancelled
+
+    # по раундам: среднее по брифам и повторам; локальное время = validate + compile + render
+    keys = ("api_ms", "validate_ms", "compile_ms", "render_ms")
+    per_round: Dict[int, List[Dict[str, Any]]] = {}
+    for run in runs:
+        for b in run["briefs"]:
+            for i, rd in enumerate(b["rounds"], 1):
+                per_round.setdefault(i, []).append(rd)
+    rounds = [{"round": i, "n": len(rows), **{k: statistics.mean(r[k] for r in rows) for k in keys},
+               # у оборванных потоков usage нет — они в среднее по токенам не входят
+               "prompt_tokens": statistics.mean([r["prompt"] for r in rows if not r.get("aborted")] or [0])}
+              for i, rows in sorted(per_round.items())]
+    last = runs[-1]["briefs"]
+    api = sum(rd["api_ms"] for b in last for rd in b["rounds"])
+    local = sum(rd[k] for b in last for rd in b["rounds"] for k in keys[1:])
+    walls = [run["wall_ms"] for run in runs]
+    # оборванные раунды — по статистике клиента; стаб видит разрыв, только если не успел дописать ответ
+    aborted = sum(bool(rd.get("aborted")) for run in runs for b in run["briefs"] for rd in b["rounds"])
+    first_errors = [ms for b in last for ms in _first_error_ms(b)]
+    summary = {
+        "briefs": len(corpus), "repeat": repeat, "compact": compact, "stream": stream,
+        "requests": calls, "aborted": aborted, "server_cancelled": cancelled,
+        "first_error_ms": statistics.mean(first_errors) if first_errors else None,
+        "green": sum(b["status"] == "ok" for b in last),
+        "rounds_to_green": {b["id"]: b["rounds_to_green"] for b in last},
+        "wall_ms": {"best": min(walls), "median": statistics.median(walls)},
+        "api_ms": api, "local_ms": local, "per_round": rounds,
+        "prompt_tokens": sum(rd["prompt"] for b in last for rd in b["rounds"]),
+    }
+    if as_json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+
+    print(f"брифов: {len(corpus)}, повторов: {repeat}, compact={compact}, stream={stream}, "
+          f"задержка {latency_ms:.0f} ms + {ms_per_token:g} ms/токен, запросов к стабу: {calls}"
+          f" (оборвано раундов: {aborted}, разрывов на стабе: {cancelled})")
+    print(f"{'бриф':<16} {'статус':>9} {'раундов':>7} {'API':>9} {'локально':>9} {'всего':>9}")
+    for b in last:
+        loc = sum(rd[k] for rd in b["rounds"] for k in keys[1:])
+        print(f"{b['id']:<16} {b['status']:>9} {b['rounds_to_green'] or '-':>7} "
+              f"{sum(rd['api_ms'] for rd in b['rounds']):>6.1f} ms {loc:>6.1f} ms {b['total_ms']:>6.1f} ms")
+    print(f"{'раунд':>5} {'n':>4} {'API':>9} {'validate':>9} {'compile':>9} {'render':>9} {'prompt tok':>10}")
+    for rd in rounds:
+        print(f"{rd['round']:>5} {rd['n']:>4} {rd['api_ms']:>6.1f} ms {rd['validate_ms']:>6.1f} ms "
+              f"{rd['compile_ms']:>6.1f} ms {rd['render_ms']:>6.1f} ms {rd['prompt_tokens']:>10.0f}")
+    print(f"весь корпус: лучший {min(walls):.0f} ms, медиана {statistics.median(walls):.0f} ms; "
+          f"API {api:.0f} ms, локально {local:.0f} ms ({local / max(api + local, 1e-9) * 100:.1f}%), "
+          f"prompt-токенов {summary['prompt_tokens']}")
+    if first_errors:
+        print(f"до первой ошибки в неудачном раунде: в среднем {summary['first_error_ms']:.0f} ms"
+              f" ({len(first_errors)} раундов)")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Бенчмарки ink_quiz")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("lexer", help="разбор строк парсером ink_to_json")
+    p.add_argument("--mb", type=float, default=4.0, help="размер синтетического скрипта, МБ")
+    p.add_argument("--repeat", type=int, default=3)
+    p = sub.add_parser("session", help="валидация по раундам правок: с нуля и в InkSession")
+    p.add_argument("--mb", type=float, default=2.0, help="размер синтетического скрипта, МБ")
+    p.add_argument("--rounds", type=int, default=10)
+    p = sub.add_parser("pipeline", help="цикл ask_gpt_ink на записанных ходах модели (gpt5_stub)")
+    p.add_argument("fixtures", nargs="?", default="fixtures/gpt5_replay.json")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--latency-ms", type=float, default=0.0, help="задержка стаба на запрос")
+    p.add_argument("--ms-per-token", type=float, default=0.0, help="задержка стаба на токен ответа")
+    p.add_argument("--no-compact", action="store_true", help="полная переписка вместо сжатой")
+    p.add_argument("--stream", action="store_true", help="потоковые ответы с ранней проверкой структуры")
+    p.add_argument("--json", action="store_true", help="сводка в JSON (для CI)")
+    args = ap.parse_args()
+    if args.cmd == "lexer":
+        bench_lexer(args.mb, args.repeat)
+    elif args.cmd == "session":
+        bench_session(args.mb, args.rounds)
+    elif args.cmd == "pipeline":
+        bench_pipeline(args.fixtures, args.repeat, args.latency_ms, args.ms_per_token,
+                       not args.no_compact, args.json, args.stream)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+# gpt5_batch.py — пакетная генерация Ink-сценариев: много циклов «генерация → validate_ink → правка» сразу.
+#
+# Брифы читаются из файла (JSON Lines {"id": ..., "brief": ...} или просто по брифу в строке).
+# Каждый бриф — тот же цикл, что gpt5_ink.ask_gpt_ink, но на AsyncOpenAI:
+#   - одновременных запросов к API не больше --concurrency (семафор);
+#   - частота запросов ограничена --rpm (ведро токенов, общее на весь пакет);
+#   - validate_ink и сборка JSON/HTML идут в пуле процессов и не блокируют цикл событий;
+#   - ответы модели кэшируются на диске (gpt5_cache): повтор пакета после локальной правки
+#     плеера или компилятора не тратит запросов; --cache replay — только из кэша, без сети;
+#   - в истории только последний скрипт и дельта ошибок (gpt5_ink.ReportDelta), токены — по раундам;
+#   - с --stream ответ читается потоком и обрывается на первой фатальной ошибке структуры (gpt5_stream).
+# Результат брифа пишется сразу по готовности: out/<id>.ink/.json/.html и строка в out/results.jsonl.
+#
+#   python gpt5_batch.py briefs.jsonl -o out/ --concurrency 8 --rpm 120 --workers 4
+#   python gpt5_batch.py briefs.txt -o out/ --base-url http://127.0.0.1:8765/v1   # локальный стаб
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import re
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from openai import AsyncOpenAI
+
+from gpt5_cache import ResponseCache
+from gpt5_ink import COMPACT, MODEL, OPENAI_API_KEY, STREAM, InkDialog, log, tool_validate_ink, usage_tokens
+from gpt5_stream import StreamWatcher, astream_create
+from ink_cache import _atomic_write
+from ink_to_json import parse_ink_to_json
+from json_to_html_player import build_html_player
+
+RESULTS = "results.jsonl"
+
+
+def read_briefs(path: str) -> Iterator[Tuple[str, str]]:
+    """(id, бриф) из файла: строка JSON {"id", "brief"} или просто текст брифа; пустые строки пропускаются."""
+    with open(path, encoding="utf-8") as f:
+        n = 0
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            n += 1
+            if line.startswith("{"):
+                rec = json.loads(line)
+                yield str(rec.get("id") or f"brief_{n:04d}"), rec["brief"]
+            else:
+                yield f"brief_{n:04d}", line
+
+
+class RateLimiter:
+    """Не больше rate запросов в секунду в среднем и не больше burst подряд (ведро токенов)."""
+    __slots__ = ("rate", "burst", "_tokens", "_t", "_lock")
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._t = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:  # очередь ждущих — честная, по порядку прихода
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._t) * self.rate)
+                self._t = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# ====== работа в пуле процессов ======
+def _validate_job(ink: str) -> Dict[str, Any]:
+    return tool_validate_ink(ink)
+
+
+def _compile_job(ink: str) -> Tuple[Dict[str, Any], str]:
+    data = parse_ink_to_json(ink)
+    return data, build_html_player(data)
+
+
+class BatchGenerator:
+    """Общие для пакета клиент, семафор, ограничитель частоты и пул валидации.
+
+    Если рабочий процесс пула умер, пул заменяется новым на workers процессов (self.pool; старый
+    закрывает владелец), а задание повторяется в отдельном процессе: упадёт снова — ошибка только
+    у его брифа.
+    """
+
+    def __init__(self, client: Optional[AsyncOpenAI], pool: Executor, concurrency: int = 8, rpm: float = 120,
+                 max_rounds: int = 8, model: str = MODEL, cache: Optional[ResponseCache] = None,
+                 compact: bool = COMPACT, stream: bool = STREAM, workers: Optional[int] = None):
+        self.client = client
+        self.cache = cache
+        self.compact = compact
+        self.stream = stream
+        self.pool = pool
+        self.workers = workers
+        self.sem = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(rpm / 60.0)
+        self.max_rounds = max_rounds
+        self.model = model
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            return await loop.run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            pass
+        # пул сломан целиком, у всех его заданий BrokenProcessPool: новый пул — один на всех
+        if self.pool is pool:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        solo = ProcessPoolExecutor(max_workers=1)
+        try:
+            return await loop.run_in_executor(solo, fn, *args)
+        finally:
+            solo.shutdown(wait=False)
+
+    async def _complete(self, request: Dict[str, Any]) -> Tuple[Any, Any]:
+        """Ответ модели и True, если он из кэша (попадание не занимает семафор и лимит частоты).
+
+        В потоковом режиме вместо False — StreamWatcher; ответ None значит, что поток оборван.
+        """
+        key = None
+        if self.cache is not None:
+            key, resp = await asyncio.to_thread(self.cache.lookup, request, self.stream)
+            if resp is not None and self.stream:
+                watcher = StreamWatcher.replay(resp)
+                if watcher.fatal:
+                    return None, watcher
+            if resp is not None:
+                return resp, True
+        watcher = False
+        async with self.sem:
+            await self.limiter.acquire()
+            if self.stream:
+                resp, watcher = await astream_create(self.client, **request)
+            else:
+                resp = await self.client.chat.completions.create(**request)
+        if self.cache is not None:
+            if resp is not None:
+                await asyncio.to_thread(self.cache.store, key, resp)
+            else:
+                await asyncio.to_thread(self.cache.store, key, watcher.completion(), True)
+        return resp, watcher
+
+    async def generate(self, brief_id: str, brief: str) -> Dict[str, Any]:
+        """Цикл генерации для одного брифа. Исключения не пробрасываются — они в status/error."""
+        t0 = time.perf_counter()
+        row: Dict[str, Any] = {"id": brief_id, "status": "failed", "rounds": 0, "cached": 0,
+                               "aborted": 0, "api_ms": 0.0, "local_ms": 0.0, "tokens": 0, "round_tokens": []}
+        dialog = InkDialog(brief, self.compact, self.model)
+        try:
+            for round_idx in range(self.max_rounds):
+                row["rounds"] = round_idx + 1
+                t = time.perf_counter()
+                resp, source = await self._complete(dialog.request())
+                row["api_ms"] += (time.perf_counter() - t) * 1000
+                if resp is None:
+                    # поток оборван на фатальной ошибке — отчёт модели без полной проверки
+                    row["aborted"] += 1
+                    log(f"[{brief_id}] раунд {round_idx + 1}: поток оборван через {source.first_error_ms:.0f} ms")
+                    dialog.aborted(source)
+                    continue
+                if source is True:
+                    row["cached"] += 1
+                else:
+                    tokens = usage_tokens(resp)
+                    row["round_tokens"].append(tokens)
+                    row["tokens"] += tokens["prompt"] + tokens["completion"]
+                msg = resp.choices[0].message
+                calls = dialog.tool_calls(msg)
+                if not calls:
+                    row["status"] = "no_tool"
+                    row["content"] = msg.content or ""
+                    return row
+
+                for call_id, name, args in calls:
+                    t = time.perf_counter()
+                    if name == "validate_ink":
+                        result = await self._run(_validate_job, args.get("ink", ""))
+                    else:
+                        result = {"ok": False, "error": f"unknown_tool:{name}"}
+                    row["local_ms"] += (time.perf_counter() - t) * 1000
+                    log(f"[{brief_id}] раунд {round_idx + 1}: {name} ok={result.get('ok')}")
+
+                    if dialog.report(call_id, name, result):
+                        t = time.perf_counter()
+                        row["ink"] = args.get("ink", "")
+                        row["json"], row["html"] = await self._run(_compile_job, row["ink"])
+                        row["local_ms"] += (time.perf_counter() - t) * 1000
+                        row["status"] = "ok"
+                        return row
+                dialog.end_round()
+            row["status"] = "exhausted"
+        except Exception as e:
+            row["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            row["api_ms"] = round(row["api_ms"], 1)
+            row["local_ms"] = round(row["local_ms"], 1)
+            row["total_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return row
+
+
+def _write_result(out_dir: pathlib.Path, row: Dict[str, Any], results) -> None:
+    """Файлы брифа (если он готов) и строка в results.jsonl — без самих ink/json/html."""
+    if row["status"] == "ok":
+        base = str(out_dir / re.sub(r"[^\w.-]", "_", row["id"]))
+        _atomic_write(pathlib.Path(base + ".ink"), row["ink"].encode("utf-8"))
+        _atomic_write(pathlib.Path(base + ".json"),
+                      json.dumps(row["json"], ensure_ascii=False, indent=2).encode("utf-8"))
+        _atomic_write(pathlib.Path(base + ".html"), row["html"].encode("utf-8"))
+        row["outputs"] = [base + ext for ext in (".ink", ".json", ".html")]
+    line = {k: v for k, v in row.items() if k not in ("ink", "json", "html")}
+    results.write(json.dumps(line, ensure_ascii=False) + "\n")
+    results.flush()
+
+
+async def run_batch(briefs: List[Tuple[str, str]], out_dir: pathlib.Path, concurrency: int = 8,
+                    rpm: float = 120, workers: Optional[int] = None, max_rounds: int = 8,
+                    base_url: Optional[str] = None, model: str = MODEL, progress=None,
+                    cache: Optional[ResponseCache] = None, compact: bool = COMPACT,
+                    stream: bool = STREAM) -> Dict[str, Any]:
+    """Сгенерировать сценарии по всем брифам; результаты пишутся по мере готовности. Возвращает сводку.
+
+    cache=None — без кэша ответов; в режиме replay клиент не создаётся вовсе.
+    compact=False — полная переписка вместо последнего раунда и дельты ошибок (для сравнения токенов).
+    stream=True — потоковые ответы с ранней проверкой структуры Ink.
+    """
+    api_key = OPENAI_API_KEY or ("local" if base_url else None)
+    replay = cache is not None and cache.mode == "replay"
+    if not api_key and not replay:
+        raise RuntimeError("OPENAI_API_KEY is not set in environment")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    summary: Dict[str, Any] = {"briefs": len(briefs), "ok": 0, "exhausted": 0, "no_tool": 0, "failed": 0,
+                               "rounds": 0, "cached": 0, "aborted": 0, "tokens": 0, "prompt_tokens": 0}
+    client = None if replay else AsyncOpenAI(api_key=api_key, base_url=base_url)
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            open(out_dir / RESULTS, "a", encoding="utf-8") as results:
+        gen = BatchGenerator(client, pool, concurrency, rpm, max_rounds, model, cache, compact, stream, workers)
+        tasks = [asyncio.create_task(gen.generate(bid, brief)) for bid, brief in briefs]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                row = await fut
+                _write_result(out_dir, row, results)
+                summary[row["status"]] += 1
+                summary["rounds"] += row["rounds"]
+                summary["cached"] += row["cached"]
+                summary["aborted"] += row["aborted"]
+                summary["tokens"] += row["tokens"]
+                summary["prompt_tokens"] += sum(t["prompt"] for t in row["round_tokens"])
+                if progress:
+                    progress(row)
+        finally:
+            if gen.pool is not pool:  # замена сломанного пула (см. BatchGenerator)
+                gen.pool.shutdown()
+    if client is not None:
+        await client.close()
+    summary["wall_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return summary
+
+
+def _print_row(row: Dict[str, Any]) -> None:
+    extra = f" {row['error']}" if row.get("error") else ""
+    print(f"[{row['status']:>9}] {row['id']}  rounds={row['rounds']} (cached {row['cached']})  api={row['api_ms']:.0f} ms  "
+          f"local={row['local_ms']:.0f} ms{extra}", file=sys.stderr)
+
+
+def _main() -> None:
+    ap = argparse.ArgumentParser(description="Пакетная генерация Ink-сценариев по файлу брифов")
+    ap.add_argument("briefs", help="JSON Lines {id, brief} или текст: бриф в строке")
+    ap.add_argument("-o", "--out", default="generated", help="каталог результатов")
+    ap.add_argument("-c", "--concurrency", type=int, default=8, help="одновременных запросов к API")
+    ap.add_argument("--rpm", type=float, default=120, help="запросов в минуту на весь пакет")
+    ap.add_argument("-w", "--workers", type=int, default=None, help="процессов для валидации и сборки")
+    ap.add_argument("--max-rounds", type=int, default=8)
+    ap.add_argument("--model", default=MODEL)
+    ap.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL"),
+                    help="OpenAI-совместимый сервер (например, локальный стаб)")
+    ap.add_argument("--cache", choices=("rw", "replay", "off"), default=None,
+                    help="кэш ответов модели (по умолчанию GPT_CACHE или rw); replay — только из кэша")
+    ap.add_argument("--cache-dir", default=None, help="каталог кэша ответов (GPT_CACHE_DIR)")
+    ap.add_argument("--no-compact", action="store_true",
+                    help="слать полную переписку (по умолчанию — последний скрипт и дельта ошибок)")
+    ap.add_argument("--stream", action="store_true",
+                    help="потоковые ответы: обрывать генерацию на первой фатальной ошибке структуры")
+    ap.add_argument("-q", "--quiet", action="store_true")
+    args = ap.parse_args()
+
+    briefs = list(read_briefs(args.briefs))
+    cache = ResponseCache(**{k: v for k, v in (("root", args.cache_dir), ("mode", args.cache)) if v is not None})
+    summary = asyncio.run(run_batch(briefs, pathlib.Path(args.out), args.concurrency, args.rpm, args.workers,
+                                    args.max_rounds, args.base_url, args.model,
+                                    progress=None if args.quiet else _print_row,
+                                    cache=None if cache.mode == "off" else cache,
+                                    compact=COMPACT and not args.no_compact,
+                                    stream=STREAM or args.stream))
+    print(json.dumps(summary, ensure_ascii=False))
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    _main()
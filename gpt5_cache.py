@@ -0,0 +1,198 @@
+# gpt5_cache.py — дисковый кэш ответов модели для цикла генерации (gpt5_ink, gpt5_batch).
+#
+# Ключ — sha256 от (модель, сообщения вместе с системным промптом, инструменты, tool_choice),
+# поэтому одинаковый бриф и одинаковые промежуточные раунды правки не идут в API повторно,
+# а правка SYSTEM_HINT или TOOLS сама даёт новые ключи. Ответ хранится как model_dump()
+# и восстанавливается тем же типом ChatCompletion, так что цикл не видит разницы.
+#
+# Режимы (GPT_CACHE):
+#   rw      — читать и писать (по умолчанию);
+#   replay  — только читать; промах — ошибка CacheMiss (детерминированный прогон без сети и ключа);
+#   off     — кэш не используется.
+# Записи старше TTL (GPT_CACHE_TTL_DAYS) считаются промахом; размер ограничен, как у CompileCache.
+# Оборванный поток (gpt5_stream) — не ответ на запрос: он лежит под отдельным ключом, и его видят
+# только потоковые прогоны (lookup(..., stream=True)); прогон без потока получает лишь полные ответы.
+#
+#   python gpt5_cache.py stats | list | purge | prune --to-mb 50 | clear
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from openai.types.chat import ChatCompletion
+
+from ink_cache import DEFAULT_DIR, DiskCache
+
+MODES = ("rw", "replay", "off")
+DEFAULT_LLM_DIR = os.environ.get("GPT_CACHE_DIR") or os.path.join(DEFAULT_DIR, "llm")
+DEFAULT_MODE = os.environ.get("GPT_CACHE", "rw")
+DEFAULT_TTL = float(os.environ.get("GPT_CACHE_TTL_DAYS", "30")) * 86400
+DEFAULT_LLM_MAX_BYTES = int(float(os.environ.get("GPT_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+# параметры запроса, от которых ответ не зависит
+_NOT_KEYED = {"timeout", "extra_headers", "stream", "stream_options"}
+
+
+def _aborted_key(key: str) -> str:
+    return hashlib.sha256(f"aborted:{key}".encode("ascii")).hexdigest()
+
+
+class CacheMiss(RuntimeError):
+    """В режиме replay для запроса нет записи в кэше."""
+
+
+def _plain(obj: Any) -> Any:
+    # сообщения модели в истории — объекты SDK; в ключ идёт их JSON-вид без пустых полей
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(exclude_none=True)
+    if isinstance(obj, dict):
+        return {k: _plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(v) for v in obj]
+    return obj
+
+
+def request_key(**request: Any) -> str:
+    """sha256 от параметров chat.completions.create (без timeout и прочих транспортных)."""
+    body = {k: _plain(v) for k, v in request.items() if k not in _NOT_KEYED}
+    blob = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(DiskCache):
+    """Ответы chat.completions по ключу request_key; TTL по времени записи, LRU по размеру."""
+
+    def __init__(self, root: str = DEFAULT_LLM_DIR, max_bytes: int = DEFAULT_LLM_MAX_BYTES,
+                 ttl: Optional[float] = DEFAULT_TTL, mode: str = DEFAULT_MODE):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        super().__init__(root, max_bytes)
+        self.ttl = ttl
+        self.mode = mode
+        self.expired = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = super().get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry.get("created", 0) > self.ttl:
+            self.hits -= 1
+            self.misses += 1
+            self.expired += 1
+            return None
+        return entry["response"]
+
+    def put(self, key: str, value: Any) -> None:
+        super().put(key, {"created": time.time(), "response": value})
+
+    def purge(self) -> int:
+        """Удалить записи старше TTL. Возвращает число удалённых."""
+        if self.ttl is None:
+            return 0
+        removed = 0
+        now = time.time()
+        for p, _size, _mtime in list(self._scan()):
+            try:
+                created = json.loads(p.read_bytes()).get("created", 0)
+            except (OSError, ValueError):
+                created = 0
+            if now - created > self.ttl:
+                try:
+                    p.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        self._size = None
+        return removed
+
+    # ====== обёртки вокруг клиента ======
+    def lookup(self, request: Dict[str, Any], stream: bool = False):
+        """(ключ, ответ из кэша или None); ключ None — кэш выключен. В replay промах — CacheMiss.
+
+        stream=True — сначала ищется оборванный поток на этот запрос (store(..., aborted=True)).
+        """
+        if self.mode == "off":
+            return None, None
+        key = request_key(**request)
+        data = None
+        if stream:
+            data = self.get(_aborted_key(key))
+            if data is None:
+                self.misses -= 1  # промах считается один раз — по полному ответу ниже
+        if data is None:
+            data = self.get(key)
+        if data is not None:
+            return key, ChatCompletion.model_validate(data)
+        if self.mode == "replay":
+            raise CacheMiss(f"нет ответа в кэше для запроса {key[:16]} (режим replay)")
+        return key, None
+
+    def store(self, key: Optional[str], resp: Any, aborted: bool = False) -> None:
+        """Записать ответ; aborted=True — оборванный поток, под отдельным ключом."""
+        if key is not None and self.mode == "rw":
+            self.put(_aborted_key(key) if aborted else key, resp.model_dump(exclude_none=True))
+
+    def create(self, client: Any, **request: Any) -> Any:
+        """client.chat.completions.create через кэш; в режиме replay client может быть None."""
+        key, resp = self.lookup(request)
+        if resp is not None:
+            return resp
+        resp = client.chat.completions.create(**request)
+        self.store(key, resp)
+        return resp
+
+    async def acreate(self, client: Any, **request: Any) -> Any:
+        """То же для AsyncOpenAI; диск читается и пишется в потоке, не блокируя цикл событий."""
+        key, resp = await asyncio.to_thread(self.lookup, request)
+        if resp is not None:
+            return resp
+        resp = await client.chat.completions.create(**request)
+        await asyncio.to_thread(self.store, key, resp)
+        return resp
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "mode": self.mode, "ttl_days": None if self.ttl is None else self.ttl / 86400,
+                "expired": self.expired}
+
+
+# ====== CLI ======
+def _main() -> None:
+    ap = argparse.ArgumentParser(description="Кэш ответов модели")
+    ap.add_argument("--dir", default=DEFAULT_LLM_DIR, help="каталог кэша (GPT_CACHE_DIR)")
+    ap.add_argument("--max-mb", type=float, default=DEFAULT_LLM_MAX_BYTES / (1024 * 1024))
+    ap.add_argument("--ttl-days", type=float, default=DEFAULT_TTL / 86400)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats")
+    p = sub.add_parser("list", help="записи от свежих к старым")
+    p.add_argument("-n", type=int, default=20)
+    sub.add_parser("purge", help="удалить записи старше TTL")
+    p = sub.add_parser("prune", help="вытеснить старые записи до предела")
+    p.add_argument("--to-mb", type=float, default=None)
+    sub.add_parser("clear", help="удалить все записи")
+    args = ap.parse_args()
+
+    cache = ResponseCache(args.dir, int(args.max_mb * 1024 * 1024), args.ttl_days * 86400)
+    if args.cmd == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    elif args.cmd == "list":
+        rows: List[Dict[str, Any]] = cache.entries()[:args.n]
+        for row in rows:
+            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["atime"]))
+            print(f"{row['key'][:16]}  {row['bytes']:>10}  {ts}")
+    elif args.cmd == "purge":
+        print(f"removed: {cache.purge()}")
+    elif args.cmd == "prune":
+        limit = None if args.to_mb is None else int(args.to_mb * 1024 * 1024)
+        print(f"removed: {cache.prune(limit)}")
+    elif args.cmd == "clear":
+        print(f"removed: {cache.clear()}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -3,9 +3,9 @@
 # GPT генерирует/правит только Ink. Когда валидатор ok — конвертация и HTML выполняются локально.
 
 from __future__ import annotations
-import os, sys, json, traceback
+import os, sys, json, time, traceback
 from os import write
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
 # --- imports / flat layout ---
 import sys, pathlib
@@ -15,8 +15,11 @@ if str(ROOT) not in sys.path:
 
 # --- локальные инструменты ---
 from ink_validator import validate_ink as _validate_ink
-from ink_to_json import parse_ink_to_json as _ink_to_json
+from ink_diagnostics import dedupe
 from json_to_html_player import build_html_player as _build_html
+from ink_incremental import InkSession
+from gpt5_cache import ResponseCache
+from gpt5_stream import stream_create
 
 # --- OpenAI client ---
 from openai import OpenAI
@@ -26,6 +29,10 @@ MODEL = os.environ.get("OPENAI_MODEL", "gpt-5")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 REQUEST_TIMEOUT = int(os.environ.get("OPENAI_TIMEOUT", "60"))  # сек
 DEBUG = os.environ.get("INK_DEBUG", "1") != "0"  # 1=вкл, 0=выкл
+# 1 = в истории только последний скрипт и дельта ошибок; 0 = полная переписка (для сравнения)
+COMPACT = os.environ.get("GPT_COMPACT", "1") != "0"
+# 1 = потоковый ответ с ранней проверкой структуры Ink (gpt5_stream)
+STREAM = os.environ.get("GPT_STREAM", "0") != "0"
 
 SYSTEM_HINT = """
 You are an Ink scenario generator for a dialogue trainer. reasoning effort: high
@@ -33,7 +40,8 @@ You are an Ink scenario generator for a dialogue trainer. reasoning effort: high
 WORKFLOW (STRICT)
 1) Produce a complete Ink script using ONLY the allowed subset below.
 2) CALL validate_ink with the full Ink.
-3) If report.errors is not empty, FIX the Ink and CALL validate_ink again (loop until ok==true).
+3) If errors is not empty, FIX the Ink and CALL validate_ink again (loop until ok==true).
+   Each error is {code, sym, lines, hint}: `lines` lists every line with the same problem, `hint` says how to fix it.
 4) When ok==true, output ONLY one fenced block: ```ink ...``` — no commentary.
 
 INK SUBSET (ENFORCED)
@@ -68,9 +76,9 @@ VARIABLE SAFETY (MANDATORY)
 - Do not rely on undeclared variables in inline conditions or text.
 
 SELF-CHECK (BEFORE validate_ink)
-- From `=== start ===`, `END`/`DONE` is reachable.
 - Every `+/*` has `-> target`, and every `->` resolves to an existing knot or stitch (relative stitches allowed).
-- No dead ends: no step with neither options nor divert (except a final step that diverts to END/DONE).
+- validate_ink itself checks the step graph: END/DONE reachable from `start`, cycles with no way out (errors),
+  unreachable steps and dead ends (warnings, fix them too).
 - For EVERY decision question:
   • YES/NO → both ACCEPT and DECLINE present (Back does not count).
   • “X or Y?” → both X and Y present as forward options, labels mirror X/Y, distinct valid targets.
@@ -106,85 +114,261 @@ def log(*args: Any) -> None:
         print("[GPT-INK]", *args, flush=True)
 
 # ====== локальные вызовы инструментов ======
-def tool_validate_ink(ink: str) -> Dict[str, Any]:
+def tool_validate_ink(ink: str, session: InkSession | None = None, lang: str | None = None) -> Dict[str, Any]:
+    """Ответ инструмента для модели: ok и свёрнутые по коду/символу ошибки и предупреждения.
+
+    Каждая запись — code, sym, lines, hint (без русского текста; lang="ru" добавит msg).
+    """
     try:
-        report = _validate_ink(ink)
-        # нормализация полей
-        report.setdefault("errors", [])
-        report.setdefault("warnings", [])
-        report.setdefault("infos", [])
-        ok = len(report["errors"]) == 0
-        return {"ok": ok, "report": report}
+        # в сессии перепроверяются только изменившиеся с прошлого раунда узлы
+        report = session.validate(ink, lang) if session is not None else _validate_ink(ink, lang)
+        diags = report.get("diagnostics", [])
+        errors = dedupe(d for d in diags if d["sev"] == "error")
+        warnings = dedupe(d for d in diags if d["sev"] == "warning")
+        for row in errors + warnings:
+            del row["sev"]
+        return {"ok": not errors, "errors": errors, "warnings": warnings}
     except Exception as e:
-        return {"ok": False, "report": {"errors": [f"validator_exception: {type(e).__name__}: {e}"]}}
+        return {"ok": False, "errors": [{"code": "validator_exception", "msg": f"{type(e).__name__}: {e}"}]}
 
-def _dispatch_tool(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+def _dispatch_tool(name: str, args: Dict[str, Any], session: InkSession | None = None) -> Dict[str, Any]:
     if name == "validate_ink":
-        return tool_validate_ink(args.get("ink", ""))
+        return tool_validate_ink(args.get("ink", ""), session)
     return {"ok": False, "error": f"unknown_tool:{name}"}
 
+# ====== сжатие переписки ======
+# Без сжатия раунд N заново отправляет все прежние скрипты и отчёты — объём растёт квадратично.
+# Со сжатием история — это [system, бриф, последний ответ модели, его отчёты]: префикс
+# system+бриф байт-в-байт одинаков во всех раундах (на нём срабатывает кэш промптов провайдера),
+# а в отчёте — только новые и ещё открытые ошибки.
+def _diag_key(row: Dict[str, Any]) -> tuple:
+    return row.get("code"), row.get("sym")
+
+
+class ReportDelta:
+    """Отчёты validate_ink между раундами: state new/open у ошибок, fixed — исправленные, новые предупреждения."""
+
+    __slots__ = ("errors", "warnings")
+
+    def __init__(self) -> None:
+        self.errors: set = set()
+        self.warnings: set = set()
+
+    def __call__(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        if "errors" not in result:
+            return result
+        keys = {_diag_key(e) for e in result["errors"]}
+        out: Dict[str, Any] = {
+            "ok": result.get("ok", False),
+            "errors": [dict(e, state="open" if _diag_key(e) in self.errors else "new") for e in result["errors"]],
+        }
+        fixed = [{"code": c, "sym": s} for c, s in sorted(self.errors - keys, key=str)]
+        if fixed:
+            out["fixed"] = fixed
+        warnings = result.get("warnings", [])
+        fresh = [w for w in warnings if _diag_key(w) not in self.warnings]
+        if fresh:
+            out["warnings"] = fresh
+        if len(fresh) < len(warnings):
+            out["warnings_repeated"] = len(warnings) - len(fresh)
+        self.errors = keys
+        self.warnings.update(_diag_key(w) for w in warnings)
+        return out
+
+    def note_errors(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Отчёт по оборванному потоку: Ink проверен только до обрыва, поэтому fixed не бывает —
+        ошибки получают state и добавляются к открытым (следующий полный отчёт скажет, исправлены ли)."""
+        errors = result.get("errors", [])
+        out = dict(result, errors=[dict(e, state="open" if _diag_key(e) in self.errors else "new") for e in errors])
+        self.errors |= {_diag_key(e) for e in errors}
+        return out
+
+
+def compact_history(messages: List[Any], reply: Any, tool_msgs: List[Dict[str, Any]]) -> None:
+    """Оставить в messages system, бриф и только последний раунд (ответ модели и отчёты на его вызовы)."""
+    messages[2:] = [reply, *tool_msgs]
+
+
+class InkDialog:
+    """Переписка одного брифа без ввода-вывода: запрос раунда, разбор вызовов инструментов, отчёты
+    для модели и история. Общая для ask_gpt_ink и gpt5_batch.BatchGenerator.generate — они только
+    ходят в API и запускают инструменты (синхронно или в пуле процессов).
+
+    Раунд: request() → tool_calls(ответ) → report(...) на каждый вызов → end_round();
+    оборванный поток — aborted(watcher) вместо всего остального.
+    """
+
+    __slots__ = ("messages", "compact", "model", "delta", "reply", "tool_msgs")
+
+    def __init__(self, brief: str, compact: bool = COMPACT, model: str = MODEL) -> None:
+        self.messages: List[Any] = [
+            {"role": "system", "content": SYSTEM_HINT},
+            {"role": "user", "content": brief},
+        ]
+        self.compact = compact
+        self.model = model
+        self.delta = ReportDelta()
+        self.reply: Any = None
+        self.tool_msgs: List[Dict[str, Any]] = []
+
+    def request(self) -> Dict[str, Any]:
+        return dict(
+            model=self.model,
+            messages=self.messages,
+            tools=TOOLS,            # только validate_ink
+            tool_choice="auto",
+            timeout=REQUEST_TIMEOUT,
+        )
+
+    def aborted(self, watcher: Any) -> None:
+        """Поток оборван на фатальной ошибке: в историю — Ink до обрыва и отчёт по нему, раунд закрыт."""
+        self.reply, self.tool_msgs = watcher.aborted_turn()
+        if self.compact:
+            for m in self.tool_msgs:
+                m["content"] = json.dumps(self.delta.note_errors(json.loads(m["content"])), ensure_ascii=False)
+        self.end_round()
+
+    def tool_calls(self, msg: Any) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """(id, имя, аргументы) вызовов инструментов в ответе; пустой список — финальный ответ без них."""
+        calls = getattr(msg, "tool_calls", None)
+        if not calls:
+            return []
+        self.reply, self.tool_msgs = msg, []
+        out = []
+        for tc in calls:
+            try:
+                args = json.loads(tc.function.arguments or "{}")
+            except ValueError as e:
+                log(f"Ошибка парсинга аргументов инструмента {tc.function.name}: {e}")
+                args = {}
+            out.append((tc.id, tc.function.name, args))
+        return out
+
+    def report(self, call_id: str, name: str, result: Dict[str, Any]) -> bool:
+        """Результат вызова для модели; True — validate_ink зелёный: Ink готов, отчёт не нужен."""
+        if name == "validate_ink" and result.get("ok"):
+            return True
+        if self.compact and name == "validate_ink":
+            result = self.delta(result)
+        self.tool_msgs.append({
+            "role": "tool",
+            "tool_call_id": call_id,
+            "content": json.dumps(result, ensure_ascii=False),
+        })
+        return False
+
+    def end_round(self) -> None:
+        self.messages.append(self.reply)
+        if self.compact:
+            compact_history(self.messages, self.reply, self.tool_msgs)
+        else:
+            self.messages.extend(self.tool_msgs)
+
+
+def usage_tokens(resp: Any) -> Dict[str, int]:
+    """Токены раунда из resp.usage: prompt, completion и cached (часть prompt из кэша провайдера)."""
+    usage = getattr(resp, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion": getattr(usage, "completion_tokens", 0) or 0,
+        "cached": getattr(details, "cached_tokens", 0) or 0,
+    }
+
+
 # ====== основной цикл ======
-def ask_gpt_ink(user_brief: str, max_rounds: int = 8) -> str:
+def ask_gpt_ink(user_brief: str, max_rounds: int = 8, cache: ResponseCache | None = None,
+                compact: bool = COMPACT, client: OpenAI | None = None,
+                out_html: str | None = "out.html", stats: Dict[str, Any] | None = None,
+                stream: bool = STREAM) -> str:
     """
     Диалог с моделью и вызов единственного инструмента validate_ink.
     Как только ok==True — локально конвертируем Ink в JSON и HTML и возвращаем итог.
+    Ответы модели берутся из кэша gpt5_cache (по умолчанию — по переменным GPT_CACHE*);
+    в режиме replay API и ключ не нужны.
+    compact — сжатие переписки (см. ReportDelta); токены каждого раунда пишутся в лог.
+    client — готовый клиент (например, на локальный стаб gpt5_stub); out_html=None — не писать файл.
+    Если stats — словарь, в него кладутся status, rounds_to_green и по раундам
+    api_ms / validate_ms / compile_ms / render_ms и токены (см. bench_ink.py pipeline).
+    stream — читать ответ потоком и обрывать его на первой фатальной ошибке структуры
+    (в stats у такого раунда aborted и first_error_ms).
     """
-    if not OPENAI_API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is not set in environment")
-
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
-    messages: List[Dict[str, Any]] = [
-        {"role": "system", "content": SYSTEM_HINT},
-        {"role": "user", "content": user_brief},
-    ]
-    log("Старт. MODEL=", MODEL)
+    cache = cache if cache is not None else ResponseCache()
+    rounds: List[Dict[str, Any]] = []
+    if stats is not None:
+        stats.update(status="exhausted", rounds_to_green=None, rounds=rounds)
+    if client is None and cache.mode != "replay":
+        if not OPENAI_API_KEY:
+            raise RuntimeError("OPENAI_API_KEY is not set in environment")
+        client = OpenAI(api_key=OPENAI_API_KEY)
+    session = InkSession()
+    dialog = InkDialog(user_brief, compact)
+    total = {"prompt": 0, "completion": 0, "cached": 0}
+
+    log("Старт. MODEL=", MODEL, "кэш:", cache.mode)
     log("Подготовлен начальный контекст (2 сообщения)")
 
     for round_idx in range(max_rounds):
         log(f"\nРаунд {round_idx+1}/{max_rounds}")
-        log(f"Отправляем в GPT {len(messages)} сообщений...")
+        log(f"Отправляем в GPT {len(dialog.messages)} сообщений...")
+        t = time.perf_counter()
+        if stream:
+            resp, watcher = stream_create(client, cache, **dialog.request())
+        else:
+            resp, watcher = cache.create(client, **dialog.request()), None
+        timing = {"api_ms": (time.perf_counter() - t) * 1000, "validate_ms": 0.0, "compile_ms": 0.0,
+                  "render_ms": 0.0}
+
+        # поток оборван на фатальной ошибке: модель сразу получает отчёт по уже написанному
+        if resp is None:
+            first = watcher.fatal[1].fatal[0]
+            log(f"Поток оборван через {watcher.first_error_ms:.0f} ms: {first.code} в строке {first.ln}."
+                " Просим исправить.")
+            rounds.append({**timing, **usage_tokens(None), "aborted": True,
+                           "first_error_ms": watcher.first_error_ms})
+            dialog.aborted(watcher)
+            continue
 
-        resp = client.chat.completions.create(
-            model=MODEL,
-            messages=messages,
-            tools=TOOLS,            # только validate_ink
-            tool_choice="auto",
-            timeout=REQUEST_TIMEOUT,
-        )
         msg = resp.choices[0].message
-        has_tools = bool(getattr(msg, "tool_calls", None))
-        log("Ответ получен. tool_calls=", has_tools)
+        calls = dialog.tool_calls(msg)
+        log("Ответ получен. tool_calls=", bool(calls))
+        tokens = usage_tokens(resp)
+        for k, v in tokens.items():
+            total[k] += v
+        log(f"Токены раунда: prompt={tokens['prompt']} (cached {tokens['cached']}) completion={tokens['completion']};"
+            f" всего prompt={total['prompt']} completion={total['completion']}")
+        rounds.append({**timing, **tokens})
 
         # финальный ответ без инструментов (редко)
-        if not has_tools:
+        if not calls:
             log("Финальный ответ от модели (без инструментов).")
+            if stats is not None:
+                stats["status"] = "no_tool"
             return msg.content or "[empty]"
 
-        # добавляем сообщение модели один раз за раунд
-        messages.append(msg)
-
         # исполняем tool_calls
-        for tc in msg.tool_calls:
-            name = tc.function.name
-            try:
-                args = json.loads(tc.function.arguments or "{}")
-            except Exception as e:
-                log(f"Ошибка парсинга аргументов инструмента {name}: {e}")
-                args = {}
-
+        for call_id, name, args in calls:
             log(f"Запуск инструмента: {name} args_keys={list(args.keys())}")
-            result = _dispatch_tool(name, args)
+            t = time.perf_counter()
+            result = _dispatch_tool(name, args, session)
+            rounds[-1]["validate_ms"] += (time.perf_counter() - t) * 1000
             log("Результат", name, ":", (json.dumps(result, ensure_ascii=False)[:300] + "…"))
 
             # ===== РАННИЙ ВЫХОД: валидатор зелёный — делаем всё локально и возвращаем итог =====
-            if name == "validate_ink" and result.get("ok"):
+            if dialog.report(call_id, name, result):
                 ink_text = args.get("ink", "")
                 log("Валидация OK. Конвертация ink→json и сборка html локально…")
-                json_obj = _ink_to_json(ink_text)
+                t = time.perf_counter()
+                json_obj = session.compile(ink_text)
+                rounds[-1]["compile_ms"] = (time.perf_counter() - t) * 1000
+                t = time.perf_counter()
                 html_str = _build_html(json_obj)
-                with open("out.html", "w", encoding="utf-8") as file:
-                    file.write(html_str)
+                rounds[-1]["render_ms"] = (time.perf_counter() - t) * 1000
+                if out_html:
+                    with open(out_html, "w", encoding="utf-8") as file:
+                        file.write(html_str)
+                if stats is not None:
+                    stats.update(status="ok", rounds_to_green=round_idx + 1)
 
                 log("Готово. Возвращаем итог.")
                 return (
@@ -192,15 +376,11 @@ def ask_gpt_ink(user_brief: str, max_rounds: int = 8) -> str:
                     "### JSON\n```json\n" + json.dumps(json_obj, ensure_ascii=False, indent=2) + "\n```\n\n"
                     "### HTML\n```html\n" + html_str + "\n```"
                 )
-
-            # иначе — отдаём отчёт валидатора модели (пусть правит Ink)
-            messages.append({
-                "role": "tool",
-                "tool_call_id": tc.id,
-                "content": json.dumps(result, ensure_ascii=False)
-            })
+            # иначе отчёт валидатора уже в dialog — модель правит Ink
             log("Результат инструмента", name, "отдан модели.")
 
+        dialog.end_round()
+
     log("❌ Лимит раундов исчерпан, финального ответа нет.")
     return "[tool loop exhausted]"
 
@@ -0,0 +1,230 @@
+# gpt5_stream.py — потоковые ответы модели с ранней проверкой структуры Ink.
+#
+# Без потока validate_ink видит скрипт только после всей генерации (несколько килобайт).
+# Здесь ответ читается чанками: аргументы вызова validate_ink по мере поступления
+# раскодируются из JSON (InkArgDecoder), законченные строки Ink идут в
+# ink_incremental.StreamChecker. На первой ошибке из FATAL_CODES (кривой заголовок узла,
+# точка в имени узла, вариант без '->' …) поток закрывается, а модели сразу уходит отчёт
+# {"ok": false, "aborted": true, ...} вместо ответа на весь скрипт.
+#
+# Ответ собирается в ChatCompletion того же вида, что без потока, и кладётся в кэш gpt5_cache.
+# Оборванный (только Ink до места обрыва) — под отдельным ключом: прогон без потока его не получит,
+# а потоковый найдёт. Попадание в кэш поток не открывает: ответ из кэша прогоняется через те же
+# проверки (StreamWatcher.replay), так что обрыв воспроизводится и в replay.
+#
+#   GPT_STREAM=1 python gpt5_ink.py "бриф"
+#   python gpt5_batch.py briefs.jsonl -o out/ --stream
+#   python bench_ink.py pipeline --stream --ms-per-token 2
+
+from __future__ import annotations
+
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai.types.chat import ChatCompletion
+
+from gpt5_cache import ResponseCache
+from ink_diagnostics import dedupe
+from ink_incremental import StreamChecker
+
+_INK_KEY = re.compile(r'"ink"\s*:\s*"')
+_PLAIN = re.compile(r'[^"\\]+')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class InkArgDecoder:
+    """Значение "ink" из JSON-аргументов вызова, которые приходят кусками: feed() отдаёт новый текст."""
+
+    __slots__ = ("_buf", "_pos", "_state")
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._pos = 0
+        self._state = 0  # 0 — ищем ключ, 1 — внутри строки, 2 — строка закончилась
+
+    def feed(self, piece: str) -> str:
+        self._buf += piece
+        buf, i = self._buf, self._pos
+        if self._state == 0:
+            m = _INK_KEY.search(buf, i)
+            if m is None:
+                return ""
+            i, self._state = m.end(), 1
+        out: List[str] = []
+        while self._state == 1 and i < len(buf):
+            m = _PLAIN.match(buf, i)
+            if m:
+                out.append(m.group())
+                i = m.end()
+                continue
+            if buf[i] == '"':
+                self._state, i = 2, i + 1
+                break
+            # экранирование: ждём, пока придёт целиком (\uXXXX — вместе с парой суррогата)
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc != "u":
+                out.append(_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            code = int(buf[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                if i + 12 > len(buf):
+                    break
+                low = int(buf[i + 8:i + 12], 16) if buf[i + 6:i + 8] == "\\u" else 0
+                if 0xDC00 <= low < 0xE000:
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+            out.append(chr(code))
+            i += 6
+        self._pos = i
+        return "".join(out)
+
+
+class StreamWatcher:
+    """Собирает чанки chat.completion.chunk в ответ и следит за Ink в вызовах validate_ink."""
+
+    def __init__(self) -> None:
+        self.t0 = time.perf_counter()
+        self.first_error_ms: Optional[float] = None
+        self.meta: Dict[str, Any] = {}
+        self.content: List[str] = []
+        self.calls: Dict[int, Dict[str, Any]] = {}
+        self.finish: Optional[str] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.ink: Dict[int, List[str]] = {}
+        self._decoders: Dict[int, InkArgDecoder] = {}
+        self._checkers: Dict[int, StreamChecker] = {}
+        self.fatal: Optional[Tuple[int, StreamChecker]] = None
+
+    def feed(self, chunk: Any) -> bool:
+        """Учесть чанк; True — найдена фатальная ошибка и поток пора закрывать."""
+        if not self.meta:
+            self.meta = {"id": chunk.id, "created": chunk.created, "model": chunk.model}
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage.model_dump(exclude_none=True)
+        for choice in chunk.choices:
+            delta = choice.delta
+            if choice.finish_reason:
+                self.finish = choice.finish_reason
+            if delta.content:
+                self.content.append(delta.content)
+            for tc in delta.tool_calls or ():
+                call = self.calls.setdefault(tc.index, {
+                    "id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                if tc.id:
+                    call["id"] = tc.id
+                fn = tc.function
+                if fn is None:
+                    continue
+                if fn.name:
+                    call["function"]["name"] += fn.name
+                if fn.arguments:
+                    call["function"]["arguments"] += fn.arguments
+                    if call["function"]["name"] == "validate_ink" and self._check(tc.index, fn.arguments):
+                        return True
+        return False
+
+    def _check(self, idx: int, piece: str) -> bool:
+        decoder = self._decoders.get(idx)
+        if decoder is None:
+            decoder = self._decoders[idx] = InkArgDecoder()
+            self._checkers[idx] = StreamChecker()
+            self.ink[idx] = []
+        text = decoder.feed(piece)
+        if not text:
+            return False
+        self.ink[idx].append(text)
+        if self._checkers[idx].feed(text):
+            self.fatal = (idx, self._checkers[idx])
+            self.first_error_ms = (time.perf_counter() - self.t0) * 1000
+            return True
+        return False
+
+    @classmethod
+    def replay(cls, resp: ChatCompletion) -> "StreamWatcher":
+        """Прогнать готовый ответ (из кэша) через те же проверки, что поток; fatal — если он бы оборвался."""
+        watcher = cls()
+        message = resp.choices[0].message
+        for idx, tc in enumerate(message.tool_calls or ()):
+            watcher.calls[idx] = tc.model_dump(exclude_none=True)
+            if tc.function.name == "validate_ink" and watcher._check(idx, tc.function.arguments or ""):
+                break
+        watcher.first_error_ms = None if watcher.fatal is None else 0.0
+        return watcher
+
+    def completion(self) -> ChatCompletion:
+        """Ответ в том же виде, что chat.completions.create без stream (у оборванного — до места обрыва)."""
+        message: Dict[str, Any] = {"role": "assistant", "content": "".join(self.content) or None}
+        if self.fatal:
+            message = self.aborted_turn()[0]
+        elif self.calls:
+            message["tool_calls"] = [self.calls[i] for i in sorted(self.calls)]
+        data = {**self.meta, "object": "chat.completion",
+                "choices": [{"index": 0, "message": message, "finish_reason": self.finish or "stop"}]}
+        if self.usage:
+            data["usage"] = self.usage
+        return ChatCompletion.model_validate(data)
+
+    def aborted_turn(self) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Ответ модели (Ink до оборванного места) и отчёт для неё — как обычный раунд с validate_ink."""
+        idx, checker = self.fatal
+        call_id = self.calls[idx]["id"] or f"call_aborted_{idx}"
+        ink = "".join(self.ink[idx])
+        reply = {"role": "assistant", "content": None, "tool_calls": [{
+            "id": call_id, "type": "function",
+            "function": {"name": "validate_ink", "arguments": json.dumps({"ink": ink}, ensure_ascii=False)},
+        }]}
+        errors = dedupe(d.to_dict() for d in checker.fatal)
+        for row in errors:
+            del row["sev"]
+        report = {"ok": False, "aborted": True, "errors": errors,
+                  "note": f"generation stopped at line {checker.fatal[0].ln}; fix it and send the full script again"}
+        return reply, [{"role": "tool", "tool_call_id": call_id, "content": json.dumps(report, ensure_ascii=False)}]
+
+
+def _stream_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    return {**request, "stream": True, "stream_options": {"include_usage": True}}
+
+
+def stream_create(client: Any, cache: Optional[ResponseCache], **request: Any
+                  ) -> Tuple[Optional[ChatCompletion], Optional[StreamWatcher]]:
+    """Как cache.create, но потоком: (ответ, watcher) или (None, watcher), если поток оборван."""
+    key = None
+    if cache is not None:
+        key, resp = cache.lookup(request, stream=True)
+        if resp is not None:
+            watcher = StreamWatcher.replay(resp)
+            return (None if watcher.fatal else resp), watcher
+    watcher = StreamWatcher()
+    stream = client.chat.completions.create(**_stream_request(request))
+    try:
+        for chunk in stream:
+            if watcher.feed(chunk):
+                break
+    finally:
+        stream.close()
+    resp = watcher.completion()
+    if cache is not None:
+        cache.store(key, resp, aborted=watcher.fatal is not None)
+    return (None if watcher.fatal else resp), watcher
+
+
+async def astream_create(client: Any, **request: Any) -> Tuple[Optional[ChatCompletion], StreamWatcher]:
+    """То же для AsyncOpenAI, без кэша (кэш и ограничение частоты — у вызывающего, см. gpt5_batch);
+    для кэша — watcher.completion()."""
+    watcher = StreamWatcher()
+    stream = await client.chat.completions.create(**_stream_request(request))
+    try:
+        async for chunk in stream:
+            if watcher.feed(chunk):
+                break
+    finally:
+        await stream.close()
+    return (None if watcher.fatal else watcher.completion()), watcher
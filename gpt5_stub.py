@@ -0,0 +1,345 @@
+# gpt5_stub.py — локальный OpenAI-совместимый сервер, проигрывающий записанные ходы модели.
+#
+# Нужен, чтобы гонять цикл generate→validate→compile (gpt5_ink, gpt5_batch, bench_ink.py pipeline)
+# без сети и ключа: POST /v1/chat/completions отвечает вызовом validate_ink с Ink из фикстуры —
+# сначала неверным, затем исправленным, — либо текстом без инструментов.
+#
+# Фикстура (JSON):
+#   {"briefs": [{"id": "cafe", "brief": "текст брифа",
+#                "turns": [{"base": "../valid.ink", "replace": [["=== start ===", "=== begin ==="]]},
+#                          {"base": "../valid.ink"},
+#                          {"ink": "..."}, {"content": "ответ без инструментов"}]}]}
+# Бриф ищется по первому сообщению user, номер хода — по id последнего tool_call в истории
+# (call_<ход>_…), поэтому сервер без состояния и одинаково работает со сжатой и полной перепиской.
+# Ходы после последнего повторяют последний. usage считается грубо (символы / 4), задержка —
+# --latency-ms на запрос плюс --ms-per-token на токен ответа. С "stream": true ответ идёт
+# SSE-чанками по --stream-chars символов с той же задержкой на токен; оборванные клиентом
+# потоки считаются в StubServer.cancelled.
+# С --record --upstream URL сервер проксирует запросы к настоящему API и дописывает ходы в фикстуру.
+#
+#   python gpt5_stub.py fixtures/gpt5_replay.json --port 8799 --latency-ms 300 --ms-per-token 2
+#   python gpt5_stub.py fixtures/new.json --record --upstream https://api.openai.com/v1
+#   OPENAI_BASE_URL=http://127.0.0.1:8799/v1 python gpt5_batch.py briefs.jsonl -o out/
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from ink_cache import _atomic_write
+
+
+class Fixtures:
+    """Записанные ходы модели по брифам; пути base — относительно файла фикстуры."""
+
+    __slots__ = ("path", "briefs", "_by_text", "_lock")
+
+    def __init__(self, path: str, briefs: Optional[List[Dict[str, Any]]] = None):
+        self.path = pathlib.Path(path)
+        self.briefs: List[Dict[str, Any]] = briefs or []
+        self._by_text = {b["brief"]: b for b in self.briefs}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, missing_ok: bool = False) -> "Fixtures":
+        p = pathlib.Path(path)
+        if missing_ok and not p.exists():
+            return cls(path)
+        return cls(path, json.loads(p.read_text(encoding="utf-8"))["briefs"])
+
+    def corpus(self) -> List[Tuple[str, str]]:
+        """Пары (id, бриф) — вход для gpt5_batch и бенчмарка."""
+        return [(b["id"], b["brief"]) for b in self.briefs]
+
+    def find(self, brief: str) -> Optional[Dict[str, Any]]:
+        return self._by_text.get(brief)
+
+    def turn(self, entry: Dict[str, Any], idx: int) -> Dict[str, Any]:
+        """Ход idx брифа: {"ink": текст} или {"content": текст}."""
+        turns = entry["turns"]
+        t = turns[min(idx, len(turns) - 1)]
+        if "content" in t:
+            return {"content": t["content"]}
+        if "ink" in t:
+            return {"ink": t["ink"]}
+        ink = (self.path.parent / t["base"]).read_text(encoding="utf-8")
+        for old, new in t.get("replace", ()):
+            if old not in ink:
+                raise ValueError(f"{entry['id']}: ход {idx}: {old!r} нет в {t['base']}")
+            ink = ink.replace(old, new, 1)
+        return {"ink": ink + t.get("append", "")}
+
+    def record(self, brief: str, idx: int, turn: Dict[str, Any]) -> None:
+        """Дописать ход и сохранить файл (атомарно)."""
+        with self._lock:
+            entry = self._by_text.get(brief)
+            if entry is None:
+                entry = {"id": f"b{len(self.briefs) + 1}", "brief": brief, "turns": []}
+                self.briefs.append(entry)
+                self._by_text[brief] = entry
+            turns = entry["turns"]
+            turns.extend({} for _ in range(idx + 1 - len(turns)))
+            turns[idx] = turn
+            data = json.dumps({"briefs": self.briefs}, ensure_ascii=False, indent=2) + "\n"
+            _atomic_write(self.path, data.encode("utf-8"))
+
+
+def _turn_index(messages: List[Dict[str, Any]]) -> int:
+    # номер хода = номер в id последнего нашего tool_call + 1; в сжатой истории других следов нет
+    for m in reversed(messages):
+        if m.get("role") != "assistant":
+            continue
+        for tc in m.get("tool_calls") or ():
+            parts = str(tc.get("id", "")).split("_")
+            if len(parts) > 2 and parts[0] == "call" and parts[1].isdigit():
+                return int(parts[1]) + 1
+        return sum(1 for x in messages if x.get("role") == "assistant")
+    return 0
+
+
+def _first_user(messages: List[Dict[str, Any]]) -> str:
+    return next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+
+
+def _tokens(obj: Any) -> int:
+    return len(json.dumps(obj, ensure_ascii=False)) // 4
+
+
+def completion(body: Dict[str, Any], turn: Dict[str, Any], idx: int, n: int) -> Dict[str, Any]:
+    """Ответ chat.completion для хода; usage — приближённо, cached — общий префикс (tools, system, бриф)."""
+    messages = body.get("messages", [])
+    if "content" in turn:
+        message: Dict[str, Any] = {"role": "assistant", "content": turn["content"]}
+        finish, out_tokens = "stop", _tokens(turn["content"])
+    else:
+        arguments = json.dumps({"ink": turn["ink"]}, ensure_ascii=False)
+        message = {"role": "assistant", "content": None, "tool_calls": [{
+            "id": f"call_{idx}_{n}", "type": "function",
+            "function": {"name": "validate_ink", "arguments": arguments},
+        }]}
+        finish, out_tokens = "tool_calls", len(arguments) // 4
+    prompt = _tokens(messages) + _tokens(body.get("tools", []))
+    cached = _tokens(messages[:2]) + _tokens(body.get("tools", [])) if idx else 0
+    return {
+        "id": f"chatcmpl-stub-{n}", "object": "chat.completion", "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+        "usage": {"prompt_tokens": prompt, "completion_tokens": out_tokens,
+                  "total_tokens": prompt + out_tokens,
+                  "prompt_tokens_details": {"cached_tokens": min(cached, prompt)}},
+    }
+
+
+def stream_chunks(out: Dict[str, Any], size: int, include_usage: bool) -> Iterator[Dict[str, Any]]:
+    """Тот же ответ кусками chat.completion.chunk: аргументы вызова или текст — по size символов."""
+    base = {"id": out["id"], "object": "chat.completion.chunk", "created": out["created"], "model": out["model"]}
+    message = out["choices"][0]["message"]
+
+    def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> Dict[str, Any]:
+        return {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+    calls = message.get("tool_calls") or []
+    if calls:
+        yield chunk({"role": "assistant", "content": None, "tool_calls": [
+            {"index": k, "id": tc["id"], "type": "function",
+             "function": {"name": tc["function"]["name"], "arguments": ""}} for k, tc in enumerate(calls)]})
+        for k, tc in enumerate(calls):
+            args = tc["function"]["arguments"]
+            for i in range(0, len(args), size):
+                yield chunk({"tool_calls": [{"index": k, "function": {"arguments": args[i:i + size]}}]})
+    else:
+        yield chunk({"role": "assistant", "content": ""})
+        text = message.get("content") or ""
+        for i in range(0, len(text), size):
+            yield chunk({"content": text[i:i + size]})
+    yield chunk({}, out["choices"][0]["finish_reason"])
+    if include_usage:
+        yield {**base, "choices": [], "usage": out["usage"]}
+
+
+class StubServer:
+    """Сервер в фоновом потоке: with StubServer(Fixtures.load(path)) as srv: OpenAI(base_url=srv.base_url)."""
+
+    def __init__(self, fixtures: Fixtures, host: str = "127.0.0.1", port: int = 0,
+                 latency_ms: float = 0.0, ms_per_token: float = 0.0, upstream: Optional[str] = None,
+                 stream_chars: int = 64):
+        self.fixtures = fixtures
+        self.latency_ms = latency_ms
+        self.ms_per_token = ms_per_token
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.stream_chars = stream_chars
+        self.calls = 0
+        self.cancelled = 0
+        self._count = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def handle(self, body: Dict[str, Any]) -> Tuple[int, Union[Dict[str, Any], Iterator[Dict[str, Any]]]]:
+        """(код, ответ) или (200, итератор чанков) для stream=True; задержки — внутри."""
+        with self._count:
+            self.calls += 1
+            n = self.calls
+        messages = body.get("messages", [])
+        brief, idx = _first_user(messages), _turn_index(messages)
+        if self.upstream:
+            out = self._forward(body, brief, idx, n)
+        else:
+            entry = self.fixtures.find(brief)
+            if entry is None:
+                return 400, {"error": {"message": f"нет брифа в фикстуре: {brief[:60]!r}",
+                                       "type": "invalid_request_error", "code": "unknown_brief"}}
+            out = completion(body, self.fixtures.turn(entry, idx), idx, n)
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return 200, self._paced(stream_chunks(out, self.stream_chars, include_usage))
+        if not self.upstream:
+            self._sleep(out["usage"]["completion_tokens"])
+        return 200, out
+
+    def _sleep(self, tokens: float) -> None:
+        delay = self.latency_ms + self.ms_per_token * tokens
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _paced(self, chunks: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        # до первого чанка — latency_ms, дальше — ms_per_token на токен куска (символы / 4)
+        self._sleep(0)
+        for ch in chunks:
+            delta = ch["choices"][0]["delta"] if ch["choices"] else {}
+            piece = delta.get("content") or "".join(
+                (tc.get("function") or {}).get("arguments", "") for tc in delta.get("tool_calls") or ())
+            if piece and self.ms_per_token > 0:
+                time.sleep(self.ms_per_token * len(piece) / 4 / 1000)
+            yield ch
+
+    def _forward(self, body: Dict[str, Any], brief: str, idx: int, n: int) -> Dict[str, Any]:
+        # запись: настоящий ответ, но id вызова переписан в нашу схему, чтобы ход считался так же;
+        # к upstream всегда без потока — клиенту поток собирается из готового ответа
+        body = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+        req = urllib.request.Request(
+            self.upstream + "/chat/completions",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json",
+                     "Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY', '')}"},
+        )
+        with urllib.request.urlopen(req) as r:
+            out = json.loads(r.read())
+        message = out["choices"][0]["message"]
+        calls = message.get("tool_calls") or []
+        if calls:
+            try:
+                ink = json.loads(calls[0]["function"]["arguments"]).get("ink", "")
+            except ValueError:
+                ink = ""
+            for k, tc in enumerate(calls):
+                tc["id"] = f"call_{idx}_{n}" + (f"_{k}" if k else "")
+            self.fixtures.record(brief, idx, {"ink": ink})
+        else:
+            self.fixtures.record(brief, idx, {"content": message.get("content") or ""})
+        return out
+
+
+def _make_handler(server: StubServer):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def _send(self, status: int, payload: Dict[str, Any]) -> None:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/models"):
+                self._send(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+            else:
+                self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+        def do_POST(self) -> None:
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                status, payload = server.handle(body)
+            except Exception as e:
+                self._send(500, {"error": {"message": f"{type(e).__name__}: {e}", "type": "server_error"}})
+                return
+            if isinstance(payload, dict):
+                self._send(status, payload)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            try:
+                for ch in payload:
+                    self.wfile.write(b"data: " + json.dumps(ch, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # клиент закрыл поток (ранняя ошибка в gpt5_stream)
+                with server._count:
+                    server.cancelled += 1
+
+    return Handler
+
+
+# ====== CLI ======
+def _main() -> None:
+    ap = argparse.ArgumentParser(description="Локальный OpenAI-совместимый сервер на фикстурах")
+    ap.add_argument("fixtures", help="JSON с брифами и ходами модели")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8799)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="задержка на запрос")
+    ap.add_argument("--ms-per-token", type=float, default=0.0, help="задержка на токен ответа")
+    ap.add_argument("--stream-chars", type=int, default=64, help="символов в чанке потокового ответа")
+    ap.add_argument("--record", action="store_true", help="проксировать к --upstream и записывать ходы")
+    ap.add_argument("--upstream", default="https://api.openai.com/v1")
+    args = ap.parse_args()
+
+    fixtures = Fixtures.load(args.fixtures, missing_ok=args.record)
+    srv = StubServer(fixtures, args.host, args.port, args.latency_ms, args.ms_per_token,
+                     args.upstream if args.record else None, args.stream_chars)
+    print(f"{'record' if args.record else 'replay'}: {len(fixtures.briefs)} брифов, {srv.base_url}", flush=True)
+    try:
+        srv.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.httpd.server_close()
+
+
+if __name__ == "__main__":
+    _main()
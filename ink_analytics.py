@@ -0,0 +1,334 @@
+# ink_analytics.py — статистика сценария как поглощающей марковской цепи (NumPy).
+#
+# Граф шагов из parse_ink_to_json переводится в переходы по правилам плеера (см. ink_runtime):
+# вариант → его next (без next — тот же шаг), пустой узел → первый стежок, divert → цель.
+# Выбор варианта — равновероятный или по весам. Поглощающие исходы:
+#   END      — '-> END' / '-> DONE' / end;
+#   DEAD_END — шаг без вариантов и перехода («Нет вариантов. Конец.»);
+#   MISSING  — переход на несуществующий шаг.
+# Цепь без памяти: фильтр уже выбранных вариантов (chosen) в ней не учитывается.
+#
+# Переходы хранятся разреженно (COO: src, dst, p). Всё считается по конденсации графа:
+# компоненты сильной связности обрабатываются уровнями топологического порядка, одиночные
+# шаги уровня — одной векторной операцией, циклы — решением (I - Q_CC) x = b размера
+# компоненты (разложение одно на все расчёты: LU из SciPy — разреженное для больших компонент,
+# плотное lu_factor для остальных; без SciPy — np.linalg.solve по самой матрице).
+# Обратные матрицы, в том числе полная фундаментальная N = (I - Q)^-1, не строятся.
+#
+#   python ink_analytics.py scenario.json [--weights weights.json] [--top 10]
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from scipy.linalg import lu_factor, lu_solve
+    from scipy.sparse import csc_matrix
+    from scipy.sparse.linalg import splu
+except ImportError:  # без SciPy все компоненты решаются плотно, np.linalg.solve
+    lu_factor = splu = None
+
+from ink_runtime import ScenarioRunner
+from ink_validator import _scc
+
+OUTCOMES = ("END", "DEAD_END", "MISSING")
+_END, _DEAD_END, _MISSING = range(3)
+
+DENSE_MAX = 500  # компоненты крупнее решаются разреженно (если есть SciPy)
+
+Weights = Dict[str, Sequence[float]]  # id шага → веса его вариантов (по порядку options)
+
+
+class ScenarioChain:
+    """Переходы между шагами (Q) и в исходы (R) в формате COO плюс конденсация графа.
+
+    Компоненты пронумерованы Тарьяном: переходы между компонентами идут только
+    от большего номера к меньшему, стоки — раньше.
+    """
+    __slots__ = ("ids", "index", "entry", "q_src", "q_dst", "q_p", "r_src", "r_dst", "r_p",
+                 "comp", "ncomp", "comp_size", "closed", "inner", "selfp", "_levels", "_blocks")
+
+    def __init__(self, data: Dict[str, Any], weights: Optional[Weights] = None):
+        runner = ScenarioRunner(data)
+        self.ids: List[str] = list(runner.steps)
+        self.index: Dict[str, int] = {sid: i for i, sid in enumerate(self.ids)}
+        entry = runner.entry()
+        if entry not in self.index:
+            raise ValueError(f"нет шага входа {entry!r}")
+        self.entry = self.index[entry]
+
+        q: List[Tuple[int, int, float]] = []
+        r: List[Tuple[int, int, float]] = []
+
+        def link(i: int, target: Optional[str], p: float) -> None:
+            if target in ("END", "DONE"):
+                r.append((i, _END, p))
+            elif target in self.index:
+                q.append((i, self.index[target], p))
+            else:
+                r.append((i, _MISSING, p))
+
+        for i, sid in enumerate(self.ids):
+            step = runner.steps[sid]
+            if step.options:
+                w = np.asarray(weights[sid], dtype=float) if weights and sid in weights else np.ones(len(step.options))
+                if w.shape != (len(step.options),) or (w < 0).any() or w.sum() <= 0:
+                    raise ValueError(f"веса шага {sid!r}: нужно {len(step.options)} неотрицательных, не все нули")
+                for opt, p in zip(step.options, w / w.sum()):
+                    if p > 0:
+                        link(i, opt.next or sid, float(p))
+                continue
+            child = runner.first_child_stitch(sid) if step.empty else None
+            if child:
+                link(i, child, 1.0)
+            elif step.divert in ("END", "DONE") or step.end:
+                r.append((i, _END, 1.0))
+            elif step.divert:
+                link(i, step.divert, 1.0)
+            else:
+                r.append((i, _DEAD_END, 1.0))
+
+        n = len(self.ids)
+        self.q_src, self.q_dst, self.q_p = _coo(q)
+        self.r_src, self.r_dst, self.r_p = _coo(r)
+        succ: Dict[int, List[int]] = {i: [] for i in range(n)}
+        for s, d in zip(self.q_src.tolist(), self.q_dst.tolist()):
+            succ[s].append(d)
+        comp = _scc(list(range(n)), succ)
+        self.comp = np.fromiter((comp[i] for i in range(n)), dtype=np.int64, count=n)
+        self.ncomp = int(self.comp.max()) + 1 if n else 0
+        self.comp_size = np.bincount(self.comp, minlength=self.ncomp)
+        self.inner = self.comp[self.q_src] == self.comp[self.q_dst]
+        loop = self.q_src == self.q_dst
+        self.selfp = np.bincount(self.q_src[loop], weights=self.q_p[loop], minlength=n)
+        # замкнутая компонента — из неё нет ни переходов наружу, ни исходов (ловушка)
+        leak = np.bincount(self.comp[self.q_src[~self.inner]], minlength=self.ncomp) \
+            + np.bincount(self.comp[self.r_src], minlength=self.ncomp)
+        self.closed = leak == 0
+        self._levels: Dict[bool, List[np.ndarray]] = {}
+        self._blocks: Dict[int, Any] = {}
+
+    @property
+    def n(self) -> int:
+        return len(self.ids)
+
+    def transition_matrix(self) -> np.ndarray:
+        """Плотная матрица P размера (n + 3) × (n + 3): шаги, затем END, DEAD_END, MISSING.
+
+        Для осмотра небольших сценариев; расчёты ниже её не строят.
+        """
+        n = self.n
+        P = np.zeros((n + len(OUTCOMES), n + len(OUTCOMES)))
+        np.add.at(P, (self.q_src, self.q_dst), self.q_p)
+        np.add.at(P, (self.r_src, n + self.r_dst), self.r_p)
+        P[np.arange(n, n + len(OUTCOMES)), np.arange(n, n + len(OUTCOMES))] = 1.0
+        return P
+
+    def levels(self, forward: bool) -> List[np.ndarray]:
+        """Компоненты по уровням: от стоков (forward=False) или от истоков (forward=True).
+
+        Внутри уровня компоненты не связаны переходами, поэтому решаются вместе.
+        """
+        if forward in self._levels:
+            return self._levels[forward]
+        level = [0] * self.ncomp
+        cs = self.comp[self.q_src].tolist()
+        cd = self.comp[self.q_dst].tolist()
+        pairs = sorted({(a, b) for a, b in zip(cs, cd) if a != b}, reverse=forward)
+        if forward:  # глубина от истоков: предшественники (большие номера) идут первыми
+            for a, b in pairs:
+                level[b] = max(level[b], level[a] + 1)
+        else:        # высота над стоками: преемники (меньшие номера) уже посчитаны
+            for a, b in pairs:
+                level[a] = max(level[a], level[b] + 1)
+        lv = np.asarray(level, dtype=np.int64)
+        order = np.argsort(lv, kind="stable")
+        bounds = np.flatnonzero(np.diff(lv[order])) + 1
+        self._levels[forward] = np.split(order, bounds) if self.ncomp else []
+        return self._levels[forward]
+
+
+def _coo(rows: List[Tuple[int, int, float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if not rows:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+    s, d, p = zip(*rows)
+    return np.asarray(s, np.int64), np.asarray(d, np.int64), np.asarray(p, float)
+
+
+def _members(chain: ScenarioChain, comps: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(np.isin(chain.comp, comps))
+
+
+def _block(chain: ScenarioChain, c: int) -> Tuple[np.ndarray, Any]:
+    """Шаги незамкнутой компоненты c и разложение I - Q_CC (кэшируется в цепи)."""
+    if c in chain._blocks:
+        return chain._blocks[c]
+    m = np.flatnonzero(chain.comp == c)
+    local = np.full(chain.n, -1)
+    local[m] = np.arange(len(m))
+    sel = chain.inner & (local[chain.q_src] >= 0)
+    rows, cols, vals = local[chain.q_src[sel]], local[chain.q_dst[sel]], chain.q_p[sel]
+    k = len(m)
+    if splu is not None and k > DENSE_MAX:
+        diag = np.arange(k)
+        A = csc_matrix((np.concatenate([np.ones(k), -vals]),
+                        (np.concatenate([diag, rows]), np.concatenate([diag, cols]))), shape=(k, k))
+        fact: Any = splu(A)
+    else:
+        A = np.eye(k)
+        np.subtract.at(A, (rows, cols), vals)
+        fact = lu_factor(A) if lu_factor is not None else A
+    chain._blocks[c] = (m, fact)
+    return m, fact
+
+
+def _block_solve(fact: Any, b: np.ndarray, transpose: bool = False) -> np.ndarray:
+    if isinstance(fact, tuple):  # плотное LU: (lu, piv)
+        return lu_solve(fact, b, trans=1 if transpose else 0)
+    if isinstance(fact, np.ndarray):  # без SciPy — сама матрица I - Q_CC
+        return np.linalg.solve(fact.T if transpose else fact, b)
+    return fact.solve(b, trans="T" if transpose else "N")
+
+
+def _solve_backward(chain: ScenarioChain, rhs: np.ndarray) -> np.ndarray:
+    """X = rhs + Q X (столбцы rhs независимы); в замкнутых компонентах X = 0."""
+    X = np.zeros_like(rhs, dtype=float)
+    comp, src, dst, p = chain.comp, chain.q_src, chain.q_dst, chain.q_p
+    pos = np.full(chain.n, -1)
+    for comps in chain.levels(forward=False):
+        nodes = _members(chain, comps)
+        pos[nodes] = np.arange(len(nodes))
+        acc = rhs[nodes].astype(float)
+        out = ~chain.inner & (pos[src] >= 0)
+        np.add.at(acc, pos[src[out]], p[out, None] * X[dst[out]])
+        ok = (chain.comp_size[comp[nodes]] == 1) & ~chain.closed[comp[nodes]]
+        X[nodes[ok]] = acc[ok] / (1.0 - chain.selfp[nodes[ok]])[:, None]
+        for c in comps[(chain.comp_size[comps] > 1) & ~chain.closed[comps]]:
+            m, fact = _block(chain, int(c))
+            X[m] = _block_solve(fact, acc[pos[m]])
+        pos[nodes] = -1
+    return X
+
+
+def _solve_forward(chain: ScenarioChain, start: np.ndarray) -> np.ndarray:
+    """v = start + v Q — ожидаемое число посещений; в достижимых ловушках — inf."""
+    v = np.zeros(chain.n)
+    comp, src, dst, p = chain.comp, chain.q_src, chain.q_dst, chain.q_p
+    pos = np.full(chain.n, -1)
+    for comps in chain.levels(forward=True):
+        nodes = _members(chain, comps)
+        pos[nodes] = np.arange(len(nodes))
+        acc = start[nodes].astype(float)
+        into = ~chain.inner & (pos[dst] >= 0)
+        np.add.at(acc, pos[dst[into]], v[src[into]] * p[into])
+        closed = chain.closed[comp[nodes]]
+        ok = (chain.comp_size[comp[nodes]] == 1) & ~closed
+        v[nodes[ok]] = acc[ok] / (1.0 - chain.selfp[nodes[ok]])
+        for c in comps[(chain.comp_size[comps] > 1) & ~chain.closed[comps]]:
+            m, fact = _block(chain, int(c))
+            v[m] = _block_solve(fact, acc[pos[m]], transpose=True)
+        # в замкнутую компоненту, куда есть вход, попадают навсегда
+        trapped = nodes[closed]
+        if len(trapped):
+            reached = np.bincount(comp[trapped], weights=acc[closed], minlength=chain.ncomp)[comp[trapped]]
+            v[trapped] = np.where(reached > 0, np.inf, 0.0)
+        pos[nodes] = -1
+    return v
+
+
+def absorption(chain: ScenarioChain) -> Dict[str, np.ndarray]:
+    """Для каждого шага: вероятности исходов, ожидаемое число шагов до конца и до END.
+
+    probs[i, k] — вероятность закончить исходом OUTCOMES[k] из шага i (сумма < 1 — ловушка);
+    steps[i] — ожидаемое число показанных шагов до любого исхода (inf, если возможна ловушка);
+    steps_to_end[i] — то же при условии, что сценарий дошёл до END (nan, если END недостижим).
+    """
+    n = chain.n
+    R = np.zeros((n, len(OUTCOMES)))
+    np.add.at(R, (chain.r_src, chain.r_dst), chain.r_p)
+    probs = _solve_backward(chain, R)
+    free = np.isclose(probs.sum(axis=1), 1.0)
+    h = probs[:, _END]
+    rhs = np.column_stack([free.astype(float), h])
+    t, g = _solve_backward(chain, rhs).T
+    steps = np.where(free, t, np.inf)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        steps_to_end = np.where(h > 0, g / h, np.nan)
+    return {"probs": probs, "steps": steps, "steps_to_end": steps_to_end}
+
+
+def visit_frequencies(chain: ScenarioChain) -> np.ndarray:
+    """Ожидаемое число показов каждого шага за прохождение от входа."""
+    start = np.zeros(chain.n)
+    start[chain.entry] = 1.0
+    return _solve_forward(chain, start)
+
+
+def path_counts(chain: ScenarioChain) -> Dict[str, int]:
+    """Число различных путей от входа к каждому исходу по конденсации графа.
+
+    Компонента сильной связности считается одной вершиной (циклы не разворачиваются),
+    разные варианты с одной целью — разные пути. Счёт точный (целые Python, без переполнения).
+    """
+    comp = chain.comp
+    cs, cd = comp[chain.q_src], comp[chain.q_dst]
+    outer = cs != cd
+    cnt = np.zeros(chain.ncomp, dtype=object)
+    cnt[:] = 0
+    if chain.n:
+        cnt[comp[chain.entry]] = 1
+    for comps in chain.levels(forward=True):
+        sel = outer & np.isin(cs, comps)
+        np.add.at(cnt, cd[sel], cnt[cs[sel]])
+    out = {name: 0 for name in OUTCOMES}
+    for s, k in zip(comp[chain.r_src].tolist(), chain.r_dst.tolist()):
+        out[OUTCOMES[k]] += cnt[s]
+    return out
+
+
+def _num(x: float) -> Optional[float]:
+    return None if math.isinf(x) or math.isnan(x) else round(float(x), 4)
+
+
+def analyze(data: Dict[str, Any], weights: Optional[Weights] = None, top: int = 10) -> Dict[str, Any]:
+    """Сводка по сценарию: исходы и длина от входа, число путей, самые посещаемые шаги."""
+    chain = ScenarioChain(data, weights)
+    ab = absorption(chain)
+    visits = visit_frequencies(chain)
+    e = chain.entry
+    probs = ab["probs"][e]
+    order = np.argsort(-visits, kind="stable")[:top]
+    return {
+        "steps": chain.n,
+        "transitions": int(len(chain.q_src) + len(chain.r_src)),
+        "entry": chain.ids[e],
+        "cyclic": bool((chain.comp_size > 1).any() or (chain.q_src == chain.q_dst).any()),
+        "outcomes": {name: _num(probs[k]) for k, name in enumerate(OUTCOMES)},
+        "trapped": _num(max(0.0, 1.0 - probs.sum())),
+        "expected_steps": _num(ab["steps"][e]),
+        "expected_steps_to_end": _num(ab["steps_to_end"][e]),
+        "paths": path_counts(chain),
+        "most_visited": [[chain.ids[i], _num(visits[i])] for i in order],
+    }
+
+
+# ====== CLI ======
+def _main() -> None:
+    ap = argparse.ArgumentParser(description="Статистика сценария: исходы, длина, пути, посещаемость")
+    ap.add_argument("json", help="сценарий ink-json/v3 или v4-compact ('-' — stdin)")
+    ap.add_argument("--weights", help="JSON {id шага: [веса вариантов]}; по умолчанию выбор равновероятный")
+    ap.add_argument("--top", type=int, default=10, help="сколько самых посещаемых шагов показать")
+    args = ap.parse_args()
+    src = sys.stdin.read() if args.json == "-" else open(args.json, encoding="utf-8").read()
+    weights = json.load(open(args.weights, encoding="utf-8")) if args.weights else None
+    print(json.dumps(analyze(json.loads(src), weights, args.top), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,337 @@
+# ink_batch.py — пакетная обработка каталога сценариев на пуле процессов.
+#
+#   python ink_batch.py compile scenarios/ -o build/ --workers 8 [--cache ~/.cache/ink_quiz] [--assets] [--chunks inline|files] [--compress]
+#   python ink_batch.py validate scenarios/ --workers 8 [--max-errors 20] [--jsonl] [--strict]
+#
+# compile: для каждого scenarios/<path>.ink пишет build/<path>.json и build/<path>.html (атомарно),
+# а в build/manifest.json — статус, время этапов и число ошибок/предупреждений по каждому файлу.
+# С --assets CSS/JS плеера пишутся один раз в build/player.<hash>.css/.js, а страницы тонкие.
+# С --chunks шаги делятся по узлам: inline — ленивые блоки в странице, files — build/<path>.knots/<узел>.json.
+# С --compress JSON в странице сжат (gzip + base64); размеры до/после — в строке файла и в сводке.
+# validate: только валидация (validate_many) — строки по файлам по мере готовности и сводка:
+# гистограмма кодов диагностик и самые медленные файлы.
+# Сбой одного сценария не останавливает пакет: он попадает в отчёт со статусом "failed" — даже если
+# он убил рабочий процесс (OOM, segfault): остальные файлы досчитываются на новом пуле (_pool_map).
+# Код возврата 1 — если есть failed, с --strict — и при ошибках валидации (invalid).
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import EXTRA_QUEUED_CALLS, BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from ink_cache import CompileCache, _atomic_write
+from ink_diagnostics import histogram
+from ink_to_json import validate_and_compile
+from ink_validator import validate_ink
+from json_to_html_player import build_html_player, split_knot_chunks, write_knot_chunks, write_player_assets
+
+MANIFEST = "manifest.json"
+
+
+def find_scenarios(root: pathlib.Path, pattern: str = "*.ink") -> List[pathlib.Path]:
+    if root.is_file():
+        return [root]
+    return sorted(p for p in root.rglob(pattern) if p.is_file())
+
+
+def _ms(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000, 2)
+
+
+def _assets_prefix(assets_dir: str, out_base: str) -> str:
+    rel = os.path.relpath(assets_dir, os.path.dirname(out_base) or ".")
+    return "" if rel == "." else rel.replace(os.sep, "/") + "/"
+
+
+def _pool_map(fn: Callable[..., Any], jobs: Sequence[tuple], workers: Optional[int] = None
+              ) -> Iterator[Tuple[int, Any]]:
+    """fn(*args) для каждого задания на пуле процессов: (номер задания, результат) по мере готовности.
+
+    Исключение задания отдаётся вместо результата. Если рабочий процесс умер, пул ломается целиком
+    (BrokenProcessPool у всех незаконченных заданий). Задания пул раздаёт по порядку, поэтому
+    выполняться в этот момент могли только первые workers + EXTRA_QUEUED_CALLS незаконченных:
+    они повторяются поодиночке, каждое в своём процессе, и ошибку получает лишь то, что роняет
+    процесс снова. Остальные незаконченные уходят в новый пул.
+    """
+    workers = workers or os.cpu_count() or 1
+    pending = list(range(len(jobs)))
+    while pending:
+        done = set()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futs = {pool.submit(fn, *jobs[i]): i for i in pending}
+            for fut in as_completed(futs):
+                try:
+                    res = fut.result()
+                except BrokenProcessPool:
+                    continue
+                except Exception as e:
+                    res = e
+                done.add(futs[fut])
+                yield futs[fut], res
+        left = [i for i in pending if i not in done]
+        suspects, pending = left[:workers + EXTRA_QUEUED_CALLS], left[workers + EXTRA_QUEUED_CALLS:]
+        solo = [ProcessPoolExecutor(max_workers=1) for _ in suspects]
+        try:
+            futs = {p.submit(fn, *jobs[i]): i for p, i in zip(solo, suspects)}
+            for fut in as_completed(futs):
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    res = e
+                yield futs[fut], res
+        finally:
+            for p in solo:
+                p.shutdown()
+
+
+def _failed_row(source: str, e: BaseException) -> Dict[str, Any]:
+    return {"source": source, "status": "failed", "errors": 0, "warnings": 0,
+            "error": f"{type(e).__name__}: {e}", "timings": {}}
+
+
+def compile_one(src: str, out_base: str, cache_dir: Optional[str] = None, assets_dir: Optional[str] = None,
+                minify: bool = False, chunks: Optional[str] = None, compress: bool = False) -> Dict[str, Any]:
+    """Скомпилировать один файл; out_base — путь вывода без расширения. Исключения не пробрасываются.
+
+    assets_dir — каталог с player.<hash>.css/.js: страница будет ссылаться на них, а не встраивать.
+    chunks — "inline"/"files": шаги по узлам, плеер загружает узел при первом входе
+    (для "files" узлы пишутся в <out_base>.knots/).
+    compress — сжатая полезная нагрузка; запасной вариант для старых браузеров — <out_base>.json.
+    """
+    t_all = time.perf_counter()
+    row: Dict[str, Any] = {"source": src, "status": "failed", "errors": 0, "warnings": 0, "timings": {}}
+    try:
+        t0 = time.perf_counter()
+        ink_text = pathlib.Path(src).read_text(encoding="utf-8")
+        row["timings"]["read_ms"] = _ms(t0)
+
+        t0 = time.perf_counter()
+        if cache_dir:
+            entry = CompileCache(cache_dir).compile(ink_text)
+            row["cached"] = entry["cached"]
+        else:
+            entry = validate_and_compile(ink_text)
+        row["timings"]["compile_ms"] = _ms(t0)
+
+        report = entry["report"]
+        row["errors"] = len(report.get("errors", []))
+        row["warnings"] = len(report.get("warnings", []))
+        if row["errors"]:
+            row["first_errors"] = report["errors"][:5]
+        row["codes"] = histogram(d for d in report.get("diagnostics", []) if d["sev"] != "info")
+
+        t0 = time.perf_counter()
+        assets_prefix = None if assets_dir is None else _assets_prefix(assets_dir, out_base)
+        name = os.path.basename(out_base)
+        if chunks is not None or compress:
+            sizes: Dict[str, Any] = {}
+            html = build_html_player(entry["json"], minify=minify, assets=assets_prefix,
+                                     chunks=chunks, chunk_base=name + ".knots/", prefetch=True,
+                                     compress=compress, fallback=name + ".json", stats=sizes)
+            if sizes:
+                row["payload"] = sizes
+        elif assets_prefix is not None:
+            html = build_html_player(entry["json"], minify=minify, assets=assets_prefix)
+        elif "html" in entry and not minify:
+            html = entry["html"]
+        else:
+            html = build_html_player(entry["json"], minify=minify)
+        row["timings"]["render_ms"] = _ms(t0)
+
+        t0 = time.perf_counter()
+        json_path = pathlib.Path(out_base + ".json")
+        html_path = pathlib.Path(out_base + ".html")
+        _atomic_write(json_path, json.dumps(entry["json"], ensure_ascii=False, indent=2).encode("utf-8"))
+        _atomic_write(html_path, html.encode("utf-8"))
+        row["outputs"] = [str(json_path), str(html_path)]
+        if chunks == "files":
+            knots_dir = pathlib.Path(out_base + ".knots")
+            write_knot_chunks(split_knot_chunks(entry["json"])[1], knots_dir)
+            row["outputs"].append(str(knots_dir))
+        row["timings"]["write_ms"] = _ms(t0)
+        row["status"] = "invalid" if row["errors"] else "ok"
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+        row["traceback"] = traceback.format_exc(limit=5)
+    row["timings"]["total_ms"] = _ms(t_all)
+    return row
+
+
+def compile_batch(sources: Iterable[pathlib.Path], root: pathlib.Path, out_dir: pathlib.Path,
+                  workers: Optional[int] = None, cache_dir: Optional[str] = None,
+                  progress=None, assets: bool = False, minify: bool = False,
+                  chunks: Optional[str] = None, compress: bool = False) -> Dict[str, Any]:
+    """Скомпилировать сценарии на пуле процессов и записать манифест. Возвращает манифест.
+
+    assets=True — общий рантайм плеера в out_dir/player.<hash>.css/.js и тонкие страницы.
+    chunks, compress — см. compile_one.
+    """
+    t0 = time.perf_counter()
+    base = root if root.is_dir() else root.parent
+    rows: List[Dict[str, Any]] = []
+    assets_dir = None
+    asset_names: Dict[str, str] = {}
+    if assets:
+        asset_names = write_player_assets(out_dir, minify)
+        assets_dir = str(out_dir)
+    sources = list(sources)
+    jobs = []
+    for src in sources:
+        out_base = str(out_dir / src.relative_to(base).with_suffix(""))
+        jobs.append((str(src), out_base, cache_dir, assets_dir, minify, chunks, compress))
+    for i, row in _pool_map(compile_one, jobs, workers):
+        if isinstance(row, BaseException):  # например, упал сам рабочий процесс
+            row = _failed_row(str(sources[i]), row)
+        rows.append(row)
+        if progress:
+            progress(row)
+
+    rows.sort(key=lambda r: r["source"])
+    summary = summarize(rows, t0)
+    manifest = {"root": str(root), "out": str(out_dir), "workers": workers or os.cpu_count(),
+                "summary": summary, "files": rows}
+    if asset_names:
+        manifest["assets"] = asset_names
+    _atomic_write(out_dir / MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return manifest
+
+
+def summarize(rows: List[Dict[str, Any]], t0: float, top: int = 10) -> Dict[str, Any]:
+    """Сводка по строкам compile_one / validate_one: статусы, гистограмма кодов, самые медленные."""
+    summary: Dict[str, Any] = {"files": len(rows), "ok": 0, "invalid": 0, "failed": 0}
+    codes: Dict[str, int] = {}
+    for r in rows:
+        summary[r["status"]] += 1
+        for code, n in r.get("codes", {}).items():
+            codes[code] = codes.get(code, 0) + n
+    summary["codes"] = dict(sorted(codes.items(), key=lambda kv: (-kv[1], kv[0])))
+    packed = [r["payload"] for r in rows if "payload" in r]
+    if packed:
+        raw = sum(p["raw_bytes"] for p in packed)
+        out = sum(p["packed_bytes"] for p in packed)
+        summary["payload"] = {"raw_bytes": raw, "packed_bytes": out, "ratio": round(out / max(raw, 1), 4)}
+    slow = sorted(rows, key=lambda r: r["timings"].get("total_ms", 0), reverse=True)[:top]
+    summary["slowest"] = [[r["source"], r["timings"].get("total_ms", 0)] for r in slow]
+    summary["wall_ms"] = _ms(t0)
+    summary["cpu_ms"] = round(sum(r["timings"].get("total_ms", 0) for r in rows), 2)
+    return summary
+
+
+# ====== только валидация ======
+Source = Union[str, pathlib.Path]
+
+
+def validate_one(source: str, ink_text: Optional[str] = None, max_errors: Optional[int] = None) -> Dict[str, Any]:
+    """Проверить один сценарий (файл или готовый текст). Исключения не пробрасываются."""
+    t_all = time.perf_counter()
+    row: Dict[str, Any] = {"source": source, "status": "failed", "errors": 0, "warnings": 0, "timings": {}}
+    try:
+        if ink_text is None:
+            ink_text = pathlib.Path(source).read_text(encoding="utf-8")
+        report = validate_ink(ink_text, max_errors=max_errors)
+        row["errors"] = len(report["errors"])
+        row["warnings"] = len(report["warnings"])
+        if row["errors"]:
+            row["first_errors"] = report["errors"][:5]
+        if report.get("truncated"):
+            row["truncated"] = True
+        row["codes"] = histogram(d for d in report["diagnostics"] if d["sev"] != "info")
+        row["status"] = "invalid" if row["errors"] else "ok"
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["timings"]["total_ms"] = _ms(t_all)
+    return row
+
+
+def validate_many(items: Iterable[Source], workers: Optional[int] = None,
+                  max_errors: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Проверить много сценариев на пуле процессов; строки отдаются по мере готовности.
+
+    Элемент — путь (pathlib.Path или строка-путь к существующему файлу) либо текст Ink;
+    тексты подписываются как "<text N>". Файлы читают сами рабочие процессы.
+    max_errors — остановить проверку файла на первых N ошибках (в строке будет truncated).
+    """
+    jobs = []
+    for i, item in enumerate(items):
+        if isinstance(item, pathlib.Path) or ("\n" not in item and os.path.isfile(item)):
+            jobs.append((str(item), None, max_errors))
+        else:
+            jobs.append((f"<text {i}>", item, max_errors))
+    for i, row in _pool_map(validate_one, jobs, workers):
+        if isinstance(row, BaseException):  # например, упал сам рабочий процесс
+            row = _failed_row(jobs[i][0], row)
+        yield row
+
+
+# ====== CLI ======
+def _print_row(row: Dict[str, Any]) -> None:
+    ms = row["timings"].get("total_ms", 0)
+    extra = f" {row['error']}" if row.get("error") else ""
+    print(f"[{row['status']:>7}] {row['source']}  errors={row['errors']}  {ms:.0f} ms{extra}", file=sys.stderr)
+
+
+def _main() -> None:
+    ap = argparse.ArgumentParser(description="Пакетная компиляция Ink-сценариев")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("compile", help="validate → JSON → HTML для каждого .ink в каталоге")
+    p.add_argument("root", help="каталог со сценариями (или один .ink)")
+    p.add_argument("-o", "--out", help="каталог вывода (по умолчанию — рядом с исходниками)")
+    p.add_argument("-w", "--workers", type=int, default=None, help="число процессов (по умолчанию — все ядра)")
+    p.add_argument("--pattern", default="*.ink")
+    p.add_argument("--cache", default=None, help="каталог кэша компиляции (см. ink_cache.py)")
+    p.add_argument("--assets", action="store_true",
+                   help="вынести CSS/JS плеера в общие player.<hash>.css/.js в каталоге вывода")
+    p.add_argument("--minify", action="store_true", help="убрать отступы и комментарии из CSS/JS плеера")
+    p.add_argument("--chunks", choices=("inline", "files"), default=None,
+                   help="делить шаги по узлам и загружать узел при первом входе (files — нужен http)")
+    p.add_argument("--compress", action="store_true", help="сжать JSON в странице (gzip + base64)")
+    p.add_argument("--strict", action="store_true", help="код возврата 1 и при ошибках валидации")
+    p.add_argument("-q", "--quiet", action="store_true")
+    p = sub.add_parser("validate", help="только валидация всех .ink в каталоге (validate_many)")
+    p.add_argument("root", help="каталог со сценариями (или один .ink)")
+    p.add_argument("-w", "--workers", type=int, default=None, help="число процессов (по умолчанию — все ядра)")
+    p.add_argument("--pattern", default="*.ink")
+    p.add_argument("--max-errors", type=int, default=None, help="прекращать проверку файла после N ошибок")
+    p.add_argument("--top", type=int, default=10, help="сколько самых медленных файлов показать в сводке")
+    p.add_argument("--jsonl", action="store_true", help="строки по файлам в stdout в формате JSON Lines")
+    p.add_argument("--strict", action="store_true", help="код возврата 1 и при ошибках валидации")
+    p.add_argument("-q", "--quiet", action="store_true")
+    args = ap.parse_args()
+
+    root = pathlib.Path(args.root)
+    if args.cmd == "validate":
+        t0 = time.perf_counter()
+        rows = []
+        for row in validate_many(find_scenarios(root, args.pattern), args.workers, args.max_errors):
+            rows.append(row)
+            if args.jsonl:
+                print(json.dumps(row, ensure_ascii=False), flush=True)
+            if not args.quiet:
+                _print_row(row)
+        s = summarize(rows, t0, args.top)
+        print(json.dumps(s, ensure_ascii=False))
+        if s["failed"] or (args.strict and s["invalid"]):
+            sys.exit(1)
+        return
+
+    out_dir = pathlib.Path(args.out) if args.out else (root if root.is_dir() else root.parent)
+    sources = find_scenarios(root, args.pattern)
+    manifest = compile_batch(sources, root, out_dir, args.workers, args.cache,
+                             progress=None if args.quiet else _print_row,
+                             assets=args.assets, minify=args.minify, chunks=args.chunks, compress=args.compress)
+    s = manifest["summary"]
+    print(json.dumps(s, ensure_ascii=False))
+    if s["failed"] or (args.strict and s["invalid"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,242 @@
+# ink_cache.py — дисковый кэш компиляции Ink → (отчёт валидатора, JSON, HTML).
+#
+# Ключ — sha256 от исходника Ink и версии компилятора (хэш исходников парсера,
+# валидатора и плеера), поэтому любая правка конвейера сама инвалидирует кэш.
+# Размер ограничен, при переполнении выбрасываются давно не читанные записи (LRU по mtime).
+#
+#   python ink_cache.py stats
+#   python ink_cache.py build scenario.ink -o out.html
+#   python ink_cache.py prune --to-mb 100
+#   python ink_cache.py clear
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import ink_compact
+import ink_diagnostics
+import ink_expr
+import ink_frontend
+import ink_to_json
+import ink_validator
+import json_to_html_player
+
+DEFAULT_DIR = os.environ.get("INK_CACHE_DIR") or os.path.join(
+    os.path.expanduser("~"), ".cache", "ink_quiz")
+DEFAULT_MAX_BYTES = int(float(os.environ.get("INK_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+
+def _compiler_version() -> str:
+    h = hashlib.sha256(ink_to_json.FORMAT.encode("utf-8"))
+    for mod in (ink_frontend, ink_expr, ink_diagnostics, ink_to_json, ink_validator, ink_compact, json_to_html_player):
+        h.update(pathlib.Path(mod.__file__).read_bytes())
+    return h.hexdigest()[:16]
+
+COMPILER_VERSION = _compiler_version()
+
+
+def compile_ink(ink_text: str) -> Dict[str, Any]:
+    """Полный локальный конвейер без кэша: отчёт валидатора, JSON и HTML."""
+    compiled = ink_to_json.validate_and_compile(ink_text)
+    html = json_to_html_player.build_html_player(compiled["json"])
+    return {"report": compiled["report"], "json": compiled["json"], "html": html}
+
+
+def _atomic_write(path: pathlib.Path, blob: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class DiskCache:
+    """Хранилище «ключ → JSON-значение» в файлах с ограничением по размеру (LRU по mtime).
+
+    Чтение обновляет mtime записи, поэтому при вытеснении удаляются давно не читанные.
+    Безопасно при нескольких процессах: записи пишутся атомарно, битые файлы считаются промахом.
+    """
+
+    suffix = ".json"
+
+    def __init__(self, root: str = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size: Optional[int] = None  # оценка занятого места; None — ещё не считали
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / (key + self.suffix)
+
+    def get(self, key: str) -> Optional[Any]:
+        p = self._path(key)
+        try:
+            value = json.loads(p.read_bytes())
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        blob = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        path = self._path(key)
+        old = 0
+        if self._size is not None:
+            # перезапись ключа заменяет файл — его прежний размер из оценки убираем
+            try:
+                old = path.stat().st_size
+            except OSError:
+                pass
+        _atomic_write(path, blob)
+        if self._size is None:
+            self._size = sum(size for _p, size, _m in self._scan())
+        else:
+            self._size += len(blob) - old
+        if self._size > self.max_bytes:
+            self.prune()
+
+    def _scan(self) -> Iterator[Tuple[pathlib.Path, int, float]]:
+        if not self.root.is_dir():
+            return
+        for p in self.root.glob("*/*" + self.suffix):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            yield p, st.st_size, st.st_mtime
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Записи от самых свежих к самым старым: key, bytes, atime (время последнего чтения/записи)."""
+        rows = [{"key": p.name[:-len(self.suffix)], "bytes": size, "atime": mtime}
+                for p, size, mtime in self._scan()]
+        rows.sort(key=lambda r: r["atime"], reverse=True)
+        return rows
+
+    def prune(self, max_bytes: Optional[int] = None) -> int:
+        """Удалить самые давние записи, пока кэш не уложится в max_bytes. Возвращает число удалённых."""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        rows = sorted(self._scan(), key=lambda r: r[2])
+        total = sum(size for _p, size, _m in rows)
+        removed = 0
+        for p, size, _m in rows:
+            if total <= limit:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._size = total
+        return removed
+
+    def clear(self) -> int:
+        return self.prune(0)
+
+    def stats(self) -> Dict[str, Any]:
+        rows = list(self._scan())
+        return {
+            "root": str(self.root),
+            "entries": len(rows),
+            "bytes": sum(size for _p, size, _m in rows),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class CompileCache(DiskCache):
+    """Кэш результатов compile_ink, ключ — хэш исходника Ink и COMPILER_VERSION."""
+
+    @staticmethod
+    def key(ink_text: str) -> str:
+        h = hashlib.sha256(COMPILER_VERSION.encode("ascii"))
+        h.update(b"\0")
+        h.update(ink_text.encode("utf-8"))
+        return h.hexdigest()
+
+    def lookup(self, ink_text: str) -> Optional[Dict[str, Any]]:
+        return self.get(self.key(ink_text))
+
+    def compile(self, ink_text: str) -> Dict[str, Any]:
+        """compile_ink с кэшем: {"report", "json", "html", "cached": bool}."""
+        key = self.key(ink_text)
+        entry = self.get(key)
+        if entry is not None:
+            entry["cached"] = True
+            return entry
+        entry = compile_ink(ink_text)
+        self.put(key, entry)
+        entry["cached"] = False
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "compiler_version": COMPILER_VERSION}
+
+
+# ====== CLI ======
+def _main() -> None:
+    ap = argparse.ArgumentParser(description="Кэш компиляции Ink → JSON → HTML")
+    ap.add_argument("--dir", default=DEFAULT_DIR, help="каталог кэша (INK_CACHE_DIR)")
+    ap.add_argument("--max-mb", type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024),
+                    help="предел размера кэша, МБ (INK_CACHE_MAX_MB)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="число записей, занятое место, версия компилятора")
+    p = sub.add_parser("list", help="записи от свежих к старым")
+    p.add_argument("-n", type=int, default=20)
+    p = sub.add_parser("prune", help="вытеснить старые записи до предела")
+    p.add_argument("--to-mb", type=float, default=None, help="целевой размер (по умолчанию --max-mb)")
+    sub.add_parser("clear", help="удалить все записи")
+    p = sub.add_parser("build", help="скомпилировать .ink через кэш")
+    p.add_argument("ink", help="путь к .ink ('-' — stdin)")
+    p.add_argument("-o", "--out", help="куда записать HTML")
+    p.add_argument("--json", help="куда записать JSON")
+    args = ap.parse_args()
+
+    cache = CompileCache(args.dir, int(args.max_mb * 1024 * 1024))
+    if args.cmd == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    elif args.cmd == "list":
+        for row in cache.entries()[:args.n]:
+            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["atime"]))
+            print(f"{row['key'][:16]}  {row['bytes']:>10}  {ts}")
+    elif args.cmd == "prune":
+        limit = None if args.to_mb is None else int(args.to_mb * 1024 * 1024)
+        print(f"removed: {cache.prune(limit)}")
+    elif args.cmd == "clear":
+        print(f"removed: {cache.clear()}")
+    elif args.cmd == "build":
+        src = sys.stdin.read() if args.ink == "-" else pathlib.Path(args.ink).read_text(encoding="utf-8")
+        entry = cache.compile(src)
+        if args.out:
+            pathlib.Path(args.out).write_text(entry["html"], encoding="utf-8")
+        if args.json:
+            pathlib.Path(args.json).write_text(
+                json.dumps(entry["json"], ensure_ascii=False, indent=2), encoding="utf-8")
+        errors = entry["report"].get("errors", [])
+        print(f"{'hit' if entry['cached'] else 'miss'}: errors={len(errors)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,129 @@
+# ink_compact.py — компактный индексный формат сценария ink-json/v4-compact.
+#
+# В ink-json/v3 id шага хранится строкой трижды (order, steps[].id, options[].next/divert),
+# а text_raw почти всегда равен "speaker: text". Здесь:
+#   ids      — id шагов по порядку; шаг i лежит в steps[i], ссылки на шаги — целые индексы;
+#   speakers — таблица имён говорящих, в шаге — индекс;
+#   steps    — короткие ключи: s (speaker), t (text), r (text_raw, только если не выводится;
+#              шаг с text без text_raw хранит text полным ключом),
+#              o (options: [text, next, repeatable, id?]; id опускается, если это opt_N),
+#              d (divert), e (end), a (actions); прочие ключи шага переносятся как есть;
+#   knots    — узел → индексы его стежков.
+# END/DONE и неразрешённые цели остаются строками. Плеер читает этот формат напрямую.
+
+from typing import Any, Dict, List, Optional, Union
+
+FORMAT_V3 = "ink-json/v3"
+FORMAT_COMPACT = "ink-json/v4-compact"
+
+_STEP_KEYS = {"id", "speaker", "text", "text_raw", "options", "divert", "end", "actions"}
+
+
+def _raw_default(speaker: Optional[str], text: str) -> str:
+    return text if speaker is None else f"{speaker}: {text}"
+
+
+def to_compact(data: Dict[str, Any]) -> Dict[str, Any]:
+    """ink-json/v3 → ink-json/v4-compact (без потерь: from_compact вернёт исходные данные)."""
+    if data.get("format") == FORMAT_COMPACT:
+        return data
+    steps_in: List[Dict[str, Any]] = data.get("steps", [])
+    ids = [s["id"] for s in steps_in]
+    index = {sid: i for i, sid in enumerate(ids)}
+    speakers: List[str] = []
+    speaker_idx: Dict[str, int] = {}
+
+    def ref(tgt: Optional[str]) -> Union[int, str, None]:
+        return index.get(tgt, tgt) if tgt is not None else None
+
+    steps: List[Dict[str, Any]] = []
+    for s in steps_in:
+        rec: Dict[str, Any] = {}
+        speaker = s.get("speaker")
+        if speaker is not None:
+            if speaker not in speaker_idx:
+                speaker_idx[speaker] = len(speakers)
+                speakers.append(speaker)
+            rec["s"] = speaker_idx[speaker]
+        if "text" in s and "text_raw" not in s:
+            rec["text"] = s["text"]  # из "t" text_raw вывелся бы, а его в шаге нет
+        elif "text" in s:
+            rec["t"] = s["text"]
+            if s["text_raw"] != _raw_default(speaker, s["text"]):
+                rec["r"] = s["text_raw"]
+        elif "text_raw" in s:
+            rec["r"] = s["text_raw"]
+        if "options" in s:
+            opts = []
+            for j, o in enumerate(s["options"]):
+                row: List[Any] = [o.get("text", ""), ref(o.get("next")), 1 if o.get("repeatable") else 0]
+                if o.get("id") != f"opt_{j + 1}":
+                    row.append(o.get("id"))
+                opts.append(row)
+            rec["o"] = opts
+        if "divert" in s:
+            rec["d"] = ref(s["divert"])
+        if s.get("end"):
+            rec["e"] = 1
+        if "actions" in s:
+            rec["a"] = s["actions"]
+        for k, v in s.items():
+            if k not in _STEP_KEYS:
+                rec[k] = v
+        steps.append(rec)
+
+    out = {k: v for k, v in data.items() if k not in ("format", "order", "knots", "steps")}
+    return {
+        "format": FORMAT_COMPACT,
+        **out,
+        "ids": ids,
+        "knots": {k: [index[c] for c in kids] for k, kids in data.get("knots", {}).items()},
+        "speakers": speakers,
+        "steps": steps,
+    }
+
+
+def from_compact(data: Dict[str, Any]) -> Dict[str, Any]:
+    """ink-json/v4-compact → ink-json/v3 (тот же разбор, что делает плеер)."""
+    if data.get("format") != FORMAT_COMPACT:
+        return data
+    ids: List[str] = data["ids"]
+    speakers: List[str] = data.get("speakers", [])
+
+    def deref(t: Union[int, str, None]) -> Optional[str]:
+        return ids[t] if isinstance(t, int) else t
+
+    steps = []
+    for sid, rec in zip(ids, data["steps"]):
+        s: Dict[str, Any] = {"id": sid}
+        speaker = speakers[rec["s"]] if "s" in rec else None
+        if speaker is not None:
+            s["speaker"] = speaker
+        if "t" in rec:
+            s["text"] = rec["t"]
+            s["text_raw"] = rec["r"] if "r" in rec else _raw_default(speaker, rec["t"])
+        elif "r" in rec:
+            s["text_raw"] = rec["r"]
+        if "o" in rec:
+            s["options"] = [{"id": o[3] if len(o) > 3 else f"opt_{j + 1}", "text": o[0],
+                             "next": deref(o[1]), "repeatable": bool(o[2])}
+                            for j, o in enumerate(rec["o"])]
+        if "d" in rec:
+            s["divert"] = deref(rec["d"])
+        if rec.get("e"):
+            s["end"] = True
+        if "a" in rec:
+            s["actions"] = rec["a"]
+        for k, v in rec.items():
+            if k not in ("s", "t", "r", "o", "d", "e", "a"):
+                s[k] = v
+        steps.append(s)
+
+    out = {k: v for k, v in data.items() if k not in ("format", "ids", "knots", "speakers", "steps")}
+    return {
+        "format": FORMAT_V3,
+        **out,
+        "order": ids,
+        "knots": {k: [ids[i] for i in kids] for k, kids in data.get("knots", {}).items()},
+        "steps": steps,
+    }
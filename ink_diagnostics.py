@@ -0,0 +1,164 @@
+# ink_diagnostics.py — диагностики валидатора как компактные записи.
+#
+# Валидатор не форматирует строки: он копит Diag(код, строка, колонки, символ, аргументы).
+# Текст на нужном языке собирается только по запросу (message/text), а наружу — в цикл GPT
+# и в пакетные отчёты — уходят короткие словари с кодом и подсказкой (to_dict, dedupe).
+#
+#   {"code": "set_undeclared", "sev": "error", "line": 41, "col": [3, 8], "sym": "order",
+#    "hint": "declare 'VAR order = 0' before use"}
+#
+# Колонки считаются с 1, конец не включается; номера строк — как в исходнике.
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+ERROR, WARNING, INFO = "error", "warning", "info"
+
+# код → (уровень, подсказка по исправлению). Подсказки короткие и на английском:
+# их читает модель, а {symbol} и аргументы подставляются так же, как в сообщения.
+CODES: Dict[str, Tuple[str, Optional[str]]] = {
+    # заголовки
+    "knot_reserved":       (ERROR, "use '-> {symbol}' instead of a knot header"),
+    "knot_dotted":         (ERROR, "write '=== {knot} ===' with '== {stitch} ==' inside, refer as '-> {symbol}'"),
+    "knot_bad_name":       (ERROR, "knot names match [A-Za-z_][A-Za-z0-9_]*"),
+    "knot_bad_header":     (ERROR, None),
+    "stitch_outside_knot": (ERROR, "put '== {symbol} ==' under a '=== knot ==='"),
+    "stitch_bad_name":     (ERROR, "stitch names match [A-Za-z_][A-Za-z0-9_]*"),
+    "stitch_bad_header":   (ERROR, None),
+    # объявления
+    "var_redeclared":      (ERROR, "remove the second 'VAR {symbol}'"),
+    "list_empty":          (ERROR, "LIST {symbol} = a, b"),
+    "external_conflict":   (ERROR, "declare EXTERNAL {symbol} with one arity"),
+    # содержимое узлов
+    "outside_knot":        (ERROR, "move it under a '=== knot ==='"),
+    "choice_no_target":    (ERROR, "add '-> target' to the choice"),
+    "set_undeclared":      (ERROR, "declare 'VAR {symbol} = 0' before use"),
+    "expr_unsupported":    (WARNING, "use numbers, strings, declared vars, + - * / % < > == != && || !"),
+    "call_no_external":    (ERROR, "declare 'EXTERNAL {symbol}(...)' before the call"),
+    "call_arity":          (ERROR, "pass {declared} argument(s)"),
+    "inline_undeclared":   (ERROR, "declare 'VAR {symbol} = \"\"' before use"),
+    "cond_undeclared":     (ERROR, "declare 'VAR {symbol} = 0' before use"),
+    "glue":                (INFO, None),
+    # ссылки и граф шагов
+    "no_start":            (ERROR, "add '=== start ==='"),
+    "bad_target":          (ERROR, "point to an existing knot, knot.stitch or a stitch of '{src}'"),
+    "unreachable":         (WARNING, "link to '{symbol}' or remove it"),
+    "dead_end":            (WARNING, "add options, a divert or '-> END'"),
+    "end_unreachable":     (ERROR, "add '-> END' to a final step reachable from start"),
+    "trap_cycle":          (ERROR, "add an option or divert leading out of the cycle to END"),
+    "path_to_end":         (INFO, None),
+}
+
+MESSAGES: Dict[str, Dict[str, str]] = {
+    "ru": {
+        "knot_reserved": "Имя узла '{symbol}' зарезервировано. Используйте '-> {symbol}' вместо '=== {symbol} ==='.",
+        "knot_dotted": "Недопустимая точка в имени узла '{symbol}'. Правильно: '=== seat ===' и внутри '== one ==', а переходы — '-> seat.one'.",
+        "knot_bad_name": "Некорректное имя узла '{symbol}'. Разрешено: [A-Za-z_][A-Za-z0-9_]*.",
+        "knot_bad_header": "Некорректный заголовок узла: '{line}'",
+        "stitch_outside_knot": "Стежок '{symbol}' объявлен вне узла. Стежки допустимы только внутри узла.",
+        "stitch_bad_name": "Некорректное имя стежка '{symbol}'. Разрешено: [A-Za-z_][A-Za-z0-9_]*.",
+        "stitch_bad_header": "Некорректный заголовок стежка: '{line}'",
+        "var_redeclared": "Повторное объявление переменной '{symbol}'.",
+        "list_empty": "Пустой LIST '{symbol}'.",
+        "external_conflict": "EXTERNAL '{symbol}' объявлен с другим числом аргументов (было {was}, теперь {now}).",
+        "outside_knot": "Конструкция допустима только внутри узла (обнаружено вне узла).",
+        "choice_no_target": "Вариант без '-> target'.",
+        "set_undeclared": "Присваивание в необъявленную переменную '{symbol}' (объявите через VAR).",
+        "expr_unsupported": "Выражение '{symbol}' вне поддерживаемого подмножества ({reason}).",
+        "call_no_external": "Вызов внешней функции '{symbol}' без EXTERNAL.",
+        "call_arity": "Неверное число аргументов в '{symbol}': {argc}, ожидалось {declared}.",
+        "inline_undeclared": "Подстановка '{{{symbol}}}' без VAR-объявления.",
+        "cond_undeclared": "Условие использует необъявленную переменную '{symbol}'.",
+        "glue": "Используется glue '<>'.",
+        "no_start": "Отсутствует обязательный узел 'start'.",
+        "bad_target": "Переход из '{src}' в несуществующую цель '{symbol}'.",
+        "unreachable": "Шаг '{symbol}' недостижим из 'start'.",
+        "dead_end": "Шаг '{symbol}' — тупик: нет вариантов, перехода или '-> END'.",
+        "end_unreachable": "Из 'start' недостижим ни один '-> END' / '-> DONE'.",
+        "trap_cycle": "Цикл без выхода к END: {cycle}.",
+        "path_to_end": "Кратчайший путь к END: {path} → END (переходов: {steps}).",
+    },
+}
+DEFAULT_LANG = "ru"
+
+
+class Diag:
+    """Одна диагностика: код из CODES, строка, колонки [начало, конец), символ и аргументы сообщения."""
+    __slots__ = ("code", "level", "ln", "span", "symbol", "args")
+
+    def __init__(self, code: str, ln: Optional[int] = None, span: Optional[Tuple[int, int]] = None,
+                 symbol: Optional[str] = None, **args: Any):
+        self.code = code
+        self.level = CODES[code][0]
+        self.ln = ln
+        self.span = span
+        self.symbol = symbol
+        self.args = args
+
+    def _format(self, template: str) -> str:
+        return template.format(symbol=self.symbol, **self.args)
+
+    def message(self, lang: str = DEFAULT_LANG) -> str:
+        table = MESSAGES.get(lang) or MESSAGES[DEFAULT_LANG]
+        return self._format(table[self.code])
+
+    def text(self, lang: str = DEFAULT_LANG) -> str:
+        """Сообщение в прежнем виде "[строка] текст"."""
+        msg = self.message(lang)
+        return msg if self.ln is None else f"[{self.ln}] {msg}"
+
+    def hint(self) -> Optional[str]:
+        template = CODES[self.code][1]
+        return None if template is None else self._format(template)
+
+    def moved(self, offset: int) -> "Diag":
+        """Та же диагностика со сдвигом номера строки (для кусков InkSession)."""
+        if self.ln is None or not offset:
+            return self
+        return Diag(self.code, self.ln + offset, self.span, self.symbol, **self.args)
+
+    def to_dict(self, lang: Optional[str] = None) -> Dict[str, Any]:
+        """Компактная запись без пустых полей; msg — только если задан язык."""
+        out: Dict[str, Any] = {"code": self.code, "sev": self.level}
+        if self.ln is not None:
+            out["line"] = self.ln
+        if self.span is not None:
+            out["col"] = list(self.span)
+        if self.symbol is not None:
+            out["sym"] = self.symbol
+        hint = self.hint()
+        if hint is not None:
+            out["hint"] = hint
+        if lang is not None:
+            out["msg"] = self.message(lang)
+        return out
+
+    def __repr__(self) -> str:
+        return f"Diag({self.code!r}, {self.ln}, {self.symbol!r})"
+
+
+def dedupe(records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Свернуть записи to_dict с одинаковыми code/sym/hint в одну со списком строк "lines".
+
+    Порядок — по первому появлению; колонки при свёртке отбрасываются.
+    """
+    out: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for rec in records:
+        key = (rec["code"], rec.get("sym"), rec.get("hint"))
+        row = out.get(key)
+        if row is None:
+            row = out[key] = {k: v for k, v in rec.items() if k not in ("line", "col")}
+            row["lines"] = []
+        if "line" in rec and rec["line"] not in row["lines"]:
+            row["lines"].append(rec["line"])
+    for row in out.values():
+        if not row["lines"]:
+            del row["lines"]
+    return list(out.values())
+
+
+def histogram(records: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """Число записей по кодам — для сводок по многим сценариям."""
+    counts: Dict[str, int] = {}
+    for rec in records:
+        counts[rec["code"]] = counts.get(rec["code"], 0) + 1
+    return dict(sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])))
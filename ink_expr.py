@@ -0,0 +1,324 @@
+# ink_expr.py — компиляция выражений Ink (`~ x = expr`, `{cond ? A | B}`) в стековый байткод.
+#
+# Выражение разбирается один раз при компиляции и кладётся в JSON как список инструкций
+# в обратной польской записи:
+#   ["k", value]  — константа (число, строка, true/false/null)
+#   ["v", name]   — значение переменной (неизвестная переменная — ошибка при вычислении)
+#   ["u", op]     — унарный оператор: "!" или "-"
+#   ["b", op]     — бинарный оператор: + - * / % < > <= >= == != && ||
+# Ink-слова and/or/not/mod переводятся в &&/||/!/%. Плеер и ScenarioRunner вычисляют
+# байткод простым циклом со стеком — без eval, new Function и переписывания строк.
+#
+# Шаблон текста с инлайнами компилируется в список сегментов:
+#   "строка" | ["v", name] ({var}) | ["?", code, yes, no] ({cond ? yes | no})
+
+import math
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+Code = List[list]
+Segment = Union[str, list]
+
+# те же шаблоны, что у валидатора и плеера
+RE_INLINE_VAR = re.compile(r"\{([A-Za-z_]\w*)\}")
+RE_INLINE_TERNARY = re.compile(r"\{([^{}?:|]+?)\?\s*([^{}|]+?)\s*\|\s*([^{}]+?)\}")
+RE_INLINE = re.compile(RE_INLINE_TERNARY.pattern + "|" + RE_INLINE_VAR.pattern)
+
+_RE_TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<num>\d+(?:\.\d+)?)
+    | (?P<str>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+    | (?P<name>[A-Za-z_]\w*)
+    | (?P<op>&&|\|\||==|!=|<=|>=|[-+*/%<>!()])
+    )""", re.VERBOSE)
+
+_WORD_OPS = {"and": "&&", "or": "||", "not": "!", "mod": "%"}
+_CONSTS = {"true": True, "false": False, "null": None}
+
+# приоритеты бинарных операторов (больше — сильнее связывает)
+_BINARY = {
+    "||": 1, "&&": 2,
+    "==": 3, "!=": 3,
+    "<": 4, ">": 4, "<=": 4, ">=": 4,
+    "+": 5, "-": 5,
+    "*": 6, "/": 6, "%": 6,
+}
+
+
+class ExprError(ValueError):
+    """Выражение не укладывается в поддерживаемое подмножество."""
+
+
+def _tokenize(src: str) -> List[Tuple[str, Any]]:
+    out: List[Tuple[str, Any]] = []
+    pos, n = 0, len(src)
+    while pos < n:
+        if src[pos:].strip() == "":
+            break
+        m = _RE_TOKEN.match(src, pos)
+        if not m:
+            raise ExprError(f"Недопустимый символ в выражении: {src[pos:].strip()[:10]!r}")
+        pos = m.end()
+        if m.group("num") is not None:
+            s = m.group("num")
+            out.append(("k", float(s) if "." in s else int(s)))
+        elif m.group("str") is not None:
+            s = m.group("str")[1:-1]
+            out.append(("k", re.sub(r"\\(.)", r"\1", s)))
+        elif m.group("name") is not None:
+            name = m.group("name")
+            if name in _WORD_OPS:
+                out.append(("op", _WORD_OPS[name]))
+            elif name in _CONSTS:
+                out.append(("k", _CONSTS[name]))
+            else:
+                out.append(("v", name))
+        else:
+            out.append(("op", m.group("op")))
+    return out
+
+
+class _Parser:
+    """Разбор с приоритетами операторов (Pratt); сразу выдаёт байткод."""
+
+    def __init__(self, tokens: List[Tuple[str, Any]]):
+        self.toks = tokens
+        self.i = 0
+        self.code: Code = []
+
+    def _peek(self) -> Optional[Tuple[str, Any]]:
+        return self.toks[self.i] if self.i < len(self.toks) else None
+
+    def parse(self) -> Code:
+        if not self.toks:
+            raise ExprError("Пустое выражение")
+        self._expr(0)
+        if self.i != len(self.toks):
+            raise ExprError(f"Лишний фрагмент в выражении: {self.toks[self.i][1]!r}")
+        return self.code
+
+    def _expr(self, min_prec: int) -> None:
+        self._unary()
+        while True:
+            tok = self._peek()
+            if tok is None or tok[0] != "op" or tok[1] not in _BINARY:
+                return
+            prec = _BINARY[tok[1]]
+            if prec <= min_prec:
+                return
+            self.i += 1
+            self._expr(prec)
+            self.code.append(["b", tok[1]])
+
+    def _unary(self) -> None:
+        tok = self._peek()
+        if tok is None:
+            raise ExprError("Выражение оборвано")
+        kind, val = tok
+        self.i += 1
+        if kind == "op" and val in ("!", "-"):
+            # унарный оператор связывает сильнее любого бинарного: -a * b == (-a) * b
+            self._unary()
+            self.code.append(["u", val])
+        elif kind == "op" and val == "(":
+            self._expr(0)
+            close = self._peek()
+            if close != ("op", ")"):
+                raise ExprError("Нет закрывающей скобки")
+            self.i += 1
+        elif kind in ("k", "v"):
+            self.code.append([kind, val])
+        else:
+            raise ExprError(f"Неожиданный оператор: {val!r}")
+
+
+def compile_expr(src: str) -> Code:
+    """Скомпилировать выражение в байткод; ExprError, если оно вне подмножества."""
+    return _Parser(_tokenize(src)).parse()
+
+
+def compile_template(text: str) -> Optional[List[Segment]]:
+    """Разбить текст на сегменты с инлайнами; None, если инлайнов нет.
+
+    Условие, которое не компилируется, даёт сегмент ["?", None, yes, no] — такое условие
+    считается ложным, как и ошибка вычисления в плеере.
+    """
+    if "{" not in text:
+        return None
+    segs: List[Segment] = []
+    pos = 0
+    found = False
+    for m in RE_INLINE.finditer(text):
+        found = True
+        if m.start() > pos:
+            segs.append(text[pos:m.start()])
+        if m.group(1) is not None:
+            try:
+                code: Optional[Code] = compile_expr(m.group(1).strip())
+            except ExprError:
+                code = None
+            segs.append(["?", code, m.group(2).strip(), m.group(3).strip()])
+        else:
+            segs.append(["v", m.group(4)])
+        pos = m.end()
+    if not found:
+        return None
+    if pos < len(text):
+        segs.append(text[pos:])
+    return segs
+
+
+# ====== вычисление (семантика JS, как в плеере) ======
+
+def js_truthy(v: Any) -> bool:
+    if isinstance(v, float) and math.isnan(v):
+        return False
+    return bool(v)
+
+def js_str(v: Any) -> str:
+    if v is True: return "true"
+    if v is False: return "false"
+    if v is None: return "null"
+    if isinstance(v, float):
+        if math.isnan(v): return "NaN"
+        if math.isinf(v): return "Infinity" if v > 0 else "-Infinity"
+        if v.is_integer() and abs(v) < 2 ** 53: return str(int(v))
+    return str(v)
+
+def _num(v: Any) -> float:
+    if v is None: return 0
+    if isinstance(v, (bool, int, float)): return v + 0
+    try:
+        s = str(v).strip()
+        return float(s) if s else 0
+    except ValueError:
+        return math.nan
+
+def _norm(v: Any) -> Any:
+    # числа JS — double; целые результаты показываем без ".0"
+    if isinstance(v, float) and v.is_integer() and abs(v) < 2 ** 53:
+        return int(v)
+    return v
+
+def _div(a: Any, b: Any) -> Any:
+    a, b = _num(a), _num(b)
+    if b == 0:
+        return math.nan if a == 0 or math.isnan(a) else math.copysign(math.inf, a)
+    return _norm(a / b)
+
+def _mod(a: Any, b: Any) -> Any:
+    a, b = _num(a), _num(b)
+    if b == 0:
+        return math.nan
+    return _norm(math.fmod(a, b))
+
+def _cmp(op: str, a: Any, b: Any) -> bool:
+    if not (isinstance(a, str) and isinstance(b, str)):
+        a, b = _num(a), _num(b)
+    if op == "<": return a < b
+    if op == ">": return a > b
+    if op == "<=": return a <= b
+    return a >= b
+
+def _loose_eq(a: Any, b: Any) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    if isinstance(a, str) and isinstance(b, str):
+        return a == b
+    return _num(a) == _num(b)
+
+def _add(a: Any, b: Any) -> Any:
+    if isinstance(a, str) or isinstance(b, str):
+        return js_str(a) + js_str(b)
+    return _norm(_num(a) + _num(b))
+
+_PY_BINARY = {
+    "+": _add,
+    "-": lambda a, b: _norm(_num(a) - _num(b)),
+    "*": lambda a, b: _norm(_num(a) * _num(b)),
+    "/": _div,
+    "%": _mod,
+    "<": lambda a, b: _cmp("<", a, b),
+    ">": lambda a, b: _cmp(">", a, b),
+    "<=": lambda a, b: _cmp("<=", a, b),
+    ">=": lambda a, b: _cmp(">=", a, b),
+    "==": _loose_eq,
+    "!=": lambda a, b: not _loose_eq(a, b),
+    "&&": lambda a, b: b if js_truthy(a) else a,
+    "||": lambda a, b: a if js_truthy(a) else b,
+}
+
+
+def evaluate(code: Code, vars: Dict[str, Any]) -> Any:
+    """Вычислить байткод над словарём переменных. KeyError — неизвестная переменная."""
+    st: List[Any] = []
+    for ins in code:
+        op = ins[0]
+        if op == "k":
+            st.append(ins[1])
+        elif op == "v":
+            if ins[1] not in vars:
+                raise KeyError(f"Неизвестная переменная: {ins[1]}")
+            st.append(vars[ins[1]])
+        elif op == "u":
+            a = st.pop()
+            st.append(not js_truthy(a) if ins[1] == "!" else _norm(-_num(a)))
+        elif op == "b":
+            b = st.pop()
+            a = st.pop()
+            st.append(_PY_BINARY[ins[1]](a, b))
+        else:
+            raise ExprError(f"Неизвестная инструкция: {op!r}")
+    return st.pop()
+
+
+def to_callable(code: Code) -> Callable[[Dict[str, Any]], Any]:
+    """Собрать байткод в дерево замыканий: f(vars) == evaluate(code, vars), но без цикла разбора.
+
+    Для многократного вычисления одного выражения (ScenarioRunner): сборка — один раз,
+    дальше — только вызовы. Оба операнда && и || вычисляются, как в стековой машине.
+    """
+    st: List[Callable[[Dict[str, Any]], Any]] = []
+    for ins in code:
+        op = ins[0]
+        if op == "k":
+            st.append(lambda vars, c=ins[1]: c)
+        elif op == "v":
+            def var(vars: Dict[str, Any], name: str = ins[1]) -> Any:
+                if name not in vars:
+                    raise KeyError(f"Неизвестная переменная: {name}")
+                return vars[name]
+            st.append(var)
+        elif op == "u":
+            a = st.pop()
+            if ins[1] == "!":
+                st.append(lambda vars, a=a: not js_truthy(a(vars)))
+            else:
+                st.append(lambda vars, a=a: _norm(-_num(a(vars))))
+        elif op == "b":
+            b = st.pop()
+            a = st.pop()
+            st.append(lambda vars, a=a, b=b, fn=_PY_BINARY[ins[1]]: fn(a(vars), b(vars)))
+        else:
+            raise ExprError(f"Неизвестная инструкция: {op!r}")
+    if len(st) != 1:
+        raise ExprError("Некорректный байткод")
+    return st[0]
+
+
+def render_template(segs: List[Segment], vars: Dict[str, Any]) -> str:
+    """Собрать текст по сегментам compile_template (как renderInline в плеере, без <br>)."""
+    out: List[str] = []
+    for seg in segs:
+        if isinstance(seg, str):
+            out.append(seg)
+        elif seg[0] == "v":
+            out.append(js_str(vars[seg[1]]) if seg[1] in vars else "{" + seg[1] + "}")
+        else:
+            _, code, yes, no = seg
+            try:
+                ok = code is not None and js_truthy(evaluate(code, vars))
+            except Exception:
+                ok = False
+            out.append(yes if ok else no)
+    return "".join(out)
@@ -0,0 +1,172 @@
+# ink_frontend.py — общий лексер Ink-подмножества для валидатора и парсера.
+#
+# Текст один раз режется на строки без комментариев, каждая непустая строка один раз
+# классифицируется. Получившийся поток токенов с номерами строк читают оба прохода:
+# InkValidator.scan_tokens (проверки) и ink_to_json (построение шагов).
+
+import re
+from typing import Container, Iterable, Iterator, List, Optional
+
+RE_KNOT    = re.compile(r"^===\s*([A-Za-z_]\w*)\s*===$")
+RE_STITCH  = re.compile(r"^==\s*([A-Za-z_]\w*)\s*==$")
+# "похожие" заголовки с неправильным именем (например seat.one) — для понятных ошибок валидатора
+RE_KNOT_LOOKS_LIKE   = re.compile(r"^===\s*(.+?)\s*===$")
+RE_STITCH_LOOKS_LIKE = re.compile(r"^==\s*(.+?)\s*==$")
+RE_CHOICE  = re.compile(r"^([+*])\s*(.*?)\s*(?:->\s*([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?))?\s*$")
+RE_DIVERT  = re.compile(r"^->\s*(END|DONE|[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?)\s*$")
+RE_VAR     = re.compile(r"^VAR\s+([A-Za-z_]\w*)\s*=\s*(.+?)\s*$")
+RE_SET     = re.compile(r"^~\s*([A-Za-z_]\w*)\s*=\s*(.+?)\s*$")
+RE_CALL    = re.compile(r"^~\s*([A-Za-z_]\w*)\s*\((.*?)\)\s*$")
+RE_LIST    = re.compile(r"^LIST\s+([A-Za-z_]\w*)\s*=\s*(.+?)\s*$")
+RE_EXTERNAL= re.compile(r"^EXTERNAL\s+([A-Za-z_]\w*)\s*\((.*?)\)\s*$")
+# RE_SET и RE_CALL в одном шаблоне: после имени идёт либо "=", либо "(" — ветки не пересекаются
+RE_ACTION  = re.compile(r"^~\s*([A-Za-z_]\w*)\s*(?:=\s*(.+?)|\((.*?)\))\s*$")
+
+# Виды строк
+T_TEXT, T_VAR, T_LIST, T_EXTERNAL, T_KNOT, T_STITCH, T_CHOICE, T_DIVERT, T_SET, T_CALL = (
+    "text", "var", "list", "external", "knot", "stitch", "choice", "divert", "set", "call",
+)
+T_BAD_KNOT, T_BAD_STITCH = "bad_knot", "bad_stitch"  # для парсера это обычный текст
+
+# Первый символ строки однозначно определяет единственный шаблон, который имеет смысл пробовать:
+# все шаблоны якорные и начинаются с разных символов. Остальные строки — обычный текст.
+_DISPATCH = {
+    "+": (T_CHOICE, RE_CHOICE),
+    "*": (T_CHOICE, RE_CHOICE),
+    "-": (T_DIVERT, RE_DIVERT),
+    "V": (T_VAR, RE_VAR),
+    "L": (T_LIST, RE_LIST),
+    "E": (T_EXTERNAL, RE_EXTERNAL),
+}
+
+def strip_comments(line: str) -> str:
+    pos = line.find("//")
+    return line if pos == -1 else line[:pos]
+
+def classify(line: str):
+    """Вернуть (вид, match) для непустой обрезанной строки, проверив не более одного шаблона
+    (для строк на "=" — ещё «похожий» заголовок, только если настоящий не подошёл)."""
+    c = line[0]
+    if c == "=":
+        if line.startswith("==="):
+            m = RE_KNOT.match(line)
+            if m:
+                return T_KNOT, m
+            m = RE_KNOT_LOOKS_LIKE.match(line)
+            if m:
+                return T_BAD_KNOT, m
+        else:
+            m = RE_STITCH.match(line)
+            if m:
+                return T_STITCH, m
+        m = RE_STITCH_LOOKS_LIKE.match(line)
+        return (T_BAD_STITCH, m) if m else (T_TEXT, None)
+    if c == "~":
+        m = RE_ACTION.match(line)
+        if m is None:
+            return T_TEXT, None
+        return (T_SET, m) if m.group(2) is not None else (T_CALL, m)
+    entry = _DISPATCH.get(c)
+    if entry is None:
+        return T_TEXT, None
+    kind, rx = entry
+    m = rx.match(line)
+    return (kind, m) if m else (T_TEXT, None)
+
+
+class Token:
+    """Непустая строка исходника: номер, вид, match и текст.
+
+    raw — строка без комментария и хвостовых пробелов (нужна для glue), text — она же без
+    ведущих пробелов, по ней и сделана классификация.
+    """
+    __slots__ = ("ln", "kind", "m", "raw", "text")
+
+    def __init__(self, ln: int, kind: str, m: Optional[re.Match], raw: str, text: str):
+        self.ln = ln
+        self.kind = kind
+        self.m = m
+        self.raw = raw
+        self.text = text
+
+    @property
+    def glue(self) -> bool:
+        return self.raw.endswith("<>")
+
+    def __repr__(self) -> str:
+        return f"Token({self.ln}, {self.kind!r}, {self.text!r})"
+
+
+def iter_tokens(lines: Iterable[str], first_ln: int = 1) -> Iterator[Token]:
+    """Лениво превратить строки исходника в токены (пустые после удаления комментария пропускаются)."""
+    for ln, line in enumerate(lines, start=first_ln):
+        raw = strip_comments(line).rstrip()
+        text = raw.strip()
+        if not text:
+            continue
+        kind, m = classify(text)
+        yield Token(ln, kind, m, raw, text)
+
+def tokenize(ink_text: str) -> List[Token]:
+    return list(iter_tokens(ink_text.splitlines()))
+
+
+# Разрешение целей переходов — одно на компилятор (ink_to_json) и граф валидатора.
+# Голая цель внутри узла — сначала стежок этого узла, затем узел; у "a.b" без такого стежка —
+# узел b. Неразрешённая цель остаётся как есть (в плеере — «Нет шага»).
+def _normalize_target(tgt: Optional[str], current_knot: Optional[str]) -> Optional[str]:
+    if not tgt:
+        return None
+    if tgt in ("END","DONE"):
+        return tgt
+    if "." in tgt:
+        return tgt
+    return f"{current_knot}.{tgt}" if current_knot else tgt
+
+def _resolve_target_late(src_step_id: str, tgt: str, ids: Container[str]) -> str:
+    if not tgt or tgt in ('END','DONE'): return tgt
+    # exact id (в т.ч. узел без точки)
+    if tgt in ids: return tgt
+    # if dotted but missing -> maybe right part is a knot id
+    if '.' in tgt:
+        left, right = tgt.split('.', 1)
+        if right in ids and '.' not in right:
+            return right
+    # else, try relative stitch under source knot
+    sk = src_step_id.split('.')[0] if '.' in src_step_id else src_step_id
+    cand = f"{sk}.{tgt}"
+    if cand in ids: return cand
+    return tgt  # leave as-is (will show runtime 'Нет шага' if wrong)
+
+
+def iter_glued(tokens: Iterable[Token]) -> Iterator[Token]:
+    """Склеить строки с glue '<>' на конце со следующими (как это делает Ink).
+
+    Токены без glue проходят как есть; склеенная строка классифицируется заново и получает
+    номер первой строки цепочки. Пустая строка (разрыв в номерах) обрывает цепочку.
+    """
+    buf: Optional[str] = None
+    first = last = 0
+    for tok in tokens:
+        if buf is not None and tok.ln != last + 1:
+            yield from _glued_token(first, buf)
+            buf = None
+        if tok.glue:
+            if buf is None:
+                buf, first = "", tok.ln
+            buf += tok.raw[:-2]
+            last = tok.ln
+            continue
+        if buf is None:
+            yield tok
+        else:
+            yield from _glued_token(first, buf + tok.raw)
+            buf = None
+    if buf is not None:
+        yield from _glued_token(first, buf)
+
+def _glued_token(ln: int, raw: str) -> Iterator[Token]:
+    text = raw.strip()
+    if text:
+        kind, m = classify(text)
+        yield Token(ln, kind, m, raw, text)
@@ -0,0 +1,291 @@
+# ink_incremental.py — инкрементальная компиляция Ink по узлам для цикла правок GPT.
+#
+# Исходник режется на куски по заголовкам `=== knot ===`; каждый кусок хэшируется.
+# Лексер, разбор (ink_to_json) и построчные проверки (InkValidator) повторяются только для
+# изменившихся кусков, а межузловые шаги — позднее разрешение целей и проверка ссылок —
+# выполняются заново по уже готовым таблицам. Результат совпадает с
+# parse_ink_to_json / validate_ink на том же тексте.
+#
+# Внутри изменившегося куска лексер тоже не работает заново: классификация строк кэшируется
+# по их содержимому, так что между раундами классифицируются только правленые строки.
+#
+# StreamChecker — построчные проверки по мере поступления текста (потоковый ответ модели):
+# ошибки заголовков и вариантов видны по одной строке, и генерацию можно оборвать сразу.
+
+from __future__ import annotations
+
+import hashlib
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import ink_to_json as ij
+from ink_frontend import RE_KNOT, Token, classify, iter_glued, strip_comments
+from ink_diagnostics import Diag
+from ink_validator import InkValidator
+
+# Ошибки, которые видны по одной строке и не исправятся дальнейшим текстом
+FATAL_CODES = frozenset({
+    "knot_dotted", "knot_bad_name", "knot_bad_header", "knot_reserved",
+    "stitch_outside_knot", "stitch_bad_name", "stitch_bad_header",
+    "choice_no_target", "outside_knot",
+})
+
+
+class _LineCache:
+    """Классификация строк, ключ — содержимое строки (после удаления комментария и пробелов).
+
+    Match-объекты неизменяемы, поэтому один результат classify годится для всех вхождений
+    строки. Хранятся только строки последней версии текста (см. retain).
+    """
+    __slots__ = ("_table", "misses")
+
+    def __init__(self) -> None:
+        self._table: Dict[str, Tuple[str, Any]] = {}
+        self.misses = 0
+
+    def tokens(self, lines: List[str]) -> List[Token]:
+        table = self._table
+        out: List[Token] = []
+        for ln, line in enumerate(lines, start=1):
+            raw = strip_comments(line).rstrip()
+            text = raw.strip()
+            if not text:
+                continue
+            hit = table.get(text)
+            if hit is None:
+                hit = table[text] = classify(text)
+                self.misses += 1
+            out.append(Token(ln, hit[0], hit[1], raw, text))
+        return out
+
+    def retain(self, lines: List[str]) -> None:
+        """Забыть строки, которых нет в текущей версии, если таблица заметно разрослась."""
+        if len(self._table) > 2 * len(lines) + 1024:
+            keep = {strip_comments(l).strip() for l in lines}
+            self._table = {k: v for k, v in self._table.items() if k in keep}
+
+
+class _Chunk:
+    __slots__ = ("first_ln", "lines", "digest", "_lexer", "_tokens")
+
+    def __init__(self, first_ln: int, lines: List[str], lexer: Optional[_LineCache] = None):
+        self.first_ln = first_ln
+        self.lines = lines  # строки исходника как есть: комментарии срезаются лексером
+        self.digest = hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+        self._lexer = lexer
+        self._tokens: Optional[List[Token]] = None
+
+    @property
+    def tokens(self) -> List[Token]:
+        """Токены куска (номера строк — от начала куска); лексер запускается только при промахе кэша."""
+        if self._tokens is None:
+            self._tokens = (self._lexer or _LineCache()).tokens(self.lines)
+        return self._tokens
+
+
+def _header_line(line: str) -> str:
+    return strip_comments(line).rstrip()
+
+
+def split_knots(ink_text: str, lexer: Optional[_LineCache] = None) -> List[_Chunk]:
+    """Разрезать текст на куски: первый — шапка вместе с первым узлом, дальше по узлу на кусок.
+
+    Шапка не отделяется от первого узла, потому что текст до первого заголовка
+    парсер отдаёт первому шагу. Граница не ставится после строки с glue '<>'.
+    Целиком обрабатываются только строки-кандидаты в заголовки; остальные строки
+    режутся и классифицируются лишь в кусках, которых нет в кэше.
+    """
+    lines = ink_text.splitlines()
+    if lexer is not None:
+        lexer.retain(lines)
+    starts = [0]
+    seen_knot = False
+    for i in [i for i, line in enumerate(lines) if "===" in line]:
+        if RE_KNOT.match(_header_line(lines[i]).strip()):
+            if i and _header_line(lines[i - 1]).endswith("<>"):
+                continue  # приклеен к предыдущей строке — это текст, а не начало узла
+            if seen_knot:
+                starts.append(i)
+            seen_knot = True
+    starts.append(len(lines))
+    return [_Chunk(a + 1, lines[a:b], lexer) for a, b in zip(starts, starts[1:])]
+
+
+class _ParsedChunk:
+    __slots__ = ("meta", "steps")
+
+    def __init__(self, tokens: List[Token]):
+        self.meta = ij._new_meta()
+        self.steps = list(ij._iter_steps(iter_glued(tokens), self.meta))
+
+
+class _CheckedChunk:
+    """Результат InkValidator.scan по одному куску; номера строк — от начала куска."""
+    __slots__ = ("diags", "knots", "stitches", "links", "nodes", "filled", "edges", "vars", "externals")
+
+    def __init__(self, tokens: List[Token], vars_before: FrozenSet[str], externals_before: Dict[str, int]):
+        v = InkValidator("")
+        v.vars = set(vars_before)
+        v.externals = dict(externals_before)
+        v.scan_tokens(tokens)
+        self.diags = v.diags
+        self.knots = v.knots
+        self.stitches = v.stitches
+        self.links = v.links
+        self.nodes = v.nodes
+        self.filled = v.filled
+        self.edges = v.edges
+        self.vars = frozenset(v.vars)  # состояние после куска — вход для следующего
+        self.externals = v.externals
+
+
+class InkSession:
+    """Долгоживущая сессия компиляции одного сценария, который правится по частям.
+
+        session = InkSession()
+        report = session.validate(ink)       # как validate_ink(ink)
+        data = session.compile(ink)          # как parse_ink_to_json(ink)
+
+    Кэши хранят только куски и строки последней версии текста, поэтому память не растёт
+    от раунда к раунду. В last_stats — сколько кусков пришлось разобрать/проверить заново
+    и сколько строк классифицировать в последнем вызове.
+    """
+
+    def __init__(self) -> None:
+        self._lexer = _LineCache()
+        self._parsed: Dict[str, _ParsedChunk] = {}
+        self._checked: Dict[Tuple[str, FrozenSet[str], Tuple[Tuple[str, int], ...]], _CheckedChunk] = {}
+        self.last_stats: Dict[str, int] = {}
+
+    # --- ink → JSON ---
+    def compile(self, ink_text: str) -> Dict[str, Any]:
+        misses = self._lexer.misses
+        chunks = split_knots(ink_text, self._lexer)
+        fresh: Dict[str, _ParsedChunk] = {}
+        reparsed = 0
+        meta = ij._new_meta()
+        steps: Dict[str, Dict[str, Any]] = {}
+        order: List[str] = []
+        pos: Dict[str, int] = {}
+        knots: Dict[str, List[str]] = {}
+        for ch in chunks:
+            pc = fresh.get(ch.digest) or self._parsed.get(ch.digest)
+            if pc is None:
+                pc = _ParsedChunk(ch.tokens)
+                reparsed += 1
+            fresh[ch.digest] = pc
+            meta["vars"].update(pc.meta["vars"])
+            meta["lists"].update((k, list(v)) for k, v in pc.meta["lists"].items())
+            for fn in pc.meta["externals"]:
+                if fn not in meta["externals"]:
+                    meta["externals"].append(fn)
+            for step in pc.steps:
+                steps[step["id"]] = step
+                ij._register_id(step["id"], pos, order, knots)
+        self._parsed = fresh
+        self.last_stats = {"chunks": len(chunks), "reparsed": reparsed,
+                           "reclassified": self._lexer.misses - misses}
+
+        # межузловой проход — по копиям, кэшированные шаги остаются неразрешёнными
+        finished = []
+        for step in steps.values():
+            step = dict(step)
+            if "options" in step:
+                step["options"] = [dict(o) for o in step["options"]]
+            ij._finish_step(step, steps, knots)
+            finished.append(step)
+        return {**meta, "order": order, "knots": knots, "steps": finished}
+
+    # --- валидация ---
+    def _validator(self, ink_text: str) -> InkValidator:
+        misses = self._lexer.misses
+        chunks = split_knots(ink_text, self._lexer)
+        fresh: Dict[Any, _CheckedChunk] = {}
+        rechecked = 0
+        total = InkValidator(ink_text)
+        vars_state: FrozenSet[str] = frozenset()
+        externals: Dict[str, int] = {}
+        for ch in chunks:
+            # результат куска зависит от объявлений VAR/EXTERNAL, сделанных выше него
+            key = (ch.digest, vars_state, tuple(sorted(externals.items())))
+            cc = fresh.get(key) or self._checked.get(key)
+            if cc is None:
+                cc = _CheckedChunk(ch.tokens, vars_state, externals)
+                rechecked += 1
+            fresh[key] = cc
+            offset = ch.first_ln - 1
+            total.diags.extend(d.moved(offset) for d in cc.diags)
+            total.knots |= cc.knots
+            total.stitches |= cc.stitches
+            total.links.extend((src, tgt, ln + offset, span) for src, tgt, ln, span in cc.links)
+            for node, ln in cc.nodes.items():
+                total.nodes.setdefault(node, ln + offset)
+            total.filled |= cc.filled
+            total.edges.extend((src, tgt, ln + offset) for src, tgt, ln in cc.edges)
+            vars_state = cc.vars
+            externals = cc.externals
+        total.vars = set(vars_state)
+        total.externals = dict(externals)
+        self._checked = fresh
+        self.last_stats = {"chunks": len(chunks), "rechecked": rechecked,
+                           "reclassified": self._lexer.misses - misses}
+        total.check_links()
+        return total
+
+    def validate(self, ink_text: str, lang: Optional[str] = None) -> Dict[str, Any]:
+        return self._validator(ink_text).report(lang)
+
+    def validate_and_compile(self, ink_text: str) -> Dict[str, Any]:
+        report = self.validate(ink_text)
+        stats = self.last_stats
+        data = self.compile(ink_text)
+        reclassified = stats["reclassified"] + self.last_stats["reclassified"]
+        self.last_stats = {**stats, **self.last_stats, "reclassified": reclassified}
+        return {"report": report, "json": data}
+
+
+
+class StreamChecker:
+    """Построчные проверки InkValidator для текста, приходящего кусками.
+
+        checker = StreamChecker()
+        for piece in pieces:
+            if checker.feed(piece):      # новые ошибки из FATAL_CODES по законченным строкам
+                break
+
+    Проверяются только законченные строки; строки с glue '<>' и их продолжения пропускаются —
+    склейку увидит полная проверка. Ссылки и граф шагов проверяет только validate_ink.
+    """
+
+    __slots__ = ("validator", "lines", "fatal", "_tail", "_glued")
+
+    def __init__(self) -> None:
+        self.validator = InkValidator("")
+        self.validator.scan_tokens(())  # состояние scan — как в начале файла
+        self.lines = 0
+        self.fatal: List[Diag] = []
+        self._tail = ""
+        self._glued = False
+
+    def feed(self, text: str) -> List[Diag]:
+        *done, self._tail = (self._tail + text).split("\n")
+        new: List[Diag] = []
+        for line in done:
+            new.extend(self._line(line))
+        self.fatal.extend(new)
+        return new
+
+    def _line(self, line: str) -> List[Diag]:
+        self.lines += 1
+        raw = strip_comments(line).rstrip()
+        text = raw.strip()
+        if not text:
+            self._glued = False  # пустая строка обрывает цепочку glue, как в iter_glued
+            return []
+        glued, self._glued = self._glued, raw.endswith("<>")
+        if glued or self._glued:
+            return []
+        kind, m = classify(text)
+        v = self.validator
+        n = len(v.diags)
+        v._check(Token(self.lines, kind, m, raw, text))
+        return [d for d in v.diags[n:] if d.code in FATAL_CODES]
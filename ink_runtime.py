@@ -0,0 +1,392 @@
+# ink_runtime.py — проигрывание ink-json/v3 без браузера (та же семантика, что у плеера).
+#
+# ScenarioRunner один раз переводит JSON в компактные шаги со __slots__ и собирает выражения
+# (~ set, {cond ? A | B}) в замыкания ink_expr.to_callable; одинаковые выражения собираются
+# один раз на процесс. Дальше каждый Playthrough — лишь словарь переменных и история.
+#
+# Повторяется поведение JS из json_to_html_player.py, включая его особенности:
+#   - выбранные варианты запоминаются по opt.id, а id вида "opt_N" повторяются в разных шагах,
+#     поэтому неповторяемый opt_1 одного шага скрывает opt_1 всех остальных;
+#   - вариант без next возвращает на тот же шаг; шаг без текста, UI и действий — вход
+#     в первый стежок узла; реплика шага попадает в расшифровку только при первом показе;
+#   - ошибка в ~ set не останавливает сценарий, а попадает в журнал.
+# Переход на несуществующий шаг заканчивает прохождение (MISSING): плеер в этом случае
+# оставляет на экране старые кнопки, но это сбой сценария, а не путь по нему.
+#
+#   python ink_runtime.py scenario.json --choices 0,1,0          # проиграть скрипт выборов
+#   python ink_runtime.py scenario.json --random 10000 --seed 1  # случайные прохождения, скорость
+
+from __future__ import annotations
+
+import argparse
+import functools
+import html
+import json
+import random
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from ink_compact import FORMAT_COMPACT, from_compact
+from ink_expr import ExprError, compile_expr, compile_template, js_str, js_truthy, to_callable
+
+Fn = Callable[[Dict[str, Any]], Any]
+
+# состояния прохождения
+CHOICE = "choice"        # ждём выбор варианта
+CONTINUE = "continue"    # кнопка «Далее» (переход без вариантов, auto_continue=False)
+END = "end"              # «Сценарий завершён»
+DEAD_END = "dead_end"    # «Нет вариантов. Конец.»
+MISSING = "missing"      # «❌ Нет шага»
+LIMIT = "limit"          # превышен max_steps (например, цикл из переходов)
+FINISHED = (END, DEAD_END, MISSING, LIMIT)
+
+
+@functools.lru_cache(maxsize=4096)
+def _expr_fn(src: str) -> Fn:
+    return to_callable(compile_expr(src))
+
+
+@functools.lru_cache(maxsize=4096)
+def _template_segs(text: str) -> Optional[tuple]:
+    return _compile_segs(compile_template(text))
+
+
+def _compile_segs(tpl: Optional[list]) -> Optional[tuple]:
+    # строки остаются строками; ["v", name] → ("v", name); ["?", code, yes, no] → ("?", fn|None, yes, no)
+    if tpl is None:
+        return None
+    out: List[Any] = []
+    for seg in tpl:
+        if isinstance(seg, str):
+            out.append(seg)
+        elif seg[0] == "v":
+            out.append(("v", seg[1]))
+        else:
+            try:
+                fn: Optional[Fn] = to_callable(seg[1]) if seg[1] else None
+            except ExprError:
+                fn = None
+            out.append(("?", fn, seg[2], seg[3]))
+    return tuple(out)
+
+
+def _render(segs: tuple, vars: Dict[str, Any]) -> str:
+    out: List[str] = []
+    for seg in segs:
+        if isinstance(seg, str):
+            out.append(seg)
+        elif seg[0] == "v":
+            out.append(js_str(vars[seg[1]]) if seg[1] in vars else "{" + seg[1] + "}")
+        else:
+            try:
+                ok = seg[1] is not None and js_truthy(seg[1](vars))
+            except Exception:
+                ok = False
+            out.append(seg[2] if ok else seg[3])
+    return "".join(out)
+
+
+_RE_TAG = re.compile(r"<[^>]*>")
+
+
+def _text_content(rendered: str) -> str:
+    # как elText.textContent после innerHTML: \n стал <br>, теги и <br> пропадают
+    return html.unescape(_RE_TAG.sub("", rendered.replace("\n", "")))
+
+
+class Option:
+    __slots__ = ("id", "text", "next", "repeatable")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.id: Optional[str] = raw.get("id")
+        self.text: str = raw.get("text") or ""
+        self.next: Optional[str] = raw.get("next")
+        self.repeatable = bool(raw.get("repeatable"))
+
+
+class Action:
+    """~ set (fn — собранное выражение, None — не компилируется) или вызов EXTERNAL."""
+    __slots__ = ("type", "var", "expr", "fn", "error", "args")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.type: str = raw.get("type", "")
+        self.var: Optional[str] = raw.get("var") if self.type == "set" else raw.get("fn")
+        self.expr: str = raw.get("expr", "")
+        self.args: str = raw.get("args") or ""
+        self.fn: Optional[Fn] = None
+        self.error: Optional[str] = None
+        if self.type == "set":
+            try:
+                # байткод из компилятора, как у плеера (act.code); разбор expr — для старых сборок
+                self.fn = to_callable(raw["code"]) if raw.get("code") else _expr_fn(self.expr)
+            except ExprError as e:
+                self.error = str(e)
+
+
+class Step:
+    __slots__ = ("id", "speaker", "raw", "segs", "options", "divert", "end", "actions", "empty")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.id: str = raw["id"]
+        self.speaker: str = raw.get("speaker") or "system"
+        self.raw: str = raw.get("text_raw") or raw.get("text") or ""
+        # tpl из компилятора; для старых сборок без tpl шаблон собирается из текста
+        self.segs = _compile_segs(raw["tpl"]) if raw.get("tpl") else _template_segs(self.raw)
+        self.options = tuple(Option(o) for o in raw.get("options") or ())
+        self.divert: Optional[str] = raw.get("divert")
+        self.end = bool(raw.get("end"))
+        self.actions = tuple(Action(a) for a in raw.get("actions") or ())
+        has_text = bool(raw.get("text_raw") or raw.get("text") or raw.get("speaker"))
+        has_ui = bool(self.options or raw.get("audio") or self.end or self.divert)
+        self.empty = not (has_text or has_ui or self.actions)
+
+    def text(self, vars: Dict[str, Any]) -> str:
+        return self.raw if self.segs is None else _render(self.segs, vars)
+
+
+class ScenarioRunner:
+    """Сценарий ink-json/v3 (или v4-compact), собранный для многократного проигрывания.
+
+    auto_continue=True — переходы без вариантов (кнопка «Далее» в плеере) выполняются сами;
+    False — они ждут proceed() / выбора 0, как клики в плеере.
+    max_steps — предел показанных шагов за прохождение (защита от циклов из переходов).
+    """
+
+    def __init__(self, data: Dict[str, Any], auto_continue: bool = True, max_steps: int = 10000):
+        if data.get("format") == FORMAT_COMPACT:
+            data = from_compact(data)
+        self.title: str = data.get("title") or data.get("scenario_id") or "Scenario"
+        self.vars: Dict[str, Any] = dict(data.get("vars") or {})
+        self.steps: Dict[str, Step] = {s["id"]: Step(s) for s in data.get("steps", [])}
+        self.auto_continue = auto_continue
+        self.max_steps = max_steps
+        self._knots: Optional[Dict[str, List[str]]] = data.get("knots")
+        self._order: Optional[List[str]] = data.get("order")
+        self._child: Dict[str, Optional[str]] = {}
+
+    def first_child_stitch(self, knot: str) -> Optional[str]:
+        """Как firstChildStitch в плеере: knot.start, затем индекс knots, порядок order, имена."""
+        if knot in self._child:
+            return self._child[knot]
+        prefix = knot + "."
+        child: Optional[str] = None
+        if prefix + "start" in self.steps:
+            child = prefix + "start"
+        elif self._knots is not None:
+            kids = self._knots.get(knot)
+            child = kids[0] if kids else None
+        else:
+            if isinstance(self._order, list) and knot in self._order:
+                for sid in self._order[self._order.index(knot) + 1:]:
+                    if sid and sid.startswith(prefix):
+                        child = sid
+                        break
+                    if sid and "." not in sid:
+                        break
+            if child is None:
+                kids = sorted(k for k in self.steps if k.startswith(prefix))
+                child = kids[0] if kids else None
+        self._child[knot] = child
+        return child
+
+    def entry(self) -> str:
+        start = self.steps.get("start")
+        if start is not None and start.empty:
+            return self.first_child_stitch("start") or "start"
+        return "start"
+
+    def start(self) -> "Playthrough":
+        return Playthrough(self)
+
+    def play(self, choices: Iterable[Union[int, str]]) -> "Playthrough":
+        """Проиграть скрипт выборов: номер среди видимых вариантов или их текст.
+
+        Скрипт может закончиться раньше сценария — тогда прохождение остаётся на текущем шаге.
+        Выбор в законченном прохождении — ValueError.
+        """
+        run = Playthrough(self)
+        for choice in choices:
+            run.choose(choice)
+        return run
+
+    def random_walk(self, rng: Optional[random.Random] = None, max_choices: int = 1000) -> "Playthrough":
+        """Случайное прохождение до конца сценария или max_choices выборов."""
+        rng = rng or random.Random()
+        run = Playthrough(self)
+        for _ in range(max_choices):
+            if run.finished:
+                break
+            run.choose(rng.randrange(len(run.options())) if run.status == CHOICE else 0)
+        return run
+
+
+class Playthrough:
+    """Состояние одного прохождения: переменные, выбранные варианты, история и расшифровка."""
+    __slots__ = ("runner", "vars", "chosen", "history", "transcript", "log", "calls",
+                 "step", "text", "status", "_logged", "_shown", "_visible")
+
+    def __init__(self, runner: ScenarioRunner):
+        self.runner = runner
+        self.vars: Dict[str, Any] = dict(runner.vars)
+        self.chosen: set = set()
+        self.history: List[str] = []
+        self.transcript: List[Dict[str, str]] = []
+        self.log: List[str] = []
+        self.calls: List[tuple] = []
+        self.step: Optional[Step] = None
+        self.text = ""
+        self.status = CHOICE
+        self._logged: set = set()
+        self._shown = 0
+        self._visible: List[Option] = []
+        self._go(runner.entry())
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    @property
+    def step_id(self) -> Optional[str]:
+        return self.step.id if self.step is not None else None
+
+    def options(self) -> List[str]:
+        """Тексты видимых кнопок (для «Далее» — одна кнопка)."""
+        if self.status == CONTINUE:
+            return ["Далее"]
+        if self.status != CHOICE:
+            return []
+        return [o.text or f"Вариант {i + 1}" for i, o in enumerate(self._visible)]
+
+    def choose(self, choice: Union[int, str]) -> "Playthrough":
+        """Нажать кнопку: номер среди видимых вариантов или её текст."""
+        labels = self.options()
+        if not labels:
+            raise ValueError(f"прохождение закончено ({self.status}) на шаге {self.step_id!r}")
+        idx = labels.index(choice) if isinstance(choice, str) else choice
+        if not 0 <= idx < len(labels):
+            raise ValueError(f"нет варианта {choice!r} на шаге {self.step_id!r}: {labels}")
+        if self.status == CONTINUE:
+            self._go(self.step.divert)
+            return self
+        opt = self._visible[idx]
+        if opt.id:
+            self.chosen.add(opt.id)
+        self._push("user", "Вы", labels[idx])
+        if opt.next in ("END", "DONE"):
+            self.status = END
+            self._visible = []
+            return self
+        self._go(opt.next or self.step.id)
+        return self
+
+    def proceed(self) -> "Playthrough":
+        """Кнопка «Далее» (только при auto_continue=False)."""
+        if self.status != CONTINUE:
+            raise ValueError(f"на шаге {self.step_id!r} нет перехода «Далее»")
+        return self.choose(0)
+
+    def _push(self, role: str, speaker: str, text: str) -> None:
+        text = text.strip()
+        if text:
+            self.transcript.append({"role": role, "speaker": speaker, "text": text})
+
+    def _go(self, step_id: Optional[str]) -> None:
+        runner = self.runner
+        while True:
+            if self._shown >= runner.max_steps:
+                self.status = LIMIT
+                return
+            step_id = step_id or "start"
+            step = runner.steps.get(step_id)
+            if step is None:
+                self.status = MISSING
+                self.text = "❌ Нет шага: " + step_id
+                self._visible = []
+                return
+            self._shown += 1
+            self.step = step
+            self.history.append(step_id)
+            self._run_actions(step)
+            self.text = step.text(self.vars)
+            if step_id not in self._logged:
+                self._push("npc", step.speaker if step.speaker != "system" else "Система", _text_content(self.text))
+                self._logged.add(step_id)
+
+            chosen = self.chosen
+            self._visible = [o for o in step.options if o.repeatable or o.id not in chosen]
+            if self._visible:
+                self.status = CHOICE
+                return
+            if step.empty:
+                child = runner.first_child_stitch(step_id)
+                if child:
+                    step_id = child
+                    continue
+            if step.divert in ("END", "DONE") or step.end:
+                self.status = END
+            elif step.divert:
+                if runner.auto_continue:
+                    step_id = step.divert
+                    continue
+                self.status = CONTINUE
+            else:
+                self.status = DEAD_END
+            return
+
+    def _run_actions(self, step: Step) -> None:
+        vars = self.vars
+        for act in step.actions:
+            if act.type == "set":
+                if act.var not in vars:
+                    vars[act.var] = 0
+                try:
+                    if act.fn is None:
+                        raise ExprError(act.error or "выражение не компилируется")
+                    v = act.fn(vars)
+                except Exception as e:
+                    self.log.append(f"! ошибка set: {e}")
+                    continue
+                vars[act.var] = v
+                self.log.append(f"~ set {act.var} = {js_str(v)}")
+            elif act.type == "call":
+                self.calls.append((act.var, act.args))
+                self.log.append(f"~ call {act.var}({act.args})")
+
+    def result(self) -> Dict[str, Any]:
+        """Итог для оценки/журнала: статус, шаг, переменные, история, выбранные варианты."""
+        return {"status": self.status, "step": self.step_id, "vars": dict(self.vars),
+                "history": list(self.history), "chosen": sorted(self.chosen),
+                "transcript": list(self.transcript), "calls": list(self.calls)}
+
+
+# ====== CLI ======
+def _main() -> None:
+    ap = argparse.ArgumentParser(description="Проигрывание ink-json/v3 без браузера")
+    ap.add_argument("json", help="сценарий (ink-json/v3 или v4-compact); '-' — stdin")
+    ap.add_argument("--choices", default="", help="скрипт выборов через запятую: номера или тексты")
+    ap.add_argument("--random", type=int, default=0, help="N случайных прохождений (счётчики исходов и скорость)")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--no-auto", action="store_true", help="переходы ждут «Далее», как в плеере")
+    args = ap.parse_args()
+
+    src = sys.stdin.read() if args.json == "-" else open(args.json, encoding="utf-8").read()
+    runner = ScenarioRunner(json.loads(src), auto_continue=not args.no_auto)
+    if args.random:
+        rng = random.Random(args.seed)
+        outcomes: Dict[str, int] = {}
+        t0 = time.perf_counter()
+        for _ in range(args.random):
+            status = runner.random_walk(rng).status
+            outcomes[status] = outcomes.get(status, 0) + 1
+        dt = time.perf_counter() - t0
+        print(json.dumps({"runs": args.random, "outcomes": outcomes, "seconds": round(dt, 3),
+                          "runs_per_sec": round(args.random / dt) if dt else None}, ensure_ascii=False))
+        return
+    choices = [int(c) if c.strip().isdigit() else c.strip() for c in args.choices.split(",") if c.strip()]
+    print(json.dumps(runner.play(choices).result(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
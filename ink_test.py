@@ -1,16 +1,16 @@
 import json
 import sys
-from ink_to_json import parse_ink_to_json
-from ink_validator import validate_ink
+from ink_to_json import validate_and_compile
 from json_to_html_player import build_html_player
 
 
 # --- CLI: читает Ink из stdin, пишет JSON в stdout ---
 def main():
     ink_text = sys.stdin.read()
-    print(f"step 0 validate ink:{validate_ink(ink_text)}")
+    compiled = validate_and_compile(ink_text)  # лексер один раз на проверку и конвертацию
+    print(f"step 0 validate ink:{compiled['report']}")
     print("step 1")
-    json_obj = parse_ink_to_json(ink_text)  # ink_text: str
+    json_obj = compiled["json"]
     print("step 2")
     html_str = build_html_player(json_obj)  # json_obj: dict
     print("step 3")
@@ -1,44 +1,23 @@
 
 # ink_to_json.py — расширенный парсер Ink-подмножества с поддержкой стежков и относительных/полных переходов.
 
+import argparse
 import json
 import re
 import sys
-from typing import List, Dict, Any, Optional
-
-RE_KNOT    = re.compile(r"^===\s*([A-Za-z_]\w*)\s*===$")
-RE_STITCH  = re.compile(r"^==\s*([A-Za-z_]\w*)\s*==$")
-RE_CHOICE  = re.compile(r"^([+*])\s*(.*?)\s*(?:->\s*([A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?))?\s*$")
-RE_DIVERT  = re.compile(r"^->\s*(END|DONE|[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?)\s*$")
-RE_VAR     = re.compile(r"^VAR\s+([A-Za-z_]\w*)\s*=\s*(.+?)\s*$")
-RE_SET     = re.compile(r"^~\s*([A-Za-z_]\w*)\s*=\s*(.+?)\s*$")
-RE_CALL    = re.compile(r"^~\s*([A-Za-z_]\w*)\s*\((.*?)\)\s*$")
-RE_LIST    = re.compile(r"^LIST\s+([A-Za-z_]\w*)\s*=\s*(.+?)\s*$")
-RE_EXTERNAL= re.compile(r"^EXTERNAL\s+([A-Za-z_]\w*)\s*\((.*?)\)\s*$")
-
-def _strip_comments(line: str) -> str:
-    pos = line.find("//")
-    return line if pos == -1 else line[:pos]
-
-def _apply_glue(lines: List[str]) -> List[str]:
-    out, buf = [], ""
-    for raw in lines:
-        line = raw.rstrip()
-        if not line:
-            if buf:
-                out.append(buf)
-                buf = ""
-            out.append("")
-            continue
-        if line.endswith("<>"):
-            buf += line[:-2]
-        else:
-            buf += line
-            out.append(buf)
-            buf = ""
-    if buf:
-        out.append(buf)
-    return out
+import tempfile
+from typing import IO, Container, Iterable, Iterator, List, Dict, Any, Optional
+
+from ink_frontend import (
+    T_CALL, T_CHOICE, T_DIVERT, T_EXTERNAL, T_KNOT, T_LIST, T_SET, T_STITCH, T_VAR,
+    Token, _normalize_target, _resolve_target_late, iter_glued, iter_tokens, tokenize,
+)
+from ink_expr import ExprError, compile_expr, compile_template
+from ink_validator import InkValidator
+
+FORMAT = "ink-json/v3"
+
+RE_SPEAKER = re.compile(r"^\s*([^:\n]+):\s*(.*)$", re.DOTALL)
 
 def _parse_value(expr: str):
     expr = expr.strip()
@@ -49,25 +28,44 @@ def _parse_value(expr: str):
     if expr.lower() in ("true", "false"): return expr.lower() == "true"
     return expr
 
-def _normalize_target(tgt: Optional[str], current_knot: Optional[str]) -> Optional[str]:
-    if not tgt:
-        return None
-    if tgt in ("END","DONE"):
-        return tgt
-    if "." in tgt:
-        return tgt
-    return f"{current_knot}.{tgt}" if current_knot else tgt
+def _new_meta() -> Dict[str, Any]:
+    return {"format": FORMAT, "vars": {}, "lists": {}, "externals": []}
 
-def parse_ink_to_json(ink_text: str) -> Dict[str, Any]:
-    raw_lines = [_strip_comments(l) for l in ink_text.splitlines()]
-    lines = _apply_glue(raw_lines)
+def _build_step(step_id: str, text_buf: List[str], choices: List[Dict[str, Any]],
+                actions: List[Dict[str, Any]], direct_divert: Optional[str]) -> Dict[str, Any]:
+    raw_text = "\n".join([t for t in text_buf if t.strip() != ""])
+    step: Dict[str, Any] = {"id": step_id}
+    if raw_text:
+        m = RE_SPEAKER.match(raw_text)
+        if m:
+            step["speaker"] = m.group(1).strip()
+            step["text"] = m.group(2).strip()
+        else:
+            step["text"] = raw_text
+        step["text_raw"] = raw_text
+        tpl = compile_template(raw_text)
+        if tpl is not None:
+            step["tpl"] = tpl  # инлайны {var} / {cond ? A | B}, разобранные заранее
 
-    vars_init: Dict[str, Any] = {}
-    lists: Dict[str, List[str]] = {}
-    externals: List[str] = []
+    if choices:
+        step["options"] = choices[:]
+    if direct_divert:
+        step["divert"] = direct_divert
+        if direct_divert in ("END","DONE"):
+            step["end"] = True
+    if actions:
+        step["actions"] = actions[:]
+    return step
 
-    steps: Dict[str, Dict[str, Any]] = {}
-    order: List[str] = []
+def _iter_steps(tokens: Iterable[Token], meta: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Собирает шаги из потока склеенных токенов и выдаёт их по мере завершения.
+
+    Цели переходов здесь только нормализованы относительно текущего узла; VAR/LIST/EXTERNAL
+    накапливаются в meta["vars"], meta["lists"], meta["externals"].
+    """
+    vars_init: Dict[str, Any] = meta["vars"]
+    lists: Dict[str, List[str]] = meta["lists"]
+    externals: List[str] = meta["externals"]
 
     current_knot: Optional[str] = None
     current_id: Optional[str] = None
@@ -76,70 +74,11 @@ def parse_ink_to_json(ink_text: str) -> Dict[str, Any]:
     actions: List[Dict[str, Any]] = []
     direct_divert: Optional[str] = None
 
-    def flush_step():
-        nonlocal current_id, text_buf, choices, actions, direct_divert
-        if current_id is None:
-            return
-        raw_text = "\n".join([t for t in text_buf if t.strip() != ""])
-        step: Dict[str, Any] = {"id": current_id}
-        if raw_text:
-            m = re.match(r"^\s*([^:\n]+):\s*(.*)$", raw_text, flags=re.DOTALL)
-            if m:
-                step["speaker"] = m.group(1).strip()
-                step["text"] = m.group(2).strip()
-            else:
-                step["text"] = raw_text
-            step["text_raw"] = raw_text
-
-        if choices:
-            step["options"] = choices[:]
-        if direct_divert:
-            step["divert"] = direct_divert
-            if direct_divert in ("END","DONE"):
-                step["end"] = True
-        if actions:
-            step["actions"] = actions[:]
-
-        steps[current_id] = step
-        if current_id not in order:
-            order.append(current_id)
-        text_buf.clear(); choices.clear(); actions.clear(); direct_divert = None
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        # Топ-уровень директив
-        m = RE_VAR.match(line)
-        if m:
-            vars_init[m.group(1)] = _parse_value(m.group(2)); continue
-        m = RE_LIST.match(line)
-        if m:
-            lists[m.group(1)] = [s.strip() for s in m.group(2).split(",") if s.strip()]; continue
-        m = RE_EXTERNAL.match(line)
-        if m:
-            fn = m.group(1)
-            if fn not in externals: externals.append(fn)
-            continue
-
-        # Узлы / стежки
-        m = RE_KNOT.match(line)
-        if m:
-            flush_step()
-            current_knot = m.group(1)
-            current_id = current_knot
-            continue
-        m = RE_STITCH.match(line)
-        if m:
-            flush_step()
-            st = m.group(1)
-            current_id = f"{current_knot}.{st}" if current_knot else st
-            continue
+    for tok in tokens:
+        kind, m = tok.kind, tok.m
 
         # Внутри блока
-        m = RE_CHOICE.match(line)
-        if m:
+        if kind is T_CHOICE:
             mark, body, target = m.groups()
             choices.append({
                 "id": f"opt_{len(choices)+1}",
@@ -147,106 +86,206 @@ def parse_ink_to_json(ink_text: str) -> Dict[str, Any]:
                 "next": _normalize_target(target, current_knot),
                 "repeatable": (mark == "*"),
             })
-            continue
-
-        m = RE_DIVERT.match(line)
-        if m:
+        elif kind is T_DIVERT:
             direct_divert = _normalize_target(m.group(1), current_knot)
-            continue
+        elif kind is T_SET:
+            act = {"type": "set", "var": m.group(1), "expr": m.group(2).strip()}
+            try:
+                act["code"] = compile_expr(act["expr"])
+            except ExprError:
+                pass  # плеер вычислит исходную строку старым путём
+            actions.append(act)
+        elif kind is T_CALL:
+            actions.append({"type": "call", "fn": m.group(1), "args": m.group(3).strip()})
 
-        m = RE_SET.match(line)
-        if m:
-            actions.append({"type": "set", "var": m.group(1), "expr": m.group(2).strip()})
-            continue
-        m = RE_CALL.match(line)
-        if m:
-            actions.append({"type": "call", "fn": m.group(1), "args": m.group(2).strip()})
-            continue
-
-        # обычный текст
-        text_buf.append(line)
-
-    flush_step()
-
-    # --- Post: auto-divert empty knots to first child stitch (Ink-like entry) ---
-    steps_by_id = { s["id"]: s for s in steps.values() }
-    def _is_empty(step: dict) -> bool:
-        if not step: return True
-        return not any([
-            step.get("text") or step.get("text_raw") or step.get("speaker"),
-            step.get("options"),
-            step.get("divert"),
-            step.get("end"),
-            step.get("actions"),
-            step.get("audio"),
-        ])
-    def _first_child_stitch(knot_id: str):
-        prefix = knot_id + "."
-        if steps_by_id.get(prefix + "start"): return prefix + "start"
-        # use 'order' to pick first child
-        try:
-            idx = order.index(knot_id)
-            for j in range(idx+1, len(order)):
-                cid = order[j]
-                if cid and cid.startswith(prefix): return cid
-                if cid and "." not in cid: break
-        except ValueError:
-            pass
-        # fallback: alphabetical
-        kids = sorted([sid for sid in steps_by_id.keys() if sid.startswith(prefix)])
-        return kids[0] if kids else None
-
-    for sid, step in list(steps_by_id.items()):
-        if "." in sid:
-            continue  # only knots (no dot)
-        if _is_empty(step):
-            child = _first_child_stitch(sid)
-            if child:
-                step["divert"] = child
-                steps_by_id[sid] = step
-                steps[sid] = step
-    # --- Post: resolve targets using known knots/stitches ---
-    knot_names = { sid for sid in steps_by_id.keys() if '.' not in sid }
-    def _src_knot_of(step_id: str) -> str:
-        return step_id.split('.')[0] if '.' in step_id else step_id
-    def _resolve_target_late(src_step_id: str, tgt: str) -> str:
-        if not tgt or tgt in ('END','DONE'): return tgt
-        # exact id
-        if tgt in steps_by_id: return tgt
-        # if dotted but missing -> maybe right part is a knot id
-        if '.' in tgt:
-            left, right = tgt.split('.', 1)
-            if right in steps_by_id and '.' not in right:
-                return right
-        # no dot: prefer knot if exists
-        if '.' not in tgt and tgt in knot_names:
-            return tgt
-        # else, try relative stitch under source knot
-        sk = _src_knot_of(src_step_id)
-        cand = f"{sk}.{tgt}"
-        if cand in steps_by_id: return cand
-        return tgt  # leave as-is (will show runtime 'Нет шага' if wrong)
-    # apply to all steps
-    for sid, step in list(steps_by_id.items()):
-        if 'options' in step and isinstance(step['options'], list):
-            for opt in step['options']:
-                opt['next'] = _resolve_target_late(sid, opt.get('next'))
-        if 'divert' in step:
-            step['divert'] = _resolve_target_late(sid, step.get('divert'))
+        # Узлы / стежки
+        elif kind is T_KNOT or kind is T_STITCH:
+            # строки до первого заголовка не сбрасываются и достаются первому шагу
+            if current_id is not None:
+                yield _build_step(current_id, text_buf, choices, actions, direct_divert)
+                text_buf.clear(); choices.clear(); actions.clear(); direct_divert = None
+            if kind is T_KNOT:
+                current_knot = m.group(1)
+                current_id = current_knot
+            else:
+                st = m.group(1)
+                current_id = f"{current_knot}.{st}" if current_knot else st
 
+        # Топ-уровень директив
+        elif kind is T_VAR:
+            vars_init[m.group(1)] = _parse_value(m.group(2))
+        elif kind is T_LIST:
+            lists[m.group(1)] = [s.strip() for s in m.group(2).split(",") if s.strip()]
+        elif kind is T_EXTERNAL:
+            fn = m.group(1)
+            if fn not in externals: externals.append(fn)
+
+        # обычный текст (в т.ч. неверные заголовки вида '=== seat.one ===')
+        else:
+            text_buf.append(tok.text)
+
+    if current_id is not None:
+        yield _build_step(current_id, text_buf, choices, actions, direct_divert)
+
+# --- Пост-обработка: нужны только индексы id (узел → стежки), не сами шаги ---
+
+def _is_empty(step: dict) -> bool:
+    if not step: return True
+    return not any([
+        step.get("text") or step.get("text_raw") or step.get("speaker"),
+        step.get("options"),
+        step.get("divert"),
+        step.get("end"),
+        step.get("actions"),
+        step.get("audio"),
+    ])
+
+def _register_id(sid: str, pos: Dict[str, int], order: List[str], knots: Dict[str, List[str]]) -> None:
+    """Учесть id шага в индексах: id → позиция в order и узел → его стежки по порядку."""
+    if sid in pos:
+        return
+    pos[sid] = len(order)
+    order.append(sid)
+    knot, dot, _ = sid.partition(".")
+    kids = knots.setdefault(knot, [])
+    if dot:
+        kids.append(sid)
+
+def _first_child_stitch(knot_id: str, ids: Container[str], knots: Dict[str, List[str]]) -> Optional[str]:
+    kids = knots.get(knot_id)
+    if not kids: return None
+    start = knot_id + ".start"
+    return start if start in ids else kids[0]
+
+def _finish_step(step: Dict[str, Any], ids: Container[str], knots: Dict[str, List[str]]) -> None:
+    """Post-проход для одного шага: вход пустого узла в первый стежок и разрешение целей."""
+    sid = step["id"]
+    # auto-divert empty knots to first child stitch (Ink-like entry); only knots (no dot)
+    if "." not in sid and _is_empty(step):
+        child = _first_child_stitch(sid, ids, knots)
+        if child:
+            step["divert"] = child
+    if 'options' in step and isinstance(step['options'], list):
+        for opt in step['options']:
+            opt['next'] = _resolve_target_late(sid, opt.get('next'), ids)
+    if 'divert' in step:
+        step['divert'] = _resolve_target_late(sid, step.get('divert'), ids)
+
+def parse_tokens(tokens: Iterable[Token]) -> Dict[str, Any]:
+    """Построить ink-json из потока токенов ink_frontend (glue применяется здесь)."""
+    meta = _new_meta()
+    steps: Dict[str, Dict[str, Any]] = {}
+    order: List[str] = []
+    pos: Dict[str, int] = {}
+    knots: Dict[str, List[str]] = {}
+    for step in _iter_steps(iter_glued(tokens), meta):
+        steps[step["id"]] = step
+        _register_id(step["id"], pos, order, knots)
+
+    for step in steps.values():
+        _finish_step(step, steps, knots)
 
     return {
-        "format": "ink-json/v3",
-        "vars": vars_init,
-        "lists": lists,
-        "externals": externals,
+        **meta,
         "order": order,
+        "knots": knots,
         "steps": list(steps.values()),
     }
 
+def parse_ink_to_json(ink_text: str) -> Dict[str, Any]:
+    return parse_tokens(iter_tokens(ink_text.splitlines()))
+
+def validate_and_compile(ink_text: str) -> Dict[str, Any]:
+    """Проверка и конвертация по одному списку токенов: {"report": ..., "json": ...}.
+
+    Текст лексится один раз, валидатор и парсер проходят по готовому списку
+    (bench_ink.py lexer сравнивает с раздельными validate_ink + parse_ink_to_json).
+    """
+    tokens = tokenize(ink_text)
+    report = InkValidator(ink_text).validate_tokens(tokens)
+    return {"report": report, "json": parse_tokens(tokens)}
+
+def parse_ink_iter(fileobj: IO[str], header: Optional[Dict[str, Any]] = None,
+                   resolve: bool = True) -> Iterator[Dict[str, Any]]:
+    """Потоковый вариант parse_ink_to_json: читает строки лениво и выдаёт шаги по одному.
+
+    С resolve=False шаги выдаются сразу после завершения, с целями как в исходнике
+    (без позднего разрешения и автовхода в стежок). С resolve=True (по умолчанию) первая
+    фаза сбрасывает шаги во временный файл и собирает компактную таблицу id → смещение,
+    вторая — перечитывает шаги по одному, дорабатывает и выдаёт их. В памяти держится
+    только таблица id и текущий шаг, а не весь сценарий.
+
+    Если передан header, он заполняется полями format/vars/lists/externals/order/knots —
+    при resolve=True до выдачи первого шага, иначе по ходу разбора.
+    """
+    meta = header if header is not None else {}
+    meta.update(_new_meta())
+    tokens = iter_glued(iter_tokens(l.rstrip("\r\n") for l in fileobj))
+
+    order: List[str] = []
+    pos: Dict[str, int] = {}
+    knots: Dict[str, List[str]] = {}
+    meta["order"] = order
+    meta["knots"] = knots
+
+    if not resolve:
+        for step in _iter_steps(tokens, meta):
+            _register_id(step["id"], pos, order, knots)
+            yield step
+        return
+
+    offsets: Dict[str, int] = {}
+    with tempfile.TemporaryFile() as spool:
+        for step in _iter_steps(tokens, meta):
+            sid = step["id"]
+            _register_id(sid, pos, order, knots)
+            offsets[sid] = spool.tell()  # повторный id перекрывает прежний шаг, как в parse_ink_to_json
+            spool.write(json.dumps(step, ensure_ascii=False).encode("utf-8") + b"\n")
+
+        for sid in order:
+            spool.seek(offsets[sid])
+            step = json.loads(spool.readline())
+            _finish_step(step, offsets, knots)
+            yield step
+
+def write_json_stream(fileobj: IO[str], out: IO[str]) -> int:
+    """Пишет тот же JSON, что parse_ink_to_json, но по шагу за раз. Возвращает число шагов."""
+    header: Dict[str, Any] = {}
+    steps = parse_ink_iter(fileobj, header)
+    first = next(steps, None)  # к этому моменту заголовок уже заполнен
+
+    out.write("{\n")
+    for key in ("format", "vars", "lists", "externals", "order", "knots"):
+        out.write(f'  "{key}": {json.dumps(header[key], ensure_ascii=False)},\n')
+    out.write('  "steps": [')
+    n = 0
+    if first is not None:
+        out.write("\n    " + json.dumps(first, ensure_ascii=False))
+        n = 1
+        for step in steps:
+            out.write(",\n    " + json.dumps(step, ensure_ascii=False))
+            n += 1
+    out.write("\n  ]\n}\n")
+    return n
+
 def _main():
+    ap = argparse.ArgumentParser(description="Ink (stdin) → JSON (stdout)")
+    ap.add_argument("--stream", action="store_true",
+                    help="читать stdin построчно и писать шаги по мере готовности (для очень больших скриптов)")
+    ap.add_argument("--compact", action="store_true",
+                    help="вывести ink-json/v4-compact (целые ссылки на шаги, таблица говорящих)")
+    args = ap.parse_args()
+    if args.stream:
+        if args.compact:
+            ap.error("--compact не сочетается с --stream")
+        write_json_stream(sys.stdin, sys.stdout)
+        return
     ink_text = sys.stdin.read()
     data = parse_ink_to_json(ink_text)
+    if args.compact:
+        from ink_compact import to_compact
+        sys.stdout.write(json.dumps(to_compact(data), ensure_ascii=False, separators=(",", ":")))
+        return
     sys.stdout.write(json.dumps(data, ensure_ascii=False, indent=2))
 
 if __name__ == "__main__":
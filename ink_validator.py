@@ -1,45 +1,90 @@
 # ink_validator.py
 import re
-from typing import List, Dict, Tuple, Set, Any
+from collections import deque
+from typing import Iterable, List, Dict, Optional, Tuple, Set, Any
+
+from ink_frontend import (
+    T_BAD_KNOT, T_BAD_STITCH, T_CALL, T_CHOICE, T_DIVERT, T_EXTERNAL, T_KNOT, T_LIST, T_SET,
+    T_STITCH, T_VAR, Token, _normalize_target, _resolve_target_late, iter_tokens, tokenize,
+)
+from ink_diagnostics import Diag
+from ink_expr import ExprError, compile_expr
 
 # --------- Имена и заголовки ---------
 NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')  # только латиница/цифры/_
 RESERVED = {'END', 'DONE'}
 
-# Строго: узел — ровно три "=", стежок — ровно два "="
-KNOT_HDR_RE   = re.compile(r'^\s*===\s*([A-Za-z_][A-Za-z0-9_]*)\s*===\s*$')
-STITCH_HDR_RE = re.compile(r'^\s*==\s*([A-Za-z_][A-Za-z0-9_]*)\s*==\s*$')
-
-# Для ловли "похожих" заголовков с неправильным именем (например seat.one)
-KNOT_LOOKS_LIKE_RE   = re.compile(r'^\s*===\s*(.+?)\s*===\s*$')
-STITCH_LOOKS_LIKE_RE = re.compile(r'^\s*==\s*(.+?)\s*==\s*$')
-
-# --------- Остальные конструкции ---------
-# choice: требуем → target, цель может быть узлом или стежком; END/DONE допустимы
-RE_CHOICE = re.compile(r'^([+*])\s*(.*?)\s*(?:->\s*((?:[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?)|END|DONE))\s*$')
-RE_DIVERT = re.compile(r'^->\s*((?:[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?)|END|DONE)\s*$')
-
-RE_VAR = re.compile(r'^VAR\s+([A-Za-z_]\w*)\s*=\s*(.+?)\s*$')
-RE_SET = re.compile(r'^~\s*([A-Za-z_]\w*)\s*=\s*(.+?)\s*$')
-
-RE_EXTERNAL = re.compile(r'^EXTERNAL\s+([A-Za-z_]\w*)\s*\((.*?)\)\s*$')
-RE_CALL = re.compile(r'^~\s*([A-Za-z_]\w*)\s*\((.*?)\)\s*$')
-
-RE_LIST = re.compile(r'^LIST\s+([A-Za-z_]\w*)\s*=\s*(.+?)\s*$')
-
+# Заголовки и конструкции распознаёт общий лексер ink_frontend (узел — ровно три "=", стежок — два)
 RE_INLINE_VAR = re.compile(r'\{([A-Za-z_]\w*)\}')
 RE_INLINE_TERNARY = re.compile(r'\{([^{}?:|]+?)\?\s*([^{}|]+?)\s*\|\s*([^{}]+?)\}')
+RE_IDENT = re.compile(r'\b([A-Za-z_]\w*)\b')
+
+_END = "END"  # сток графа: переходы -> END / -> DONE
+
+# виды токенов, которые не добавляют содержимого в шаг
+_NOT_CONTENT = {T_KNOT, T_STITCH, T_VAR, T_LIST, T_EXTERNAL}
+
+
+def _scc(nodes: List[str], succ: Dict[str, List[str]]) -> Dict[str, int]:
+    """Компоненты сильной связности (Тарьян без рекурсии): шаг → номер компоненты."""
+    index: Dict[str, int] = {}
+    low: Dict[str, int] = {}
+    comp: Dict[str, int] = {}
+    stack: List[str] = []
+    count = 0
+    for root in nodes:
+        if root in index:
+            continue
+        work = [(root, 0)]
+        while work:
+            n, i = work.pop()
+            if i == 0:
+                index[n] = low[n] = len(index)
+                stack.append(n)
+            kids = succ[n]
+            while i < len(kids):
+                d = kids[i]
+                i += 1
+                if d not in index:
+                    work.append((n, i))
+                    work.append((d, 0))
+                    break
+                if d not in comp:
+                    low[n] = min(low[n], index[d])
+            else:
+                if low[n] == index[n]:
+                    while True:
+                        d = stack.pop()
+                        comp[d] = count
+                        if d == n:
+                            break
+                    count += 1
+                if work:
+                    p = work[-1][0]
+                    low[p] = min(low[p], low[n])
+    return comp
+
+
+def _span(tok: Token, start: int, end: int) -> Tuple[int, int]:
+    """Колонки [начало, конец) с 1 в исходной строке по позициям в tok.text."""
+    indent = len(tok.raw) - len(tok.raw.lstrip())
+    return indent + start + 1, indent + end + 1
+
+def _group_span(tok: Token, m: re.Match, g: int) -> Tuple[int, int]:
+    return _span(tok, m.start(g), m.end(g))
+
+class _EnoughErrors(Exception):
+    """Набрано max_errors ошибок — проверка файла прекращается."""
 
-def _strip_comments(line: str) -> str:
-    pos = line.find('//')
-    return line if pos == -1 else line[:pos]
 
 class InkValidator:
-    def __init__(self, text: str):
+    def __init__(self, text: str, max_errors: Optional[int] = None):
         self.text = text
-        self.errors: List[str] = []
-        self.warnings: List[str] = []
-        self.infos: List[str] = []
+        self.max_errors = max_errors  # остановиться на первых N ошибках (None — проверять всё)
+        self.n_errors = 0
+        self.truncated = False
+        # диагностики в порядке появления; errors/warnings/infos — их текстовое представление
+        self.diags: List[Diag] = []
 
         self.knots: Set[str] = set()
         self.stitches: Set[str] = set()  # полные имена knot.stitch
@@ -47,11 +92,36 @@ class InkValidator:
         self.externals: Dict[str, int] = {}
         self.lists: Set[str] = set()
 
-        self.links: List[Tuple[str, str, int]] = []  # (src_knot, target, line)
-
-    def add_error(self, ln: int, msg: str): self.errors.append(f"[{ln}] {msg}")
-    def add_warn(self, ln: int, msg: str):  self.warnings.append(f"[{ln}] {msg}")
-    def add_info(self, ln: int, msg: str):  self.infos.append(f"[{ln}] {msg}")
+        self.links: List[Tuple[str, str, int, Tuple[int, int]]] = []  # (src_knot, target, line, колонки цели)
+        self._knot: Optional[str] = None  # текущий узел во время scan
+
+        # граф шагов для постпроверок (шаг — узел или knot.stitch, как id в ink_to_json)
+        self.nodes: Dict[str, int] = {}   # шаг → строка заголовка, в порядке объявления
+        self.filled: Set[str] = set()     # шаги с содержимым (текст, варианты, действия, переходы)
+        self.edges: List[Tuple[str, str, int]] = []  # (шаг, цель как написана, строка), и END/DONE
+        self.graph: Optional[Dict[str, Any]] = None  # сводка check_graph
+        self._node: Optional[str] = None
+        self._pending = False  # содержимое до первого заголовка — парсер отдаёт его первому шагу
+
+    def emit(self, code: str, ln: Optional[int] = None, span: Optional[Tuple[int, int]] = None,
+             symbol: Optional[str] = None, **args: Any) -> None:
+        """Добавить диагностику по коду из ink_diagnostics.CODES (уровень берётся оттуда)."""
+        d = Diag(code, ln, span, symbol, **args)
+        self.diags.append(d)
+        if d.level == "error":
+            self.n_errors += 1
+            if self.max_errors is not None and self.n_errors >= self.max_errors:
+                raise _EnoughErrors()
+
+    def _messages(self, level: str) -> List[str]:
+        return [d.text() for d in self.diags if d.level == level]
+
+    @property
+    def errors(self) -> List[str]: return self._messages("error")
+    @property
+    def warnings(self) -> List[str]: return self._messages("warning")
+    @property
+    def infos(self) -> List[str]: return self._messages("info")
 
     # --- проверка существования цели ---
     def _target_exists(self, src_knot: str, tgt: str) -> bool:
@@ -71,158 +141,306 @@ class InkValidator:
             return rel in self.stitches
         return False
 
-    def validate(self) -> Dict[str, Any]:
-        current_knot: str | None = None
-
-        lines = [_strip_comments(l).rstrip() for l in self.text.splitlines()]
-
-        for ln, raw in enumerate(lines, start=1):
-            line = raw.strip()
-            if not line:
-                continue
-
-            # --- заголовок узла ---
-            m = KNOT_HDR_RE.match(line)
-            if m:
-                name = m.group(1)
-                if name.upper() in RESERVED:
-                    self.add_error(ln, f"Имя узла '{name}' зарезервировано. Используйте '-> {name}' вместо '=== {name} ==='.")
-                self.knots.add(name)
-                current_knot = name
-                continue
-            # Похоже на узел, но имя неверное (например seat.one)
-            m = KNOT_LOOKS_LIKE_RE.match(line)
-            if m:
-                bad = m.group(1).strip()
-                if '.' in bad:
-                    self.add_error(ln, f"Недопустимая точка в имени узла '{bad}'. Правильно: '=== seat ===' и внутри '== one ==', а переходы — '-> seat.one'.")
-                elif not NAME_RE.match(bad):
-                    self.add_error(ln, f"Некорректное имя узла '{bad}'. Разрешено: [A-Za-z_][A-Za-z0-9_]*.")
-                else:
-                    # сюда почти не попадём, но на всякий случай
-                    self.add_error(ln, f"Некорректный заголовок узла: '{line}'")
-                # не переключаем current_knot
-                continue
-
-            # --- заголовок стежка ---
-            m = STITCH_HDR_RE.match(line)
-            if m:
-                st = m.group(1)
-                if current_knot is None:
-                    self.add_error(ln, f"Стежок '{st}' объявлен вне узла. Стежки допустимы только внутри узла.")
-                else:
-                    self.stitches.add(f"{current_knot}.{st}")
-                continue
-            # Похоже на стежок, но имя неверное
-            m = STITCH_LOOKS_LIKE_RE.match(line)
-            if m:
-                bad = m.group(1).strip()
-                if current_knot is None:
-                    self.add_error(ln, f"Стежок '{bad}' объявлен вне узла.")
-                elif not NAME_RE.match(bad):
-                    self.add_error(ln, f"Некорректное имя стежка '{bad}'. Разрешено: [A-Za-z_][A-Za-z0-9_]*.")
-                else:
-                    self.add_error(ln, f"Некорректный заголовок стежка: '{line}'")
-                continue
-
-            # --- декларации VAR/LIST/EXTERNAL ---
-            m = RE_VAR.match(line)
-            if m:
-                name = m.group(1)
-                if name in self.vars:
-                    self.add_error(ln, f"Повторное объявление переменной '{name}'.")
-                self.vars.add(name)
-                continue
-
-            m = RE_LIST.match(line)
-            if m:
-                list_name = m.group(1)
-                items = [x.strip() for x in m.group(2).split(",") if x.strip()]
-                if not items:
-                    self.add_error(ln, f"Пустой LIST '{list_name}'.")
-                continue
-
-            m = RE_EXTERNAL.match(line)
-            if m:
-                fn = m.group(1)
-                args = m.group(2)
-                argc = 0 if not args.strip() else len([a.strip() for a in args.split(",") if a.strip()])
-                prev = getattr(self, "externals", {})
-                if fn in prev and prev[fn] != argc:
-                    self.add_error(ln, f"EXTERNAL '{fn}' объявлен с другим числом аргументов (было {prev[fn]}, теперь {argc}).")
-                self.externals[fn] = argc
-                continue
-
-            # --- вне узла нельзя делать переходы/варианты/действия ---
+    def validate(self, lang: Optional[str] = None) -> Dict[str, Any]:
+        return self.validate_tokens(tokenize(self.text), lang)
+
+    def validate_tokens(self, tokens: List[Token], lang: Optional[str] = None) -> Dict[str, Any]:
+        """validate() по готовому списку токенов self.text — его же можно отдать parse_tokens."""
+        try:
+            self.scan_tokens(tokens)
+            self.check_links()
+        except _EnoughErrors:
+            self.truncated = True  # постпроверки и остаток файла пропущены
+        return self.report(lang)
+
+    def scan(self, lines: Iterable[str], first_ln: int = 1) -> None:
+        """Построчные проверки: копит объявления, ссылки и диагностики (без постпроверок)."""
+        self.scan_tokens(iter_tokens(lines, first_ln))
+
+    def scan_tokens(self, tokens: Iterable[Token]) -> None:
+        self._knot = self._node = None
+        for tok in tokens:
+            self._check(tok)
+
+    def _enter(self, node: str, ln: int) -> None:
+        self.nodes.setdefault(node, ln)
+        if self._pending:
+            self.filled.add(node)
+            self._pending = False
+        self._node = node
+
+    def _check(self, tok: Token) -> None:
+        ln, line, kind, m = tok.ln, tok.text, tok.kind, tok.m
+
+        if kind not in _NOT_CONTENT:
+            if self._node is None:
+                self._pending = True
+            else:
+                self.filled.add(self._node)
+
+        # --- заголовок узла ---
+        if kind is T_KNOT:
+            name = m.group(1)
+            if name.upper() in RESERVED:
+                self.emit("knot_reserved", ln, _group_span(tok, m, 1), name)
+            self.knots.add(name)
+            self._knot = name
+            self._enter(name, ln)
+            return
+        # Похоже на узел, но имя неверное (например seat.one)
+        if kind is T_BAD_KNOT:
+            bad = m.group(1).strip()
+            span = _group_span(tok, m, 1)
+            if '.' in bad:
+                knot, _, stitch = bad.partition('.')
+                self.emit("knot_dotted", ln, span, bad, knot=knot, stitch=stitch)
+            elif not NAME_RE.match(bad):
+                self.emit("knot_bad_name", ln, span, bad)
+            else:
+                # сюда почти не попадём, но на всякий случай
+                self.emit("knot_bad_header", ln, span, bad, line=line)
+            # не переключаем current_knot
+            return
+
+        current_knot = self._knot
+
+        # --- заголовок стежка ---
+        if kind is T_STITCH:
+            st = m.group(1)
             if current_knot is None:
-                if RE_CHOICE.match(line) or RE_DIVERT.match(line) or RE_SET.match(line) or RE_CALL.match(line):
-                    self.add_error(ln, "Конструкция допустима только внутри узла (обнаружено вне узла).")
-                # остальной текст вне узла допустим (например, шапка сценария)
-                continue
-
-            # --- внутри узла: варианты, диверты, действия, инлайны ---
-            m = RE_CHOICE.match(line)
-            if m:
-                mark, body, tgt = m.groups()
-                if tgt is None or not tgt.strip():
-                    self.add_error(ln, "Вариант без '-> target'.")
-                else:
-                    self.links.append((current_knot, tgt.strip(), ln))
-                continue
-
-            m = RE_DIVERT.match(line)
-            if m:
-                tgt = m.group(1).strip()
-                if tgt.upper() not in RESERVED:
-                    self.links.append((current_knot, tgt, ln))
-                continue
-
-            m = RE_SET.match(line)
-            if m:
-                var = m.group(1)
-                if var not in self.vars:
-                    self.add_error(ln, f"Присваивание в необъявленную переменную '{var}' (объявите через VAR).")
-                continue
-
-            m = RE_CALL.match(line)
-            if m:
-                fn = m.group(1)
-                args = m.group(2)
-                argc = 0 if not args.strip() else len([a.strip() for a in args.split(",") if a.strip()])
-                if fn not in self.externals:
-                    self.add_error(ln, f"Вызов внешней функции '{fn}' без EXTERNAL.")
-                else:
-                    declared = self.externals[fn]
-                    if declared != argc:
-                        self.add_error(ln, f"Неверное число аргументов в '{fn}': {argc}, ожидалось {declared}.")
-                continue
-
-            if "{" in line and "}" in line:
-                for name in RE_INLINE_VAR.findall(line):
-                    if name not in self.vars:
-                        self.add_error(ln, f"Подстановка '{{{name}}}' без VAR-объявления.")
-                for _cond, _yes, _no in RE_INLINE_TERNARY.findall(line):
-                    for ident in re.findall(r"\b([A-Za-z_]\w*)\b", _cond):
-                        if ident in ("true", "false", "null"):
-                            continue
-                        if ident not in self.vars:
-                            self.add_error(ln, f"Условие использует необъявленную переменную '{ident}'.")
-                continue
-
-            # Glue считаем информацией
-            if "<>" in line:
-                self.add_info(ln, "Используется glue '<>'.")
-                continue
-
-        # --- постпроверки ---
+                self.emit("stitch_outside_knot", ln, _group_span(tok, m, 1), st)
+            else:
+                self.stitches.add(f"{current_knot}.{st}")
+                self._enter(f"{current_knot}.{st}", ln)
+            return
+        # Похоже на стежок, но имя неверное
+        if kind is T_BAD_STITCH:
+            bad = m.group(1).strip()
+            span = _group_span(tok, m, 1)
+            if current_knot is None:
+                self.emit("stitch_outside_knot", ln, span, bad)
+            elif not NAME_RE.match(bad):
+                self.emit("stitch_bad_name", ln, span, bad)
+            else:
+                self.emit("stitch_bad_header", ln, span, bad, line=line)
+            return
+
+        # --- декларации VAR/LIST/EXTERNAL ---
+        if kind is T_VAR:
+            name = m.group(1)
+            if name in self.vars:
+                self.emit("var_redeclared", ln, _group_span(tok, m, 1), name)
+            self.vars.add(name)
+            return
+
+        if kind is T_LIST:
+            list_name = m.group(1)
+            items = [x.strip() for x in m.group(2).split(",") if x.strip()]
+            if not items:
+                self.emit("list_empty", ln, _group_span(tok, m, 1), list_name)
+            return
+
+        if kind is T_EXTERNAL:
+            fn = m.group(1)
+            args = m.group(2)
+            argc = 0 if not args.strip() else len([a.strip() for a in args.split(",") if a.strip()])
+            prev = self.externals
+            if fn in prev and prev[fn] != argc:
+                self.emit("external_conflict", ln, _group_span(tok, m, 1), fn, was=prev[fn], now=argc)
+            self.externals[fn] = argc
+            return
+
+        # --- вне узла нельзя делать переходы/варианты/действия ---
+        if current_knot is None:
+            if kind is T_CHOICE or kind is T_DIVERT or kind is T_SET or kind is T_CALL:
+                self.emit("outside_knot", ln, _span(tok, 0, len(line)))
+            # остальной текст вне узла допустим (например, шапка сценария)
+            return
+
+        # --- внутри узла: варианты, диверты, действия, инлайны ---
+        if kind is T_CHOICE:
+            mark, body, tgt = m.groups()
+            if tgt is None or not tgt.strip():
+                self.emit("choice_no_target", ln, _span(tok, 0, len(line)))
+            else:
+                self.links.append((current_knot, tgt.strip(), ln, _group_span(tok, m, 3)))
+                self.edges.append((self._node, tgt.strip(), ln))
+            return
+
+        if kind is T_DIVERT:
+            tgt = m.group(1).strip()
+            if tgt.upper() not in RESERVED:
+                self.links.append((current_knot, tgt, ln, _group_span(tok, m, 1)))
+            self.edges.append((self._node, tgt, ln))
+            return
+
+        if kind is T_SET:
+            var = m.group(1)
+            if var not in self.vars:
+                self.emit("set_undeclared", ln, _group_span(tok, m, 1), var)
+            try:
+                compile_expr(m.group(2))
+            except ExprError as e:
+                self.emit("expr_unsupported", ln, _group_span(tok, m, 2), m.group(2), reason=str(e))
+            return
+
+        if kind is T_CALL:
+            fn = m.group(1)
+            args = m.group(3)
+            argc = 0 if not args.strip() else len([a.strip() for a in args.split(",") if a.strip()])
+            if fn not in self.externals:
+                self.emit("call_no_external", ln, _group_span(tok, m, 1), fn)
+            else:
+                declared = self.externals[fn]
+                if declared != argc:
+                    self.emit("call_arity", ln, _group_span(tok, m, 3), fn, argc=argc, declared=declared)
+            return
+
+        if "{" in line and "}" in line:
+            for mv in RE_INLINE_VAR.finditer(line):
+                if mv.group(1) not in self.vars:
+                    self.emit("inline_undeclared", ln, _group_span(tok, mv, 1), mv.group(1))
+            for mt in RE_INLINE_TERNARY.finditer(line):
+                base = mt.start(1)
+                for mi in RE_IDENT.finditer(mt.group(1)):
+                    ident = mi.group(1)
+                    if ident in ("true", "false", "null"):
+                        continue
+                    if ident not in self.vars:
+                        self.emit("cond_undeclared", ln, _span(tok, base + mi.start(1), base + mi.end(1)), ident)
+            return
+
+        # Glue считаем информацией
+        if "<>" in line:
+            self.emit("glue", ln, _span(tok, line.find("<>"), line.find("<>") + 2))
+
+    # --- постпроверки ---
+    def check_links(self) -> None:
         if "start" not in self.knots:
-            self.errors.append("Отсутствует обязательный узел 'start'.")
+            self.emit("no_start")
 
-        for src, tgt, ln in self.links:
+        for src, tgt, ln, span in self.links:
             if not self._target_exists(src, tgt):
-                self.add_error(ln, f"Переход из '{src}' в несуществующую цель '{tgt}'.")
+                self.emit("bad_target", ln, span, tgt, src=src)
+
+        self.check_graph()
+
+    # --- анализ графа шагов: всё за O(V+E) ---
+    def _resolve(self, src: str, tgt: str) -> Optional[str]:
+        """Шаг, в который ведёт переход (END — для END/DONE), или None для несуществующей цели.
+
+        Правила те же, что у компилятора: стежок узла-источника, затем узел, затем правая часть a.b.
+        """
+        if tgt.upper() in RESERVED:
+            return _END
+        dst = _resolve_target_late(src, _normalize_target(tgt, src.split('.', 1)[0]), self.nodes)
+        return dst if dst in self.nodes else None
+
+    def _successors(self) -> Dict[str, List[str]]:
+        succ: Dict[str, List[str]] = {n: [] for n in self.nodes}
+        for src, tgt, _ln in self.edges:
+            if src in succ:
+                dst = self._resolve(src, tgt)
+                if dst is not None:
+                    succ[src].append(dst)
+        # пустой узел со стежками — вход в первый стежок (.start, иначе первый по порядку)
+        children: Dict[str, List[str]] = {}
+        for n in self.nodes:
+            if '.' in n:
+                children.setdefault(n.split('.', 1)[0], []).append(n)
+        for knot, kids in children.items():
+            if knot in succ and knot not in self.filled:
+                start = knot + ".start"
+                succ[knot].append(start if start in succ else kids[0])
+        return succ
+
+    def check_graph(self) -> None:
+        """Недостижимые шаги, тупики, циклы без выхода и кратчайший путь от 'start' к END."""
+        if "start" not in self.nodes:
+            return
+        succ = self._successors()
+        containers = {n for n in self.nodes if n not in self.filled and succ[n]}
+
+        # 1) прямой обход от start: достижимость и кратчайший путь (BFS)
+        parent: Dict[str, Optional[str]] = {"start": None}
+        queue = deque(["start"])
+        end_from: Optional[str] = None
+        while queue:
+            n = queue.popleft()
+            for dst in succ[n]:
+                if dst is _END:
+                    if end_from is None:
+                        end_from = n
+                elif dst not in parent:
+                    parent[dst] = n
+                    queue.append(dst)
+
+        unreachable = [n for n in self.nodes if n not in parent and n not in containers]
+        for n in unreachable:
+            self.emit("unreachable", self.nodes[n], symbol=n)
+
+        dead_ends = [n for n in parent if not succ[n]]
+        for n in dead_ends:
+            self.emit("dead_end", self.nodes[n], symbol=n)
+
+        path: List[str] = []
+        if end_from is None:
+            self.emit("end_unreachable")
+        else:
+            n: Optional[str] = end_from
+            while n is not None:
+                path.append(n)
+                n = parent[n]
+            path.reverse()
+            self.emit("path_to_end", path=" → ".join(path), steps=len(path))
+
+        # 2) обратный обход от завершений (END/DONE и тупиков): откуда сценарий может закончиться
+        pred: Dict[str, List[str]] = {n: [] for n in parent}
+        finish = deque()
+        for n in parent:
+            if not succ[n]:
+                finish.append(n)
+            for dst in succ[n]:
+                if dst is _END:
+                    finish.append(n)
+                else:
+                    pred[dst].append(n)
+        done = set(finish)
+        while finish:
+            for p in pred[finish.popleft()]:
+                if p not in done:
+                    done.add(p)
+                    finish.append(p)
+
+        # 3) из остальных шагов выхода нет: их замкнутые компоненты (SCC) — циклы-ловушки
+        cycles = []
+        trapped = [n for n in parent if n not in done]
+        if trapped:
+            comp = _scc(trapped, {n: [d for d in succ[n] if d is not _END and d not in done] for n in trapped})
+            leaves = {}
+            for n in trapped:
+                leaves.setdefault(comp[n], []).append(n)
+            for c, members in leaves.items():
+                if any(comp[d] != c for n in members for d in succ[n] if d not in done):
+                    continue  # из компоненты можно уйти в другую ловушку — сообщаем только о конечных
+                members.sort(key=self.nodes.__getitem__)
+                cycles.append(members)
+                shown = " → ".join(members[:6]) + (f" … (+{len(members) - 6})" if len(members) > 6 else "")
+                self.emit("trap_cycle", self.nodes[members[0]], symbol=members[0], cycle=shown)
+
+        self.graph = {
+            "steps": len(self.nodes),
+            "edges": sum(len(v) for v in succ.values()),
+            "unreachable": unreachable,
+            "dead_ends": dead_ends,
+            "cycles": cycles,
+            "path_to_end": path,
+        }
 
-        return {
+    def report(self, lang: Optional[str] = None) -> Dict[str, Any]:
+        """Сводка проверки. diagnostics — компактные записи (см. ink_diagnostics); с lang
+        в каждую добавляется текст сообщения на этом языке."""
+        out = {
             "errors": self.errors,
             "warnings": self.warnings,
             "infos": self.infos,
@@ -231,9 +449,15 @@ class InkValidator:
             "vars": sorted(self.vars),
             "externals": sorted([f"{k}/{v}" for k, v in self.externals.items()]),
             "lists": sorted(self.lists),
+            "diagnostics": [d.to_dict(lang) for d in self.diags],
         }
+        if self.graph is not None:
+            out["graph"] = self.graph
+        if self.truncated:
+            out["truncated"] = True
+        return out
 
 # Внешняя точка входа
-def validate_ink(ink_text: str) -> Dict[str, Any]:
-    v = InkValidator(ink_text)
-    return v.validate()
+def validate_ink(ink_text: str, lang: Optional[str] = None, max_errors: Optional[int] = None) -> Dict[str, Any]:
+    v = InkValidator(ink_text, max_errors)
+    return v.validate(lang)
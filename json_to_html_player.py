@@ -1,12 +1,31 @@
-
 from __future__ import annotations
+import base64
+import functools
+import gzip
+import hashlib
+import html as _html
+import io
 import json
+import os
+import pathlib
+from typing import IO, Any, Dict, Optional, Tuple, Union
+
+from ink_compact import to_compact
 
-def build_html_player(data: dict) -> str:
-    """Return a self-contained HTML player for Ink JSON (our simplified schema)."""
-    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+# Оболочка плеера (HTML + CSS + JS) не зависит от сценария: она собирается один раз,
+# режется по месту данных на префикс и суффикс, и рендер лишь склеивает
+# префикс + экранированный JSON + суффикс.
+#
+# Для библиотеки сценариев CSS и JS можно вынести в общие файлы player.<hash>.css/.js
+# (write_player_assets) — тогда страницы тонкие и ссылаются на них (assets=...).
+# Без assets страница самодостаточна и работает офлайн.
+#
+# Большой сценарий можно отдать по узлам (chunks=...): в странице — индекс и узел start,
+# остальные узлы плеер разбирает (inline) или загружает (files) при первом входе.
+# compress=True кладёт JSON как base64 от gzip: реплики и имена говорящих повторяются,
+# и страница большого сценария уменьшается в разы (плеер распаковывает DecompressionStream).
 
-    css = r"""
+_CSS = r"""
   :root { --bg:#0b1324; --card:#121b34; --muted:#9fb0d1; --accent:#5aa8ff; --ok:#39d98a; --warn:#ffb020; }
   * { box-sizing: border-box; }
   body { margin:0; font-family: system-ui,-apple-system,Segoe UI,Roboto,Inter,Arial; background:var(--bg); color:#e9f1ff; }
@@ -32,259 +51,435 @@ def build_html_player(data: dict) -> str:
   .msg .txt { font-size:15px; white-space:pre-wrap; }
 """
 
-    js = r"""
+_JS = r"""
 (function(){
-  let scenario = null;
   const elFatal = document.getElementById('fatal');
   function showFatal(msg){
     if (!elFatal) return;
     elFatal.style.display = 'block';
     elFatal.textContent = 'Ошибка: ' + msg;
   }
-  try {
-    scenario = JSON.parse(document.getElementById('scenario-data').textContent);
-  } catch(e){
-    showFatal('Не удалось разобрать JSON сценария: ' + (e && e.message ? e.message : e));
-    return;
+
+  // Сжатый сценарий (build_html_player(compress=True)): base64 от gzip, распаковка
+  // DecompressionStream; без него — несжатая копия из data-fallback. Иначе — сразу JSON.
+  function readScenario(){
+    const el = document.getElementById('scenario-data');
+    if (el.getAttribute('data-encoding') !== 'gzip+base64') return JSON.parse(el.textContent);
+    const fallback = el.getAttribute('data-fallback');
+    if (typeof DecompressionStream === 'undefined'){
+      if (!fallback) throw new Error('браузер не поддерживает DecompressionStream');
+      return fetch(fallback).then(r => { if (!r.ok) throw new Error('HTTP ' + r.status); return r.json(); });
+    }
+    const bin = atob(el.textContent.trim());
+    const bytes = new Uint8Array(bin.length);
+    for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+    return new Response(stream).text().then(JSON.parse);
   }
+  const fail = e => showFatal('Не удалось разобрать JSON сценария: ' + (e && e.message ? e.message : e));
+  let loaded;
+  try { loaded = readScenario(); } catch(e){ fail(e); return; }
+  if (loaded && typeof loaded.then === 'function') loaded.then(play, fail);
+  else play(loaded);
 
-  const stepsArr = scenario.steps || [];
-  const steps = {};
-  stepsArr.forEach(s => steps[s.id] = s);
+  function play(scenario){
+    // ink-json/v4-compact (см. ink_compact.py): шаги лежат по индексу, ссылки на них — целые числа
+    // (END/DONE и неразрешённые цели — строки). Карта id → шаг не строится: шаг разворачивается
+    // в объект v3 при первом входе, id берётся из ids[...] только для показа.
+    const compact = !!scenario && scenario.format === 'ink-json/v4-compact';
+    const ids = compact ? (scenario.ids || []) : null;
+    const spk = compact ? (scenario.speakers || []) : null;
+    const SHORT = {s:1, t:1, r:1, o:1, d:1, e:1, a:1};
+    const expanded = [];
+    function expandStep(i){
+      const r = scenario.steps[i];
+      const s = {id: ids[i]};
+      if (r.s !== undefined) s.speaker = spk[r.s];
+      if (r.t !== undefined){
+        s.text = r.t;
+        s.text_raw = (r.r !== undefined) ? r.r : (s.speaker !== undefined ? s.speaker + ': ' + r.t : r.t);
+      } else if (r.r !== undefined) s.text_raw = r.r;
+      if (r.o) s.options = r.o.map((o, j)=>({id: o.length > 3 ? o[3] : 'opt_' + (j+1), text: o[0], next: o[1], repeatable: !!o[2]}));
+      if (r.d !== undefined) s.divert = r.d;
+      if (r.e) s.end = true;
+      if (r.a) s.actions = r.a;
+      for (const k in r){ if (!SHORT[k]) s[k] = r[k]; }
+      return s;
+    }
 
-  const vars = Object.assign({}, scenario.vars || {});
-  const chosen = new Set();
-  const history = [];
-  const transcript = [];
-  const loggedSteps = new Set();
+    const steps = {};
+    if (!compact) (scenario.steps || []).forEach(s => steps[s.id] = s);
+    // ссылка на шаг: id (v3) или индекс в steps (v4-compact)
+    function idOf(ref){ return typeof ref === 'number' ? ids[ref] : ref; }
+    function stepAt(ref){
+      if (!compact) return steps[ref];
+      const i = typeof ref === 'number' ? ref : ids.indexOf(ref);
+      if (i < 0 || i >= scenario.steps.length) return undefined;
+      return expanded[i] || (expanded[i] = expandStep(i));
+    }
 
-  function safeEval(expr, vars){
-    if (typeof expr !== 'string') return expr;
-    const original = String(expr);
+    // Сценарий по узлам (build_html_player(chunks=...)): в индексе только узел start,
+    // шаги остальных узлов разбираются (inline) или загружаются (files) при первом входе.
+    const chunking = scenario.chunks || null;
+    const chunkKnots = new Set(chunking ? chunking.knots : []);
+    const knotState = {};  // узел → true (шаги на месте) | Promise (загружается)
+    function knotOf(id){ const i = id.indexOf('.'); return i < 0 ? id : id.slice(0, i); }
+    function loadKnot(k){
+      if (!chunkKnots.has(k) || knotState[k] === true) return null;
+      if (knotState[k]) return knotState[k];
+      if (chunking.mode === 'inline'){
+        const el = document.getElementById('knot-' + k);
+        (el ? JSON.parse(el.textContent) : []).forEach(s => steps[s.id] = s);
+        knotState[k] = true;
+        return null;
+      }
+      const p = fetch(chunking.base + encodeURIComponent(k) + '.json')
+        .then(r => { if (!r.ok) throw new Error('HTTP ' + r.status); return r.json(); })
+        .then(list => { list.forEach(s => steps[s.id] = s); knotState[k] = true; },
+              e => { delete knotState[k]; throw e; });
+      knotState[k] = p;
+      return p;
+    }
+    function go(stepId){
+      if (!chunking) return render(stepId);
+      const k = knotOf(stepId || 'start');
+      let p;
+      try { p = loadKnot(k); }
+      catch(e){ showFatal('Не удалось разобрать узел ' + k + ': ' + (e && e.message ? e.message : e)); return; }
+      if (!p) return render(stepId);
+      p.then(()=> render(stepId),
+             e => showFatal('Не удалось загрузить узел ' + k + ': ' + (e && e.message ? e.message : e)));
+    }
+    function prefetch(targets){
+      if (!chunking || !chunking.prefetch) return;
+      const later = window.requestIdleCallback || (fn => setTimeout(fn, 0));
+      later(()=> targets.forEach(t => {
+        if (!t || t === 'END' || t === 'DONE') return;
+        try { const p = loadKnot(knotOf(t)); if (p) p.catch(()=>{}); } catch(e){}
+      }));
+    }
+
+    const vars = Object.assign({}, scenario.vars || {});
+    const chosen = new Set();
+    // История и расшифровка растут с каждым шагом, поэтому на экран попадает только хвост:
+    // последние HISTORY_VIEW шагов в плашке и последние TRANSCRIPT_VIEW реплик в списке.
+    const HISTORY_VIEW = 12;
+    const TRANSCRIPT_VIEW = 200;
+    const history = [];       // хвост истории (не длиннее 2*HISTORY_VIEW)
+    let historyTotal = 0;     // сколько шагов пройдено всего
+    const transcript = [];
+    let transcriptShown = 0;  // сколько реплик уже добавлено в DOM
+    const loggedSteps = new Set();
+
+    function safeEval(expr, vars){
+      if (typeof expr !== 'string') return expr;
+      const original = String(expr);
   
-    // 1) Меняем строковые литералы на плейсхолдер — чтобы Unicode/слэши не мешали проверке
-    const STR = '"__STR__"';
-    const stripped = original.replace(/"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'/g, STR);
+      // 1) Меняем строковые литералы на плейсхолдер — чтобы Unicode/слэши не мешали проверке
+      const STR = '"__STR__"';
+      const stripped = original.replace(/"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'/g, STR);
   
-    // 2) Очень консервативная проверка посимвольно — без регекспа
-    const isAsciiLetter = c => (c >= 'a' && c <= 'z') || (c >= 'A' && c <= 'Z');
-    const isDigit = c => (c >= '0' && c <= '9');
-    const extra = new Set([' ', '\t', '\r', '\n', '_', '[', ']', '\'', '"', '.', ',', ':', '+', '*', '/', '(', ')', '<', '>', '!', '=', '?', '&', '|', '-', '\\']);
-    for (const ch of stripped){
-      if (isAsciiLetter(ch) || isDigit(ch) || extra.has(ch)) { continue; }
-      throw new Error('Недопустимые символы: ' + original);
-    }
+      // 2) Очень консервативная проверка посимвольно — без регекспа
+      const isAsciiLetter = c => (c >= 'a' && c <= 'z') || (c >= 'A' && c <= 'Z');
+      const isDigit = c => (c >= '0' && c <= '9');
+      const extra = new Set([' ', '\t', '\r', '\n', '_', '[', ']', '\'', '"', '.', ',', ':', '+', '*', '/', '(', ')', '<', '>', '!', '=', '?', '&', '|', '-', '\\']);
+      for (const ch of stripped){
+        if (isAsciiLetter(ch) || isDigit(ch) || extra.has(ch)) { continue; }
+        throw new Error('Недопустимые символы: ' + original);
+      }
   
-    // 3) Подставляем vars["name"] для идентификаторов
-    const compiled = original.replace(/\b([A-Za-z_]\w*)\b/g, (m, name)=>{
-      if (Object.prototype.hasOwnProperty.call(vars, name)) return 'vars["'+name+'"]';
-      if (['true','false','null','undefined'].includes(name)) return name;
-      return name;
-    });
+      // 3) Подставляем vars["name"] для идентификаторов
+      const compiled = original.replace(/\b([A-Za-z_]\w*)\b/g, (m, name)=>{
+        if (Object.prototype.hasOwnProperty.call(vars, name)) return 'vars["'+name+'"]';
+        if (['true','false','null','undefined'].includes(name)) return name;
+        return name;
+      });
   
-    // 4) Выполняем выражение
-    const fn = new Function('vars', 'return (' + compiled + ')');
-    return fn(vars);
-  }
+      // 4) Выполняем выражение
+      const fn = new Function('vars', 'return (' + compiled + ')');
+      return fn(vars);
+    }
 
 
-  function renderInline(raw){
-    if (!raw) return '';
-    let s = String(raw);
-    // {cond ? A | B}
-    const ternary = /\\{([^{}?:|]+?)\\?\\s*([^{}|]+?)\\|\\s*([^{}]+?)\\}/g;
-    s = s.replace(ternary, (_, cond, yes, no)=>{
-      let ok = false;
-      try { ok = !!safeEval(cond.trim(), vars); } catch(e){ ok = false; }
-      return ok ? yes.trim() : no.trim();
-    });
-    // {var}
-    s = s.replace(/\\{([A-Za-z_]\\w*)\\}/g, (_, name)=> (name in vars) ? String(vars[name]) : '{'+name+'}');
-    // newlines
-    s = s.replace(/\\n/g, '<br>');
-    return s;
-  }
+    // Байткод из ink_expr.py: ["k",c] ["v",name] ["u",op] ["b",op] — стековая машина без eval
+    const BIN = {
+      '+': (a,b)=>a+b, '-': (a,b)=>a-b, '*': (a,b)=>a*b, '/': (a,b)=>a/b, '%': (a,b)=>a%b,
+      '<': (a,b)=>a<b, '>': (a,b)=>a>b, '<=': (a,b)=>a<=b, '>=': (a,b)=>a>=b,
+      '==': (a,b)=>a==b, '!=': (a,b)=>a!=b, '&&': (a,b)=>a&&b, '||': (a,b)=>a||b,
+    };
+    function evalCode(code, vars){
+      const st = [];
+      for (const ins of code){
+        const op = ins[0];
+        if (op === 'k') st.push(ins[1]);
+        else if (op === 'v'){
+          if (!Object.prototype.hasOwnProperty.call(vars, ins[1])) throw new Error('Неизвестная переменная: ' + ins[1]);
+          st.push(vars[ins[1]]);
+        } else if (op === 'u'){
+          const a = st.pop();
+          st.push(ins[1] === '!' ? !a : -a);
+        } else if (op === 'b' && Object.prototype.hasOwnProperty.call(BIN, ins[1])){
+          const b = st.pop(), a = st.pop();
+          st.push(BIN[ins[1]](a, b));
+        } else {
+          throw new Error('Неизвестная инструкция: ' + op);
+        }
+      }
+      return st.pop();
+    }
 
-  function runActions(actions){
-    if (!actions) return;
-    for (const act of actions){
-      if (act.type === 'set'){
-        try {
-          if (!(act.var in vars)) vars[act.var] = 0;
-          const v = safeEval(act.expr, vars);
-          vars[act.var] = v;
-          log('~ set '+act.var+' = '+v);
-        } catch(e){
-          log('! ошибка set: '+e.message);
+    // Шаблон из ink_expr.compile_template: строки, ["v",name], ["?",code,yes,no]
+    function renderTpl(tpl){
+      let s = '';
+      for (const seg of tpl){
+        if (typeof seg === 'string') s += seg;
+        else if (seg[0] === 'v') s += (seg[1] in vars) ? String(vars[seg[1]]) : '{'+seg[1]+'}';
+        else {
+          let ok = false;
+          try { ok = !!(seg[1] && evalCode(seg[1], vars)); } catch(e){ ok = false; }
+          s += ok ? seg[2] : seg[3];
         }
-      } else if (act.type === 'call'){
-        log('~ call '+act.fn+'('+ (act.args||'') +')');
       }
+      return s.replace(/\n/g, '<br>');
     }
-  }
 
-  function isEmptyStep(step){
-    if (!step) return true;
-    const hasText = !!(step.text_raw || step.text || step.speaker);
-    const hasUI = (step.options && step.options.length) || step.audio || step.end || step.divert;
-    const hasAct = step.actions && step.actions.length;
-    return !(hasText || hasUI || hasAct);
-  }
-  function firstChildStitch(knotId){
-    const prefix = knotId + '.';
-    if (steps[prefix + 'start']) return prefix + 'start';
-    if (Array.isArray(scenario.order)){
-      const idx = scenario.order.indexOf(knotId);
-      if (idx >= 0){
-        for (let j = idx + 1; j < scenario.order.length; j++){
-          const id = scenario.order[j];
-          if (id && id.startsWith(prefix)) return id;
-          if (id && !id.includes('.')) break;
+    // Запасной путь для JSON без tpl (старые сборки)
+    function renderInline(raw){
+      if (!raw) return '';
+      let s = String(raw);
+      // {cond ? A | B}
+      const ternary = /\{([^{}?:|]+?)\?\s*([^{}|]+?)\|\s*([^{}]+?)\}/g;
+      s = s.replace(ternary, (_, cond, yes, no)=>{
+        let ok = false;
+        try { ok = !!safeEval(cond.trim(), vars); } catch(e){ ok = false; }
+        return ok ? yes.trim() : no.trim();
+      });
+      // {var}
+      s = s.replace(/\{([A-Za-z_]\w*)\}/g, (_, name)=> (name in vars) ? String(vars[name]) : '{'+name+'}');
+      // newlines
+      s = s.replace(/\n/g, '<br>');
+      return s;
+    }
+
+    function runActions(actions){
+      if (!actions) return;
+      for (const act of actions){
+        if (act.type === 'set'){
+          try {
+            if (!(act.var in vars)) vars[act.var] = 0;
+            const v = act.code ? evalCode(act.code, vars) : safeEval(act.expr, vars);
+            vars[act.var] = v;
+            log('~ set '+act.var+' = '+v);
+          } catch(e){
+            log('! ошибка set: '+e.message);
+          }
+        } else if (act.type === 'call'){
+          log('~ call '+act.fn+'('+ (act.args||'') +')');
         }
       }
     }
-    const list = Object.keys(steps).filter(k => k.startsWith(prefix)).sort();
-    return list.length ? list[0] : null;
-  }
-  function applyDivert(divert){
-    if (!divert) return null;
-    if (divert === 'END' || divert === 'DONE') return '__END__';
-    return divert;
-  }
-  function pushNpc(speaker, text){
-    if (!text || !String(text).trim()) return;
-    const spk = (speaker && speaker !== 'system') ? speaker : 'Система';
-    transcript.push({role:'npc', speaker: spk, text: String(text).trim()});
-  }
-  function pushUser(text){
-    if (!text || !String(text).trim()) return;
-    transcript.push({role:'user', speaker:'Вы', text: String(text).trim()});
-  }
 
-  const elTitle = document.getElementById('title');
-  const elMeta  = document.getElementById('meta');
-  const elSpk   = document.getElementById('speaker');
-  const elText  = document.getElementById('text');
-  const elAudio = document.getElementById('audio');
-  const elOpts  = document.getElementById('opts');
-  const elEnd   = document.getElementById('end');
-  const elChipSt= document.getElementById('chipState');
-  const elTranscript = document.getElementById('transcript');
-  const elQAList = document.getElementById('qaList');
-  const elSys   = document.getElementById('syslog');
-  function log(msg){ if (elSys) elSys.textContent = msg; }
-
-  function renderTranscript(){
-    elTranscript.style.display = transcript.length ? 'block' : 'none';
-    elQAList.innerHTML = '';
-    transcript.forEach((m)=>{
-      const box = document.createElement('div'); box.className = 'msg ' + (m.role === 'user' ? 'user' : 'npc');
-      const hdr = document.createElement('div'); hdr.className = 'hdr'; hdr.textContent = m.speaker;
-      const txt = document.createElement('div'); txt.className = 'txt'; txt.textContent = m.text;
-      box.appendChild(hdr); box.appendChild(txt);
-      elQAList.appendChild(box);
-    });
-  }
+    function isEmptyStep(step){
+      if (!step) return true;
+      const hasText = !!(step.text_raw || step.text || step.speaker);
+      const hasUI = (step.options && step.options.length) || step.audio || step.end || step.divert != null;
+      const hasAct = step.actions && step.actions.length;
+      return !(hasText || hasUI || hasAct);
+    }
+    function firstChildStitch(knotId){
+      const prefix = knotId + '.';
+      if (compact){
+        const kids = (scenario.knots || {})[knotId] || [];
+        const st = kids.find(i => ids[i] === prefix + 'start');
+        return st !== undefined ? st : (kids.length ? kids[0] : null);
+      }
+      if (steps[prefix + 'start']) return prefix + 'start';
+      // индекс узел → стежки из компилятора: O(1) вместо поиска по order
+      if (scenario.knots){
+        const kids = scenario.knots[knotId];
+        return (kids && kids.length) ? kids[0] : null;
+      }
+      if (Array.isArray(scenario.order)){
+        const idx = scenario.order.indexOf(knotId);
+        if (idx >= 0){
+          for (let j = idx + 1; j < scenario.order.length; j++){
+            const id = scenario.order[j];
+            if (id && id.startsWith(prefix)) return id;
+            if (id && !id.includes('.')) break;
+          }
+        }
+      }
+      const list = Object.keys(steps).filter(k => k.startsWith(prefix)).sort();
+      return list.length ? list[0] : null;
+    }
+    function applyDivert(divert){
+      if (divert == null || divert === '') return null;
+      if (divert === 'END' || divert === 'DONE') return '__END__';
+      return divert;
+    }
+    function pushNpc(speaker, text){
+      if (!text || !String(text).trim()) return;
+      const spk = (speaker && speaker !== 'system') ? speaker : 'Система';
+      transcript.push({role:'npc', speaker: spk, text: String(text).trim()});
+    }
+    function pushUser(text){
+      if (!text || !String(text).trim()) return;
+      transcript.push({role:'user', speaker:'Вы', text: String(text).trim()});
+    }
+
+    const elTitle = document.getElementById('title');
+    const elMeta  = document.getElementById('meta');
+    const elSpk   = document.getElementById('speaker');
+    const elText  = document.getElementById('text');
+    const elAudio = document.getElementById('audio');
+    const elOpts  = document.getElementById('opts');
+    const elEnd   = document.getElementById('end');
+    const elChipSt= document.getElementById('chipState');
+    const elTranscript = document.getElementById('transcript');
+    const elQAList = document.getElementById('qaList');
+    const elSys   = document.getElementById('syslog');
+    function log(msg){ if (elSys) elSys.textContent = msg; }
+
+    const elQAMore = document.getElementById('qaMore');
+    let transcriptNodes = 0;
+
+    // добавляет только новые реплики; старые узлы сверх TRANSCRIPT_VIEW удаляются
+    function renderTranscript(){
+      elTranscript.style.display = transcript.length ? 'block' : 'none';
+      for (; transcriptShown < transcript.length; transcriptShown++){
+        const m = transcript[transcriptShown];
+        const box = document.createElement('div'); box.className = 'msg ' + (m.role === 'user' ? 'user' : 'npc');
+        const hdr = document.createElement('div'); hdr.className = 'hdr'; hdr.textContent = m.speaker;
+        const txt = document.createElement('div'); txt.className = 'txt'; txt.textContent = m.text;
+        box.appendChild(hdr); box.appendChild(txt);
+        elQAList.appendChild(box);
+        transcriptNodes++;
+      }
+      while (transcriptNodes > TRANSCRIPT_VIEW){
+        elQAList.removeChild(elQAList.firstChild);
+        transcriptNodes--;
+      }
+      const hidden = transcript.length - transcriptNodes;
+      if (elQAMore) elQAMore.textContent = hidden ? ('… скрыто ранних реплик: ' + hidden) : '';
+    }
 
-  function render(stepId){
-    try {
-      if (!stepId) stepId = 'start';
-      const step = steps[stepId];
-      if (!step){ elText.textContent = '❌ Нет шага: ' + stepId; return; }
+    function pushHistory(stepId){
       history.push(stepId);
+      historyTotal++;
+      if (history.length > 2 * HISTORY_VIEW) history.splice(0, history.length - HISTORY_VIEW);
+    }
+    function historyText(){
+      const tail = history.slice(-HISTORY_VIEW);
+      const skipped = historyTotal - tail.length;
+      return 'История: ' + (skipped ? '… (+' + skipped + ') → ' : '') + tail.join(' → ');
+    }
 
-      runActions(step.actions);
+    function render(ref){
+      try {
+        if (ref == null || ref === '') ref = 'start';
+        const stepId = idOf(ref);
+        const step = stepAt(ref);
+        if (!step){ elText.textContent = '❌ Нет шага: ' + stepId; return; }
+        pushHistory(stepId);
 
-      elTitle.textContent = scenario.title || (scenario.scenario_id || 'Scenario');
-      elMeta.textContent  = 'Шаг: ' + stepId;
+        runActions(step.actions);
 
-      const speaker = step.speaker || 'system';
-      elSpk.textContent = speaker;
+        elTitle.textContent = scenario.title || (scenario.scenario_id || 'Scenario');
+        elMeta.textContent  = 'Шаг: ' + stepId;
 
-      const raw = step.text_raw || step.text || '';
-      const renderedText = renderInline(raw);
-      elText.innerHTML  = renderedText;
-      if (!loggedSteps.has(stepId)) { pushNpc(speaker, elText.textContent || ''); loggedSteps.add(stepId); }
+        const speaker = step.speaker || 'system';
+        elSpk.textContent = speaker;
 
-      elAudio.innerHTML = '';
-      if (step.audio){
-        const audio = document.createElement('audio');
-        audio.controls = true;
-        audio.src = step.audio;
-        elAudio.appendChild(audio);
-      }
+        const raw = step.text_raw || step.text || '';
+        const renderedText = step.tpl ? renderTpl(step.tpl) : renderInline(raw);
+        elText.innerHTML  = renderedText;
+        if (!loggedSteps.has(stepId)) { pushNpc(speaker, elText.textContent || ''); loggedSteps.add(stepId); }
 
-      elOpts.innerHTML = '';
-      let options = step.options || [];
-      options = options.filter(opt => opt.repeatable || !chosen.has(opt.id));
-
-      if (options.length){
-        options.forEach((opt, idx)=>{
-          const btn = document.createElement('button');
-          btn.className = 'btn';
-          btn.textContent = opt.text || ('Вариант ' + (idx+1));
-          btn.onclick = ()=>{
-            if (opt.id) chosen.add(opt.id);
-            pushUser(opt.text || ('Вариант ' + (idx+1)));
-            if (opt.next === 'END' || opt.next === 'DONE'){
-              elEnd.textContent = 'Сценарий завершён';
-              renderTranscript();
-              elOpts.innerHTML = '';
-              return;
-            }
-            render(opt.next || stepId);
-          };
-          elOpts.appendChild(btn);
-        });
-        elEnd.textContent = '';
-      } else {
-        // empty node? autostitch into first child
-        if (isEmptyStep(step)){
-          const child = firstChildStitch(stepId);
-          if (child){ render(child); return; }
+        elAudio.innerHTML = '';
+        if (step.audio){
+          const audio = document.createElement('audio');
+          audio.controls = true;
+          audio.src = step.audio;
+          elAudio.appendChild(audio);
         }
-        const target = applyDivert(step.divert);
-        if (target === '__END__' || step.end){
-          elEnd.textContent = 'Сценарий завершён';
-          renderTranscript();
-        } else if (target){
-          const btn = document.createElement('button');
-          btn.className = 'btn';
-          btn.textContent = 'Далее';
-          btn.onclick = ()=> render(target);
-          elOpts.appendChild(btn);
+
+        elOpts.innerHTML = '';
+        let options = step.options || [];
+        options = options.filter(opt => opt.repeatable || !chosen.has(opt.id));
+
+        if (options.length){
+          options.forEach((opt, idx)=>{
+            const btn = document.createElement('button');
+            btn.className = 'btn';
+            btn.textContent = opt.text || ('Вариант ' + (idx+1));
+            btn.onclick = ()=>{
+              if (opt.id) chosen.add(opt.id);
+              pushUser(opt.text || ('Вариант ' + (idx+1)));
+              if (opt.next === 'END' || opt.next === 'DONE'){
+                elEnd.textContent = 'Сценарий завершён';
+                renderTranscript();
+                elOpts.innerHTML = '';
+                return;
+              }
+              go(opt.next != null ? opt.next : ref);
+            };
+            elOpts.appendChild(btn);
+          });
           elEnd.textContent = '';
         } else {
-          elEnd.textContent = 'Нет вариантов. Конец.';
-          renderTranscript();
+          // empty node? autostitch into first child
+          if (isEmptyStep(step)){
+            const child = firstChildStitch(stepId);
+            if (child != null){ go(child); return; }
+          }
+          const target = applyDivert(step.divert);
+          if (target === '__END__' || step.end){
+            elEnd.textContent = 'Сценарий завершён';
+            renderTranscript();
+          } else if (target !== null){
+            const btn = document.createElement('button');
+            btn.className = 'btn';
+            btn.textContent = 'Далее';
+            btn.onclick = ()=> go(target);
+            elOpts.appendChild(btn);
+            elEnd.textContent = '';
+          } else {
+            elEnd.textContent = 'Нет вариантов. Конец.';
+            renderTranscript();
+          }
         }
-      }
 
-      elChipSt.textContent = 'История: ' + history.join(' → ');
-    } catch(e){
-      showFatal('Сбой при рендере: ' + (e && e.message ? e.message : e));
-      return;
+        elChipSt.textContent = historyText();
+        prefetch((step.options || []).map(o => o.next).concat([step.divert]));
+      } catch(e){
+        showFatal('Сбой при рендере: ' + (e && e.message ? e.message : e));
+        return;
+      }
     }
-  }
 
-  const entry = (steps['start'] && isEmptyStep(steps['start'])) ? (firstChildStitch('start') || 'start') : 'start';
-  render(entry);
+    const first = stepAt('start');
+    const child = (first && isEmptyStep(first)) ? firstChildStitch('start') : null;
+    go(child != null ? child : 'start');
+  }
 })();"""
 
-    transcript_html = r"""
+_TRANSCRIPT_HTML = r"""
   <div class="transcript" id="transcript" style="display:none">
     <h2>История диалога</h2>
+    <div class="sys" id="qaMore"></div>
     <div id="qaList"></div>
   </div>
 """
 
-    html = f"""<!DOCTYPE html>
+_MARK = "\0scenario-payload\0"  # место JSON в шаблоне; в CSS/JS такого нет
+
+_HTML = f"""<!DOCTYPE html>
 <html lang="ru">
 <head>
 <meta charset="utf-8"/>
 <meta name="viewport" content="width=device-width, initial-scale=1"/>
 <title>Scenario Player</title>
-<style>{css}</style>
+<style>{_CSS}</style>
 </head>
 <body>
 <div class="wrap">
@@ -306,11 +501,234 @@ def build_html_player(data: dict) -> str:
     <div class="sys" id="syslog"></div>
   </div>
 
-  {transcript_html}
+  {_TRANSCRIPT_HTML}
 </div>
 
-<script id="scenario-data" type="application/json">{payload}</script>
-<script>{js}</script>
+<script id="scenario-data" type="application/json">{_MARK}</script>
+<script>{_JS}</script>
 </body>
 </html>"""
-    return html
+
+
+def _minify(text: str) -> str:
+    """Убрать отступы, пустые строки и строки-комментарии '//' (переводы строк сохраняются ради ASI)."""
+    out = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("//"):
+            out.append(line)
+    return "\n".join(out)
+
+
+@functools.lru_cache(maxsize=None)
+def player_assets(minify: bool = False) -> Dict[str, Tuple[str, bytes]]:
+    """Рантайм плеера как отдельные файлы: {"css": (имя, байты), "js": (имя, байты)}.
+
+    Имя содержит хэш содержимого (player.<hash>.css), поэтому его можно кэшировать навсегда.
+    """
+    out = {}
+    for kind, text in (("css", _CSS), ("js", _JS)):
+        blob = (_minify(text) if minify else text).encode("utf-8")
+        out[kind] = (f"player.{hashlib.sha256(blob).hexdigest()[:12]}.{kind}", blob)
+    return out
+
+
+def write_player_assets(out_dir: Union[str, pathlib.Path], minify: bool = False) -> Dict[str, str]:
+    """Записать player.<hash>.css/.js в out_dir (если таких ещё нет). Возвращает {"css": имя, "js": имя}."""
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    names = {}
+    for kind, (name, blob) in player_assets(minify).items():
+        path = out_dir / name
+        if not path.exists():
+            tmp = path.with_name(f".{name}.{os.getpid()}.tmp")
+            tmp.write_bytes(blob)
+            os.replace(tmp, path)  # одно и то же содержимое: гонка процессов безопасна
+        names[kind] = name
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def _shell(minify: bool = False, assets: Optional[str] = None) -> Tuple[str, str, bytes, bytes]:
+    """Префикс и суффикс оболочки — строками и в UTF-8; собираются при первом вызове."""
+    html = _HTML
+    if minify:
+        html = html.replace(_TRANSCRIPT_HTML, _minify(_TRANSCRIPT_HTML))
+    if assets is None:
+        if minify:
+            html = html.replace(_CSS, _minify(_CSS)).replace(_JS, _minify(_JS))
+    else:
+        files = player_assets(minify)
+        html = html.replace(f"<style>{_CSS}</style>",
+                            f'<link rel="stylesheet" href="{assets}{files["css"][0]}"/>')
+        html = html.replace(f"<script>{_JS}</script>", f'<script src="{assets}{files["js"][0]}"></script>')
+    prefix, suffix = html.split(_MARK)
+    return prefix, suffix, prefix.encode("utf-8"), suffix.encode("utf-8")
+
+
+def _escape(chunk: str) -> str:
+    # JSON внутри <script>: "</script>" и "<!--" не должны встретиться в тексте как есть.
+    # '<' бывает только внутри строк JSON, где "\/" и "\u0021" — допустимые экранирования.
+    if "<" not in chunk:
+        return chunk
+    return chunk.replace("</", "<\\/").replace("<!--", "<\\u0021--")
+
+
+def _payload(data: dict, compact: bool) -> dict:
+    return to_compact(data) if compact else data
+
+
+# ====== сценарий по узлам ======
+CHUNK_MODES = ("inline", "files")
+
+
+def split_knot_chunks(data: dict) -> Tuple[dict, Dict[str, list]]:
+    """Разделить ink-json/v3 на индекс и шаги по узлам (узел шага — часть id до точки).
+
+    Шаги узла start остаются в индексе, чтобы первый экран не ждал загрузки.
+    Индекс содержит всё, кроме шагов, и knots (узел → стежки) для входа в пустой узел.
+    """
+    chunks: Dict[str, list] = {}
+    for step in data.get("steps", []):
+        chunks.setdefault(step["id"].split(".", 1)[0], []).append(step)
+    index = {k: v for k, v in data.items() if k != "steps"}
+    if "knots" not in index:
+        index["knots"] = {k: [s["id"] for s in v if "." in s["id"]] for k, v in chunks.items()}
+    index["steps"] = chunks.pop("start", [])
+    return index, chunks
+
+
+def write_knot_chunks(chunks: Dict[str, list], out_dir: Union[str, pathlib.Path]) -> None:
+    """Записать шаги узлов как out_dir/<узел>.json (для chunks="files")."""
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for knot, steps in chunks.items():
+        (out_dir / f"{knot}.json").write_text(
+            json.dumps(steps, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+
+
+def _chunked(data: dict, compact: bool, chunks: str, chunk_base: str, prefetch: bool):
+    if chunks not in CHUNK_MODES:
+        raise ValueError(f"chunks must be one of {CHUNK_MODES}, got {chunks!r}")
+    if compact:
+        raise ValueError("chunks and compact=True cannot be combined: compact ids are global")
+    index, parts = split_knot_chunks(data)
+    index["chunks"] = {"mode": chunks, "base": chunk_base, "knots": sorted(parts), "prefetch": prefetch}
+    return index, parts
+
+
+def _lazy_block(knot: str, steps: list) -> str:
+    body = _escape(json.dumps(steps, ensure_ascii=False, separators=(",", ":")))
+    return f'<script type="application/json" id="knot-{knot}">{body}</script>\n'
+
+
+_CLOSE_DATA = "</script>\n"  # суффикс оболочки начинается с закрытия блока данных
+
+
+# ====== сжатая полезная нагрузка ======
+_OPEN_DATA = '<script id="scenario-data" type="application/json">'
+
+
+def pack_payload(text: str) -> Tuple[str, Dict[str, Any]]:
+    """gzip + base64 от JSON-текста и размеры: raw_bytes, packed_bytes, ratio (packed / raw).
+
+    mtime=0 — одинаковый вход даёт одинаковую страницу (кэш, хэши в сборке).
+    """
+    raw = text.encode("utf-8")
+    packed = base64.b64encode(gzip.compress(raw, compresslevel=9, mtime=0)).decode("ascii")
+    return packed, {"raw_bytes": len(raw), "packed_bytes": len(packed),
+                    "ratio": round(len(packed) / max(len(raw), 1), 4)}
+
+
+def _packed_prefix(prefix: str, fallback: Optional[str]) -> str:
+    # base64 не содержит '<', поэтому _escape не нужен; type не json — браузер не тронет блок
+    assert prefix.endswith(_OPEN_DATA)
+    attrs = "" if not fallback else f' data-fallback="{_html.escape(fallback, quote=True)}"'
+    return (prefix[:-len(_OPEN_DATA)]
+            + f'<script id="scenario-data" type="application/octet-stream" data-encoding="gzip+base64"{attrs}>')
+
+
+def _tail(suffix: str, chunks: Optional[str], parts: Optional[Dict[str, list]]):
+    """Всё после полезной нагрузки: ленивые блоки узлов (chunks="inline") и суффикс оболочки."""
+    if parts is None:
+        yield suffix
+        return
+    yield _CLOSE_DATA
+    if chunks == "inline":
+        for knot, steps in parts.items():
+            yield _lazy_block(knot, steps)
+    yield suffix[len(_CLOSE_DATA):]
+
+
+def build_html_player(data: dict, compact: bool = False, minify: bool = False,
+                      assets: Optional[str] = None, chunks: Optional[str] = None,
+                      chunk_base: str = "", prefetch: bool = False, compress: bool = False,
+                      fallback: Optional[str] = None, stats: Optional[Dict[str, Any]] = None) -> str:
+    """Return a self-contained HTML player for Ink JSON (our simplified schema).
+
+    compact=True embeds the scenario as ink-json/v4-compact (see ink_compact.py): smaller payload,
+    faster JSON.parse; the player reads both formats. minify=True strips indentation and
+    comment lines from the shell. assets="<url prefix>" returns a thin page that links
+    player.<hash>.css/.js under that prefix instead of inlining them (see write_player_assets;
+    "" means next to the page).
+
+    chunks splits steps by knot and the player loads a knot on first entry:
+    "inline" — lazy <script type="application/json"> blocks parsed on demand;
+    "files" — <chunk_base><knot>.json fetched on demand (write them with
+    split_knot_chunks + write_knot_chunks; needs http, not file://).
+    prefetch=True loads the knots of the current options in the background.
+
+    compress=True embeds the payload as gzip + base64, unpacked with DecompressionStream.
+    Browsers without it fetch the plain JSON from fallback (a URL relative to the page,
+    e.g. the scenario .json written next to it); with no fallback they show an error.
+    If stats is a dict, the payload sizes from pack_payload are stored in it.
+    """
+    prefix, suffix, _, _ = _shell(minify, assets)
+    if chunks is None:
+        payload, parts = _payload(data, compact), None
+    else:
+        payload, parts = _chunked(data, compact, chunks, chunk_base, prefetch)
+    text = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    if compress:
+        body, sizes = pack_payload(text)
+        prefix = _packed_prefix(prefix, fallback)
+        if stats is not None:
+            stats.update(sizes)
+    else:
+        body = _escape(text)
+    return prefix + body + "".join(_tail(suffix, chunks, parts))
+
+
+def write_html_player(data: dict, out: Union[IO[bytes], IO[str]], compact: bool = False,
+                      minify: bool = False, assets: Optional[str] = None, chunks: Optional[str] = None,
+                      chunk_base: str = "", prefetch: bool = False, compress: bool = False,
+                      fallback: Optional[str] = None, stats: Optional[Dict[str, Any]] = None) -> None:
+    """Same page as build_html_player, written to a file object piece by piece.
+
+    The JSON is streamed with iterencode, so the whole HTML string is never built in memory
+    (except with compress=True, which needs the whole JSON text to gzip it).
+    Text files get str, anything else gets UTF-8 bytes.
+    """
+    prefix, suffix, bprefix, bsuffix = _shell(minify, assets)
+    text = isinstance(out, io.TextIOBase)
+    write = out.write if text else (lambda piece: out.write(piece.encode("utf-8")))
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    if chunks is None:
+        payload, parts = _payload(data, compact), None
+    else:
+        payload, parts = _chunked(data, compact, chunks, chunk_base, prefetch)
+    if compress:
+        body, sizes = pack_payload(encoder.encode(payload))
+        write(_packed_prefix(prefix, fallback))
+        write(body)
+        if stats is not None:
+            stats.update(sizes)
+    else:
+        out.write(prefix if text else bprefix)
+        for piece in encoder.iterencode(payload):
+            write(_escape(piece))
+    if parts is None:
+        out.write(suffix if text else bsuffix)
+        return
+    for piece in _tail(suffix, chunks, parts):
+        write(piece)
@@ -0,0 +1,91 @@
+# test_analytics.py — ink_analytics против прямого расчёта через N = (I - Q)^-1.
+#
+#   python -m pytest -q test_analytics.py
+#   python test_analytics.py
+
+import random
+
+import numpy as np
+
+import ink_analytics as ia
+from ink_to_json import parse_ink_to_json
+
+VALID = parse_ink_to_json(open("valid.ink", encoding="utf-8").read())
+
+
+def _random_scenario(n: int, seed: int) -> dict:
+    """Случайный граф с циклами и без ловушек: у каждого шага с вариантами есть выход в END,
+    а переходы без вариантов идут только вперёд (или в END / в никуда)."""
+    rnd = random.Random(seed)
+    ids = ["start"] + [f"s{i}" for i in range(1, n)]
+    steps = []
+    for i, sid in enumerate(ids):
+        step = {"id": sid, "speaker": "A", "text": sid}
+        if rnd.random() < 0.8 or i == n - 1:
+            opts = [rnd.choice(ids) for _ in range(rnd.randint(1, 4))] + ["END"]
+            if rnd.random() < 0.1:
+                opts.append("nowhere")  # MISSING
+            step["options"] = [{"id": f"{sid}_{j}", "text": t, "next": t} for j, t in enumerate(opts)]
+        elif rnd.random() < 0.7:
+            step["divert"] = rnd.choice(ids[i + 1:])
+        steps.append(step)  # иначе — тупик (DEAD_END)
+    return {"steps": steps}
+
+
+def _brute(chain: ia.ScenarioChain):
+    n = chain.n
+    P = chain.transition_matrix()
+    N = np.linalg.inv(np.eye(n) - P[:n, :n])
+    probs = N @ P[:n, n:]
+    h = probs[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        to_end = np.where(h > 0, (N @ h) / h, np.nan)
+    return probs, N.sum(axis=1), to_end, N[chain.entry]
+
+
+def _check(data: dict, weights=None) -> None:
+    chain = ia.ScenarioChain(data, weights)
+    assert not chain.closed.any()
+    probs, steps, to_end, visits = _brute(chain)
+    ab = ia.absorption(chain)
+    np.testing.assert_allclose(ab["probs"], probs, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(ab["steps"], steps, rtol=1e-9)
+    np.testing.assert_allclose(ab["steps_to_end"], to_end, rtol=1e-9)
+    np.testing.assert_allclose(ia.visit_frequencies(chain), visits, rtol=1e-9, atol=1e-12)
+
+
+def test_valid_ink():
+    _check(VALID)
+    weights = {s["id"]: list(range(1, len(s["options"]) + 1)) for s in VALID["steps"] if s.get("options")}
+    _check(VALID, weights)
+
+
+def test_random_graphs():
+    for seed in range(20):
+        _check(_random_scenario(60, seed))
+
+
+def test_large_component():
+    # компонента больше DENSE_MAX — разреженное LU (с SciPy)
+    data = _random_scenario(3 * ia.DENSE_MAX, 1)
+    assert ia.ScenarioChain(data).comp_size.max() > ia.DENSE_MAX
+    _check(data)
+
+
+def test_without_scipy():
+    # без SciPy компоненты решаются np.linalg.solve по самой матрице
+    saved = ia.lu_factor, ia.splu
+    ia.lu_factor = ia.splu = None
+    try:
+        for seed in range(5):
+            _check(_random_scenario(60, seed))
+        _check(_random_scenario(3 * ia.DENSE_MAX, 1))
+    finally:
+        ia.lu_factor, ia.splu = saved
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+            print("ok", name)
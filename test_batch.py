@@ -0,0 +1,40 @@
+# test_batch.py — ink_batch: упавший рабочий процесс валит только свой файл, не весь пакет.
+#
+#   python -m pytest -q test_batch.py
+#   python test_batch.py
+
+import os
+
+from ink_batch import _pool_map, validate_many, validate_one
+
+VALID = open("valid.ink", encoding="utf-8").read()
+
+
+def _crash_on(label, text, max_errors=None):
+    if label == "<crash>":
+        os._exit(3)  # как OOM-killer: процесс исчез, пул сломан
+    return validate_one(label, text, max_errors)
+
+
+def test_dead_worker_fails_only_its_job():
+    jobs = [(f"<text {i}>", VALID) for i in range(9)]
+    jobs.insert(4, ("<crash>", VALID))
+    for workers in (1, 2):
+        res = dict(_pool_map(_crash_on, jobs, workers))
+        assert sorted(res) == list(range(len(jobs)))
+        broken = [i for i, r in res.items() if isinstance(r, BaseException)]
+        assert broken == [4] and type(res[4]).__name__ == "BrokenProcessPool"
+        assert all(res[i]["status"] == "ok" for i in res if i != 4)
+
+
+def test_validate_many_rows():
+    rows = list(validate_many([VALID, "=== start ===\n-> nowhere\n"], workers=2))
+    assert sorted(r["source"] for r in rows) == ["<text 0>", "<text 1>"]
+    assert {r["source"]: r["status"] for r in rows} == {"<text 0>": "ok", "<text 1>": "invalid"}
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+            print("ok", name)
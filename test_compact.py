@@ -0,0 +1,35 @@
+# test_compact.py — ink-json/v3 → v4-compact → v3 без потерь.
+#
+#   python -m pytest -q test_compact.py
+#   python test_compact.py
+
+from ink_compact import from_compact, to_compact
+from ink_runtime import ScenarioRunner
+from ink_to_json import parse_ink_to_json
+
+
+def test_valid_ink_round_trip():
+    data = parse_ink_to_json(open("valid.ink", encoding="utf-8").read())
+    assert from_compact(to_compact(data)) == data
+
+
+def test_text_without_text_raw():
+    # шаг без text_raw не должен получить ни text_raw: None, ни выведенный "speaker: text"
+    steps = [
+        {"id": "start", "speaker": "A", "text": "привет", "divert": "b"},
+        {"id": "b", "text": "без говорящего", "divert": "END"},
+        {"id": "c", "speaker": "B", "text": "q", "text_raw": "B: q"},
+        {"id": "d", "text_raw": "только raw"},
+    ]
+    compact = to_compact({"steps": steps})
+    assert all(rec.get("r", "") is not None for rec in compact["steps"])
+    assert from_compact(compact)["steps"] == steps
+    texts = [ScenarioRunner(d, auto_continue=False).start().text for d in (compact, {"steps": steps})]
+    assert texts == ["привет", "привет"]
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+            print("ok", name)
@@ -0,0 +1,145 @@
+# test_gpt5_pipeline.py — цикл генерации (gpt5_ink, gpt5_batch) против локального стаба gpt5_stub:
+# без потока и с потоком, обрыв на фатальной ошибке и повтор из кэша, упавший процесс пула.
+#
+#   python -m pytest -q test_gpt5_pipeline.py
+#   python test_gpt5_pipeline.py
+
+import asyncio
+import json
+import os
+import pathlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+pytest.importorskip("openai")
+from openai import OpenAI
+
+import gpt5_ink as gi
+from gpt5_batch import BatchGenerator, run_batch
+from gpt5_cache import ResponseCache
+from gpt5_stub import Fixtures, StubServer
+
+gi.DEBUG = False
+FIXTURES = Fixtures.load("fixtures/gpt5_replay.json")
+CORPUS = FIXTURES.corpus()
+DOTTED = dict(CORPUS)["cafe-dotted"]  # в потоке обрывается дважды: точка в имени узла, вариант без цели
+
+
+def _ask(srv, brief, cache, stream):
+    client = None if srv is None else OpenAI(api_key="stub", base_url=srv.base_url, max_retries=0)
+    stats = {}
+    out = gi.ask_gpt_ink(brief, cache=cache, client=client, out_html=None, stats=stats, stream=stream)
+    return out, stats
+
+
+def _tokens(stats):
+    return [(rd["prompt"], rd["completion"]) for rd in stats["rounds"]]
+
+
+def test_stream_matches_plain():
+    with StubServer(FIXTURES) as srv:
+        for bid, brief in CORPUS:
+            plain, ps = _ask(srv, brief, ResponseCache(mode="off"), False)
+            streamed, ss = _ask(srv, brief, ResponseCache(mode="off"), True)
+            assert ss["status"] == ps["status"]
+            if ps["status"] == "ok":
+                assert streamed == plain
+            if bid == "cafe-dotted":
+                assert [rd.get("aborted", False) for rd in ss["rounds"]] == [True, True, False]
+
+
+def test_stream_abort_then_replay():
+    with tempfile.TemporaryDirectory() as tmp, StubServer(FIXTURES) as srv:
+        first, fs = _ask(srv, DOTTED, ResponseCache(tmp, mode="rw"), True)
+        calls = srv.calls
+        # потоковый replay повторяет оба обрыва без сети
+        again, rs = _ask(None, DOTTED, ResponseCache(tmp, mode="replay"), True)
+        assert again == first and rs["rounds_to_green"] == fs["rounds_to_green"] == 3
+        assert [rd.get("aborted", False) for rd in rs["rounds"]] == [True, True, False]
+        # прогон без потока не получает оборванный кусок вместо ответа: идёт в API за полным
+        # (у куска нет usage — раунды совпали бы по тексту, но не по токенам)
+        plain, ps = _ask(srv, DOTTED, ResponseCache(tmp, mode="rw"), False)
+        fresh, fresh_stats = _ask(srv, DOTTED, ResponseCache(mode="off"), False)
+        assert srv.calls > calls
+        assert plain == fresh and _tokens(ps) == _tokens(fresh_stats)
+
+
+def _batch(out, srv, cache, stream):
+    return asyncio.run(run_batch(CORPUS, pathlib.Path(out), workers=1, cache=cache, stream=stream,
+                                 base_url=None if srv is None else srv.base_url))
+
+
+def test_batch_stream_and_replay():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = f"{tmp}/cache"
+        with StubServer(FIXTURES) as srv:
+            plain = _batch(f"{tmp}/plain", srv, None, False)
+            live = _batch(f"{tmp}/live", srv, ResponseCache(cache_dir, mode="rw"), True)
+            calls = srv.calls
+        assert live["aborted"] == 2 and plain["aborted"] == 0
+        for k in ("ok", "no_tool", "failed", "exhausted"):
+            assert live[k] == plain[k]
+        replay = _batch(f"{tmp}/replay", None, ResponseCache(cache_dir, mode="replay"), True)
+        assert srv.calls == calls
+        assert replay["aborted"] == 2 and replay["failed"] == 0 and replay["ok"] == live["ok"]
+        assert replay["cached"] == replay["rounds"] - replay["aborted"]
+        for name in ("cafe-dotted.ink", "cafe-long.json"):
+            assert pathlib.Path(tmp, "replay", name).read_bytes() == pathlib.Path(tmp, "live", name).read_bytes()
+        # replay без потока: полного ответа на первый раунд cafe-dotted никто не получал — промах сразу
+        _batch(f"{tmp}/plain-replay", None, ResponseCache(cache_dir, mode="replay"), False)
+        rows = [json.loads(line) for line in open(f"{tmp}/plain-replay/results.jsonl", encoding="utf-8")]
+        dotted = next(r for r in rows if r["id"] == "cafe-dotted")
+        assert dotted["status"] == "failed" and dotted["rounds"] == 1 and "CacheMiss" in dotted["error"]
+
+
+class _Aborted:
+    """Оборванный раунд с одной фатальной ошибкой (как StreamWatcher.aborted_turn)."""
+
+    def aborted_turn(self):
+        reply = {"role": "assistant", "content": None, "tool_calls": [{
+            "id": "c1", "type": "function", "function": {"name": "validate_ink", "arguments": "{}"}}]}
+        report = {"ok": False, "aborted": True, "errors": [{"code": "BAD_KNOT", "sym": "a.b"}], "note": "..."}
+        return reply, [{"role": "tool", "tool_call_id": "c1", "content": json.dumps(report)}]
+
+
+def test_aborted_errors_reach_delta():
+    dialog = gi.InkDialog("бриф")
+    dialog.aborted(_Aborted())
+    sent = json.loads(dialog.messages[-1]["content"])
+    assert sent["aborted"] and sent["errors"][0]["state"] == "new"
+    # следующий полный отчёт: та же ошибка — open, а пропавшая — fixed
+    dialog.report("c2", "validate_ink", {"ok": False, "errors": [{"code": "BAD_KNOT", "sym": "a.b"}]})
+    assert json.loads(dialog.tool_msgs[-1]["content"])["errors"][0]["state"] == "open"
+    dialog.report("c3", "validate_ink", {"ok": False, "errors": [{"code": "MISSING", "sym": "x"}]})
+    assert json.loads(dialog.tool_msgs[-1]["content"])["fixed"] == [{"code": "BAD_KNOT", "sym": "a.b"}]
+
+
+def _crash_on(ink):
+    if ink == "crash":
+        os._exit(3)  # рабочий процесс исчез — пул сломан у всех его заданий
+    return gi.tool_validate_ink(ink)["ok"]
+
+
+def test_batch_pool_survives_dead_worker():
+    valid = open("valid.ink", encoding="utf-8").read()
+
+    async def run(gen):
+        jobs = [gen._run(_crash_on, ink) for ink in [valid] * 3 + ["crash"] + [valid] * 3]
+        return await asyncio.gather(*jobs, return_exceptions=True)
+
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        gen = BatchGenerator(None, pool, workers=2)
+        res = asyncio.run(run(gen))
+        assert gen.pool is not pool
+        gen.pool.shutdown()
+    assert res[:3] + res[4:] == [True] * 6
+    assert type(res[3]).__name__ == "BrokenProcessPool"
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+            print("ok", name)
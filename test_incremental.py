@@ -0,0 +1,72 @@
+# test_incremental.py — InkSession должна давать то же, что parse_ink_to_json / validate_ink.
+#
+#   python -m pytest -q test_incremental.py
+#   python test_incremental.py
+
+import random
+
+from ink_incremental import InkSession, split_knots
+from ink_to_json import parse_ink_to_json
+from ink_validator import validate_ink
+
+VALID = open("valid.ink", encoding="utf-8").read()
+
+GLUED_HEADERS = [
+    # шапка приклеена к первому заголовку — это текст, первый узел начинается ниже
+    "Вступление <>\n=== start ===\nТекст\n-> next\n=== next ===\nКонец\n-> END\n",
+    "VAR x = 0\nшапка <>\n=== start ===\n+ a -> b\n=== b ===\nb <>\n=== c ===\n-> END\n",
+    # glue обрывается пустой строкой и строкой-комментарием
+    "шапка <>\n\n=== start ===\n-> END\n",
+    "шапка <>\n// комментарий\n=== start ===\n-> END\n",
+]
+
+
+def _same(session: InkSession, text: str) -> None:
+    assert session.compile(text) == parse_ink_to_json(text)
+    assert session.validate(text) == validate_ink(text)
+
+
+def test_glued_headers():
+    for text in GLUED_HEADERS:
+        _same(InkSession(), text)
+
+
+def test_glued_first_header_stays_with_preamble():
+    # "=== start ===" приклеен к шапке, поэтому первый настоящий узел — next, и он в одном куске с шапкой
+    assert [c.first_ln for c in split_knots(GLUED_HEADERS[0])] == [1]
+    # после пустой строки glue нет: start — первый узел, граница — перед вторым
+    assert [c.first_ln for c in split_knots("шапка <>\n\n=== start ===\n-> b\n=== b ===\n-> END\n")] == [1, 5]
+
+
+def test_valid_ink():
+    _same(InkSession(), VALID)
+
+
+def test_random_edit_rounds():
+    # правки как в цикле GPT, в том числе glue перед заголовками; сессия живёт между раундами
+    rnd = random.Random(5)
+    base = VALID.split("\n")
+    session = InkSession()
+    for _ in range(500):
+        lines = list(base)
+        for _ in range(rnd.randint(1, 3)):
+            i = rnd.randrange(len(lines))
+            op = rnd.random()
+            if op < 0.3:
+                lines[i] += " <>"
+            elif op < 0.5:
+                lines.insert(i, f"=== k{rnd.randint(0, 5)} ===")
+            elif op < 0.6:
+                lines.insert(0, "пролог <>")
+            elif op < 0.8:
+                del lines[i]
+            else:
+                lines.insert(i, "")
+        _same(session, "\n".join(lines))
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+            print("ok", name)
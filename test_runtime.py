@@ -0,0 +1,67 @@
+# test_runtime.py — ScenarioRunner на valid.ink: прохождения, v4-compact, байткод ~ set.
+#
+#   python -m pytest -q test_runtime.py
+#   python test_runtime.py
+
+import random
+
+import pytest
+
+from ink_compact import to_compact
+from ink_runtime import DEAD_END, END, Action, ScenarioRunner
+from ink_to_json import parse_ink_to_json
+
+DATA = parse_ink_to_json(open("valid.ink", encoding="utf-8").read())
+
+
+def test_leave():
+    run = ScenarioRunner(DATA).play(["Уйти"])
+    assert run.status == END
+    assert run.history == ["start", "leave.start"]
+    assert run.transcript[-1]["text"] == "Официант: До свидания!"
+
+
+def test_order_water():
+    runner = ScenarioRunner(DATA)
+    run = runner.play(["Двое", "Напитки"])
+    # opt_1 и opt_2 уже выбраны на прошлых шагах — плеер прячет «Чай» и «Кофе» (см. шапку ink_runtime)
+    assert run.options() == ["Вода", "Назад"]
+    run.choose("Вода")
+    assert run.history == ["start", "seat.two", "drinks.menu", "drinks.water"]
+    assert run.vars == {"drink": "вода", "food": "", "total": 30, "paid": False}
+    assert run.calls == [("play", '"ding"')]
+    assert run.status == DEAD_END
+    with pytest.raises(ValueError):
+        run.choose(0)
+
+
+def test_choices_by_index_and_text():
+    runner = ScenarioRunner(DATA)
+    assert runner.play([1, 0, 0]).result() == runner.play(["Двое", "Напитки", "Вода"]).result()
+
+
+def test_random_walks():
+    runner = ScenarioRunner(DATA)
+    compact = ScenarioRunner(to_compact(DATA))
+    step_ids = {s["id"] for s in DATA["steps"]}
+    for seed in range(300):
+        run = runner.random_walk(random.Random(seed))
+        assert run.status in (END, DEAD_END)
+        assert run.history[0] == "start" and set(run.history) <= step_ids
+        assert run.vars["total"] in (0, 30, 50, 70)
+        assert compact.random_walk(random.Random(seed)).result() == run.result()
+
+
+def test_action_prefers_bytecode():
+    # байткод из компилятора главнее текста, как act.code в плеере
+    act = Action({"type": "set", "var": "x", "expr": "1", "code": [["k", 2]]})
+    assert act.fn({}) == 2
+    assert Action({"type": "set", "var": "x", "expr": "x + 1"}).fn({"x": 1}) == 2
+    assert Action({"type": "set", "var": "x", "expr": "x +"}).error
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+            print("ok", name)
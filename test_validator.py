@@ -0,0 +1,49 @@
+# test_validator.py — граф валидатора должен вести туда же, куда компилятор (ink_to_json).
+#
+#   python -m pytest -q test_validator.py
+#   python test_validator.py
+
+from ink_incremental import InkSession
+from ink_to_json import parse_ink_to_json
+from ink_validator import validate_ink
+
+# стежок start.menu и отдельный узел menu: голое "-> menu" внутри start — это стежок
+SHADOWED_STITCH = """=== start ===
+Привет
+-> menu
+== menu ==
+Меню
+-> END
+
+=== menu ===
+Петля
+-> menu
+"""
+
+
+def test_stitch_before_knot():
+    report = validate_ink(SHADOWED_STITCH)
+    assert report["errors"] == []
+    assert report["graph"]["path_to_end"] == ["start", "start.menu"]
+    assert report["graph"]["unreachable"] == ["menu"]
+    assert InkSession().validate(SHADOWED_STITCH) == report
+
+    steps = {s["id"]: s for s in parse_ink_to_json(SHADOWED_STITCH)["steps"]}
+    assert steps["start"]["divert"] == "start.menu"
+    assert steps["start.menu"]["divert"] == "END"
+    assert steps["menu"]["divert"] == "menu"
+
+
+def test_dotted_fallback_to_knot():
+    # "x.menu" без такого стежка компилятор ведёт в узел menu — граф валидатора тоже
+    text = "=== start ===\n+ Дальше -> x.menu\n=== menu ===\n-> END\n"
+    report = validate_ink(text)
+    assert report["graph"]["path_to_end"] == ["start", "menu"]
+    assert parse_ink_to_json(text)["steps"][0]["options"][0]["next"] == "menu"
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            fn()
+            print("ok", name)